@@ -8,193 +8,340 @@
 # and related or neighboring rights to the source code in this file.
 # http://creativecommons.org/publicdomain/zero/1.0/
 
-import os, inspect, bitstring, itertools
-
-# def gen_vec(funcName, *vars):
-#     current_frame   = inspect.currentframe()
-#     caller_frame    = inspect.getouterframes(current_frame)[1]
-#     local_vars      = caller_frame.frame.f_locals
-#     for var in vars:
-#         for name, value in local_vars.items():
-#             if value is var:
-#                 print(f'{name:20}: {var}')
-#                 os.system(f'mkdir -p ./vec/{funcName}')
-#                 with open(f'./vec/{funcName}/{name}.vec', 'a') as fh:
-#                     fh.write(hex(var).replace('0x','').rjust(1184,'0')+'\n')
-   
-def genvec(funcName, dict, bitwidth):
-    # bitwidth = bytelen *2 (since hex)
-    for key, value in dict.items():
-        print(f'{key:20}: {value}')
-        os.system(f'mkdir -p ./vec/{funcName}')
-        with open(f'./vec/{funcName}/{key}.vec', 'a') as fh:
-            fh.write(hex(value).replace('0x','').rjust(bitwidth,'0')+'\n')   
+import struct
+import numpy as np
+from tracing import get_trace_hook
+from vectors import vector_writer
 
 def ROL64(a, n):
     out =  ((a >> (64-(n%64))) + (a << (n%64))) % (1 << 64)
     return out
 
-def KeccakF1600onLanes(lanes):
-    i_lanes = list(itertools.chain(*lanes))
-    i_lanes = int(''.join(hex(x).replace('0x', '').rjust(16, '0') for x in i_lanes), 16)
+MASK64 = (1 << 64) - 1
+
+def KeccakTables():
+    """
+    Per lane index x+5y of the flat 25 lane state: the ρ offset and
+    the π destination, and the 24 ι round constants of the LFSR
+    """
+    rho, pi = [0]*25, [0]*25
+    (x, y) = (1, 0)
+    for t in range(24):
+        rho[x+5*y] = ((t+1)*(t+2)//2) % 64
+        (x, y) = (y, (2*x+3*y)%5)
+    for x in range(5):
+        for y in range(5):
+            pi[x+5*y] = y+5*((2*x+3*y)%5)
+    round_constants = []
     R = 1
     for round in range(24):
+        rc = 0
+        for j in range(7):
+            R = ((R << 1) ^ ((R >> 7)*0x71)) % 256
+            if (R & 2):
+                rc = rc ^ (1 << ((1<<j)-1))
+        round_constants.append(rc)
+    return rho, pi, round_constants
+
+RHO_OFFSETS, PI_LANES, ROUND_CONSTANTS = KeccakTables()
+# (source lane, ρ offset, 64 - ρ offset, θ column) of every lane after π
+RHO_PI = sorted((PI_LANES[i], i, RHO_OFFSETS[i], 64 - RHO_OFFSETS[i], i % 5) for i in range(25))
+RHO_PI = [source[1:] for source in RHO_PI]
+# (lane, lane x+1, lane x+2) of every lane for χ
+CHI = [(i, (i//5)*5 + (i+1)%5, (i//5)*5 + (i+2)%5) for i in range(25)]
+
+def KeccakF1600onLaneList(lanes):
+    """
+    Keccak-f[1600] on a flat list of 25 lanes, lane x+5y at index x+5y
+    """
+    A = lanes
+    for rc in ROUND_CONSTANTS:
         # θ
-        C = [lanes[x][0] ^ lanes[x][1] ^ lanes[x][2] ^ lanes[x][3] ^ lanes[x][4] for x in range(5)]
-        D = [C[(x+4)%5] ^ ROL64(C[(x+1)%5], 1) for x in range(5)]
-        lanes = [[lanes[x][y]^D[x] for y in range(5)] for x in range(5)]
+        C0 = A[0] ^ A[5] ^ A[10] ^ A[15] ^ A[20]
+        C1 = A[1] ^ A[6] ^ A[11] ^ A[16] ^ A[21]
+        C2 = A[2] ^ A[7] ^ A[12] ^ A[17] ^ A[22]
+        C3 = A[3] ^ A[8] ^ A[13] ^ A[18] ^ A[23]
+        C4 = A[4] ^ A[9] ^ A[14] ^ A[19] ^ A[24]
+        D = (C4 ^ (((C1 << 1) | (C1 >> 63)) & MASK64),
+             C0 ^ (((C2 << 1) | (C2 >> 63)) & MASK64),
+             C1 ^ (((C3 << 1) | (C3 >> 63)) & MASK64),
+             C2 ^ (((C4 << 1) | (C4 >> 63)) & MASK64),
+             C3 ^ (((C0 << 1) | (C0 >> 63)) & MASK64))
 
         # ρ and π
-        (x, y) = (1, 0)
-        current = lanes[x][y]
-        for t in range(24):
-            (x, y) = (y, (2*x+3*y)%5)
-            (current, lanes[x][y]) = (lanes[x][y], ROL64(current, (t+1)*(t+2)//2))
+        B = [(((a := A[i] ^ D[x]) << r) | (a >> l)) & MASK64 for i, r, l, x in RHO_PI]
 
         # χ
-        for y in range(5):
-            T = [lanes[x][y] for x in range(5)]
-            for x in range(5):
-                lanes[x][y] = T[x] ^((~T[(x+1)%5]) & T[(x+2)%5])
+        A = [B[i] ^ (~B[i1] & B[i2]) for i, i1, i2 in CHI]
 
         # ι
-        for j in range(7):
-            R = ((R << 1) ^ ((R >> 7)*0x71)) % 256
-            if (R & 2):
-                lanes[0][0] = lanes[0][0] ^ (1 << ((1<<j)-1))
+        A[0] = A[0] ^ rc
 
-    return lanes
+    return A
+
+def KeccakF1600onLanes(lanes):
+    flat = KeccakF1600onLaneList([lanes[x][y] for y in range(5) for x in range(5)])
+    return [[flat[x+5*y] for y in range(5)] for x in range(5)]
+
+# Lane index tables of KeccakF1600onLaneArrays
+THETA_NEXT = np.array([1, 2, 3, 4, 0]) # C[x+1]
+THETA_PREV = np.array([4, 0, 1, 2, 3]) # C[x-1]
+THETA_COLUMN = np.array([i % 5 for i in range(25)])
+PI_ORDER = np.array(PI_LANES)
+RHO_LEFT = np.array(RHO_OFFSETS, dtype=np.uint64)[:, None]
+RHO_RIGHT = ((64 - RHO_LEFT) % 64).astype(np.uint64) # Lane 0 has offset 0: a >> 0 | a << 0 = a
+CHI_NEXT = np.array([i1 for _, i1, _ in CHI])
+CHI_NEXT2 = np.array([i2 for _, _, i2 in CHI])
+ROUND_CONSTANTS_64 = np.array(ROUND_CONSTANTS, dtype=np.uint64)
+
+def KeccakF1600onLaneArrays(A):
+    """
+    Keccak-f[1600] on several states at once: A is a (25, B) uint64
+    array of the lanes x+5y of B states
+    """
+    one = np.uint64(1)
+    shift = np.uint64(63)
+    for rc in ROUND_CONSTANTS_64:
+        # θ
+        C = np.bitwise_xor.reduce(A.reshape(5, 5, -1), axis=0)
+        C1 = C[THETA_NEXT]
+        D = C[THETA_PREV] ^ ((C1 << one) | (C1 >> shift))
+        A = A ^ D[THETA_COLUMN]
+
+        # ρ and π
+        B = np.empty_like(A)
+        B[PI_ORDER] = (A << RHO_LEFT) | (A >> RHO_RIGHT)
+
+        # χ
+        A = B ^ (~B[CHI_NEXT] & B[CHI_NEXT2])
+
+        # ι
+        A[0] ^= rc
+
+    return A
 
 def load64(b):
-    out = sum((b[i] << (8*i)) for i in range(8))
-    #i_data = int.from_bytes(b)
-    #gen_vec('load64', i_data, out)
-    return out
+    return int.from_bytes(b[:8], "little")
 
 def store64(a):
-    out = list((a >> (8*i)) % 256 for i in range(8))
-    o_out = int(''.join(hex(x).replace('0x', '').rjust(2, '0') for x in out), 16)
-    #gen_vec('store64', a, o_out)
-    return out
+    return list(a.to_bytes(8, "little"))
 
-def KeccakF1600(state):
+LANES = struct.Struct("<25Q")
 
-    i_istate = int.from_bytes(state)
+def KeccakF1600(state):
 
-    lanes = [[load64(state[8*(x+5*y):8*(x+5*y)+8]) for y in range(5)] for x in range(5)]
-    lanes = KeccakF1600onLanes(lanes)
-    state = bytearray(200)
-    for x in range(5):
-        for y in range(5):
-            state[8*(x+5*y):8*(x+5*y)+8] = store64(lanes[x][y])
+    writer = vector_writer("keccakf1600")
+    if writer:
+        i_istate = int.from_bytes(state)
 
-    # # """for test"""
-    # o_ostate = int.from_bytes(state)
-    # print(f'[KeccakF1600] iState  : {hex(i_istate).replace("0x", "")}')
-    # print(f'[KeccakF1600] oState  : {hex(o_ostate).replace("0x", "")}')
+    lanes = KeccakF1600onLaneList(list(LANES.unpack(state)))
+    state = bytearray(LANES.pack(*lanes))
 
-    # vecDict = dict()
-    # vecDict['i_istate'] = i_istate
-    # vecDict['o_ostate'] = o_ostate
-    # genvec('keccakf1600', vecDict, 200*2)
+    if writer:
+        vecDict = dict()
+        vecDict['i_istate'] = i_istate
+        vecDict['o_ostate'] = int.from_bytes(state)
+        writer.write('keccakf1600', vecDict, 200*2)
 
     return state
 
+# HW modes by (rate, delimitedSuffix): name and i_mode of rtl/keccak.v
+KECCAK_MODES = {
+    (1344, 0x1F): ("SHAKE128", 0),
+    (1088, 0x1F): ("SHAKE256", 1),
+    (1088, 0x06): ("SHA3_256", 2),
+    (576,  0x06): ("SHA3_512", 3),
+}
+
+class KeccakSponge:
+    """
+    Incremental Keccak sponge: `absorb` any number of times, then
+    `squeeze` any number of bytes at a time (the first squeeze pads,
+    or call `finalize`). `copy` clones the sponge with its state, e.g.
+    to squeeze a stream twice. Cloning after a shared prefix only saves
+    permutations for prefixes of a block or more: the XOF inputs
+    rho || j || i of Kyber are 34 bytes, within one SHAKE128 block, so
+    the matrix expansion absorbs each input whole.
+
+    The "keccak" trace events follow the FSM of rtl/keccak.v: ABSB per
+    absorbed block and ABSB_K after its permutation, PADD_I/PADD/PADD_K
+    around the padding, SQUZ per squeezed block and SQUZ_K before the
+    permutation for the next one. IOBytes counts the bytes absorbed
+    and squeezed so far.
+    """
+    def __init__(self, rate, capacity, delimitedSuffix):
+        if rate + capacity != 1600 or rate % 8 != 0:
+            raise ValueError(f"Rate {rate} and capacity {capacity} must add up to 1600 bits")
+        self.rate = rate
+        self.capacity = capacity
+        self.delimitedSuffix = delimitedSuffix
+        self.rateInBytes = rate//8
+        self.mode, self.i_mode = KECCAK_MODES.get((rate, delimitedSuffix), (f"Keccak[r={rate}]", None))
+        self.state = bytearray(200)
+        self.blockSize = 0 # Bytes absorbed into / squeezed from the current block
+        self.inputLen = 0
+        self.outputLen = 0
+        self.squeezing = False
+
+        trace = get_trace_hook("keccak")
+        if trace:
+            trace("keccak", self.mode, Rate=self.rateInBytes)
+
+    def copy(self):
+        other = KeccakSponge.__new__(KeccakSponge)
+        other.__dict__.update(self.__dict__)
+        other.state = bytearray(self.state)
+        return other
+
+    def absorb(self, inputBytes):
+        if self.squeezing:
+            raise ValueError("Cannot absorb after the sponge was finalized")
+        trace = get_trace_hook("keccak")
+        inputOffset = 0
+        while(inputOffset < len(inputBytes)):
+            # HW-FETCH
+            size = min(len(inputBytes)-inputOffset, self.rateInBytes-self.blockSize)
+
+            # HW-ABSB
+            block = int.from_bytes(inputBytes[inputOffset:inputOffset+size], "little")
+            end = self.blockSize + size
+            self.state[self.blockSize:end] = (int.from_bytes(self.state[self.blockSize:end], "little") ^ block).to_bytes(size, "little")
+            self.blockSize = end
+            self.inputLen = self.inputLen + size
+            inputOffset = inputOffset + size
+            if trace:
+                trace("keccak", "ABSB", BlockSize=self.blockSize, IOBytes=f"{self.inputLen},{self.outputLen}", State=self.state.hex())
+
+            # HW-ABSB-KECCAK
+            if (self.blockSize == self.rateInBytes):
+                self.state = KeccakF1600(self.state)
+                if trace:
+                    trace("keccak", "ABSB_K", BlockSize=self.blockSize, IOBytes=f"{self.inputLen},{self.outputLen}", State=self.state.hex())
+                self.blockSize = 0
+        return self
+
+    def finalize(self):
+        """
+        Pad and switch to the squeezing phase, a no-op when squeezing
+        """
+        if self.squeezing:
+            return self
+        trace = get_trace_hook("keccak")
+        if trace:
+            trace("keccak", "PADD_I", BlockSize=self.blockSize, IOBytes=f"{self.inputLen},{self.outputLen}", State=self.state.hex())
+        self.state[self.blockSize] = self.state[self.blockSize] ^ self.delimitedSuffix
+
+        # This part is not needed for Kyber
+        # if (((delimitedSuffix & 0x80) != 0) and (blockSize == (rateInBytes-1))):
+        #    state = KeccakF1600(state)
+
+        self.state[self.rateInBytes-1] = self.state[self.rateInBytes-1] ^ 0x80
+        if trace:
+            trace("keccak", "PADD", BlockSize=self.blockSize, IOBytes=f"{self.inputLen},{self.outputLen}", State=self.state.hex())
+        self.state = KeccakF1600(self.state)
+        if trace:
+            trace("keccak", "PADD_K", BlockSize=self.blockSize, IOBytes=f"{self.inputLen},{self.outputLen}", State=self.state.hex())
+        self.blockSize = 0
+        self.squeezing = True
+        return self
+
+    def squeeze(self, outputByteLen):
+        """
+        The next `outputByteLen` bytes of the output stream
+        """
+        self.finalize()
+        trace = get_trace_hook("keccak")
+        outputBytes = []
+        while(outputByteLen > 0):
+            if (self.blockSize == self.rateInBytes):
+                if trace:
+                    trace("keccak", "SQUZ_K", BlockSize=self.blockSize, IOBytes=f"{self.inputLen},{self.outputLen}", State=self.state.hex())
+                self.state = KeccakF1600(self.state)
+                self.blockSize = 0
+            size = min(outputByteLen, self.rateInBytes-self.blockSize)
+            outputBytes.append(self.state[self.blockSize:self.blockSize+size])
+            self.blockSize = self.blockSize + size
+            self.outputLen = self.outputLen + size
+            outputByteLen = outputByteLen - size
+            if trace:
+                trace("keccak", "SQUZ", BlockSize=self.blockSize, IOBytes=f"{self.inputLen},{self.outputLen}", State=self.state.hex())
+        return b"".join(outputBytes)
+
 def Keccak(rate, capacity, inputBytes, delimitedSuffix, outputByteLen):
 
-    """for test"""
-    print('==============================')
-    if rate == 1344:
-        print(f'SHAKE128: IOBytes={len(inputBytes)},{outputByteLen}')
-        i_mode = 0
-    if rate == 1088 and delimitedSuffix == 0x1F:
-        print(f'SHAKE256: IOBytes={len(inputBytes)},{outputByteLen}')
-        i_mode = 1
-    if rate == 1088 and delimitedSuffix == 0x06:
-        print(f'SHA3_256: IOBytes={len(inputBytes)},{outputByteLen}')
-        i_mode = 2
-    if rate == 576:
-        print(f'SHA3_512: IOBytes={len(inputBytes)},{outputByteLen}')
-        i_mode = 3
-    print('==============================')
-    """for test"""
-
-    outputBytes = bytearray()
-    state = bytearray([0 for i in range(200)])
+    sponge = KeccakSponge(rate, capacity, delimitedSuffix)
+    outputBytes = sponge.absorb(inputBytes).squeeze(outputByteLen)
+
+    trace = get_trace_hook("keccak")
+    writer = vector_writer("keccak") if sponge.i_mode is not None else None
+    if trace or writer:
+        if len(inputBytes) % 8 == 0:
+            i_ibytes = int(int.from_bytes(inputBytes))
+        else:
+            i_ibytes = int(int.from_bytes(inputBytes) << 8*(8 - (len(inputBytes) % 8))) 
+        o_obytes = int(int.from_bytes(outputBytes))
+
+    if trace:
+        trace("keccak", "IO", IBytes=hex(i_ibytes).replace("0x", ""), OBytes=hex(o_obytes).replace("0x", ""))
+
+    if writer:
+        vecDict = dict()
+        vecDict['i_ibytes']     = i_ibytes
+        vecDict['o_obytes']     = o_obytes
+        vecDict['i_ibytes_len'] = len(inputBytes)
+        vecDict['i_obytes_len'] = len(outputBytes)
+        vecDict['i_mode']       = sponge.i_mode
+        writer.write('keccak', vecDict, 1568*2)
+    
+    return outputBytes
+
+def KeccakBatch(rate, capacity, inputs, delimitedSuffix, outputByteLen):
+    """
+    Keccak of several inputs of the same length at once, the
+    permutations of all instances run on lane arrays. Falls back to
+    one Keccak call per input while "keccak" is traced or keccak /
+    keccakf1600 vectors are written, so these see every call.
+    """
+    if get_trace_hook("keccak") or vector_writer("keccak") or vector_writer("keccakf1600"):
+        return [bytes(Keccak(rate, capacity, inputBytes, delimitedSuffix, outputByteLen)) for inputBytes in inputs]
+    if len(set(len(inputBytes) for inputBytes in inputs)) > 1:
+        raise ValueError("Batched inputs must have the same length")
+    if not inputs:
+        return []
+    if outputByteLen == 0:
+        return [b""] * len(inputs)
+
     rateInBytes = rate//8
-    blockSize = 0
-    inputOffset = 0
+    data = np.frombuffer(b"".join(inputs), dtype=np.uint8).reshape(len(inputs), -1)
+    state = np.zeros((len(inputs), 200), dtype=np.uint8)
+    permute = lambda state: np.ascontiguousarray(KeccakF1600onLaneArrays(np.ascontiguousarray(state.view("<u8").T)).T).view(np.uint8)
 
-    # ===================================
-    # === Absorb all the input blocks ===
-    # ===================================
-    while(inputOffset < len(inputBytes)):
-        # HW-FETCH
-        blockSize = min(len(inputBytes)-inputOffset, rateInBytes)
-        
-        # HW-ABSB
-        for i in range(blockSize):
-            state[i] = state[i] ^ inputBytes[i+inputOffset]
-        print(f'[ABSB  ]: BlockSize={blockSize}, IOBytes={len(inputBytes)},{outputByteLen}, State={state.hex()}')       
-        inputOffset = inputOffset + blockSize
-
-        # HW-ABSB-KECCAK
-        if (blockSize == rateInBytes):
-            state = KeccakF1600(state)
-            print(f'[ABSB_K]: BlockSize={blockSize}, IOBytes={len(inputBytes)},{outputByteLen}, State={state.hex()}')
-            blockSize = 0
-
-    # ========================================================
-    # === Do the padding and switch to the squeezing phase ===
-    # ========================================================
-    print(f'[PADD_I]: BlockSize={blockSize}, IOBytes={len(inputBytes)},{outputByteLen}, State={state.hex()}')
-    state[blockSize] = state[blockSize] ^ delimitedSuffix
-
-    # This part is not needed for Kyber
-    # if (((delimitedSuffix & 0x80) != 0) and (blockSize == (rateInBytes-1))):
-    #    state = KeccakF1600(state)
-    #    print(f'[Padding]: BlockSize={blockSize}, IOBytes={len(inputBytes)},{outputByteLen}')
-    #    k = k+1
-
-    state[rateInBytes-1] = state[rateInBytes-1] ^ 0x80
-    print(f'[PADD  ]: BlockSize={blockSize}, IOBytes={len(inputBytes)},{outputByteLen}, State={state.hex()}')
-    state = KeccakF1600(state)
-    print(f'[PADD_K]: BlockSize={blockSize}, IOBytes={len(inputBytes)},{outputByteLen}, State={state.hex()}')
-
-    # =========================================
-    # === Squeeze out all the output blocks ===
-    # =========================================
+    # Absorb, pad
+    inputOffset = 0
+    while(data.shape[1] - inputOffset >= rateInBytes):
+        state[:, :rateInBytes] ^= data[:, inputOffset:inputOffset+rateInBytes]
+        state = permute(state)
+        inputOffset = inputOffset + rateInBytes
+    blockSize = data.shape[1] - inputOffset
+    state[:, :blockSize] ^= data[:, inputOffset:]
+    state[:, blockSize] ^= delimitedSuffix
+    state[:, rateInBytes-1] ^= 0x80
+    state = permute(state)
+
+    # Squeeze
+    outputBytes = []
     while(outputByteLen > 0):
         blockSize = min(outputByteLen, rateInBytes)
-        outputBytes = outputBytes + state[0:blockSize]
+        outputBytes.append(state[:, :blockSize].copy())
         outputByteLen = outputByteLen - blockSize
-        print(f'[SQUZ  ]: BlockSize={blockSize}, IOBytes={len(inputBytes)},{outputByteLen}, State={state.hex()}')
         if (outputByteLen > 0):
-            print(f'[SQUZ_K]: BlockSize={blockSize}, IOBytes={len(inputBytes)},{outputByteLen}, State={state.hex()}')
-            state = KeccakF1600(state)
-
-
-    """for test"""
-    if len(inputBytes) % 8 == 0:
-        i_ibytes = int(int.from_bytes(inputBytes))
-    else:
-        i_ibytes = int(int.from_bytes(inputBytes) << 8*(8 - (len(inputBytes) % 8))) 
-    o_obytes = int(int.from_bytes(outputBytes))
-
-    print(f'[keccak] IBytes  : {hex(i_ibytes).replace("0x", "")}')
-    print(f'[keccak] OBytes  : {hex(o_obytes).replace("0x", "")}')
+            state = permute(state)
+    outputBytes = np.concatenate(outputBytes, axis=1)
 
-    vecDict = dict()
-    vecDict['i_ibytes']     = i_ibytes
-    vecDict['o_obytes']     = o_obytes
-    vecDict['i_ibytes_len'] = len(inputBytes)
-    vecDict['i_obytes_len'] = len(outputBytes)
-    vecDict['i_mode']       = i_mode
-
-    genvec('keccak', vecDict, 1568*2)
-    
-    return outputBytes
+    return [row.tobytes() for row in outputBytes]
 
+def SHAKE128_batch(inputs, outputByteLen):
+    return KeccakBatch(1344, 256, inputs, 0x1F, outputByteLen)
 
 def SHAKE128(inputBytes, outputByteLen):
     return Keccak(1344, 256, inputBytes, 0x1F, outputByteLen)
@@ -202,6 +349,12 @@ def SHAKE128(inputBytes, outputByteLen):
 def SHAKE256(inputBytes, outputByteLen):
     return Keccak(1088, 512, inputBytes, 0x1F, outputByteLen)
 
+def SHAKE128Sponge():
+    return KeccakSponge(1344, 256, 0x1F)
+
+def SHAKE256Sponge():
+    return KeccakSponge(1088, 512, 0x1F)
+
 def SHA3_224(inputBytes):
     return Keccak(1152, 448, inputBytes, 0x06, 224//8)
 
@@ -2,12 +2,28 @@ import os
 from utils import xor_bytes
 from Crypto.Cipher import AES
 
+# Requests of up to this many blocks encrypt a counter buffer in ECB
+# mode with the cached cipher, longer ones use one CTR mode cipher
+ECB_BLOCKS = 64
+
 class AES256_CTR_DRBG:
-    def __init__(self, seed=None, personalization=b""):
+    def __init__(self, seed=None, personalization=b"", buffer_size=0):
+        """
+        With a `buffer_size`, `random_bytes` serves requests from
+        generate calls of at least `buffer_size` bytes. The output is
+        still deterministic in the seed but, as one generate call
+        replaces several, no longer the output of the NIST reference
+        for the same requests (e.g. the KAT files).
+        """
+        if not 0 <= buffer_size <= 2**16:
+            raise ValueError(f"The buffer size must be at most 2^16 bytes, the limit of one generate call. Got {buffer_size}")
         self.seed_length = 48
         self.reseed_interval = 2**48
         self.key = bytes([0])*32
         self.V   = bytes([0])*16
+        self.cipher = AES.new(self.key, AES.MODE_ECB)
+        self.buffer_size = buffer_size
+        self.buffer = b""
         self.entropy_input = self.__check_entropy_input(seed)
       
         seed_material = self.__instantiate(personalization=personalization)
@@ -38,26 +54,30 @@ class AES256_CTR_DRBG:
         assert len(personalization) == self.seed_length
         return xor_bytes(self.entropy_input, personalization)
 
-    def __increment_counter(self):
+    def __keystream(self, num_bytes):
+        """
+        The AES encryptions of V+1, V+2, ... (mod 2^128) until there
+        are `num_bytes`, advancing V past the last block used
+        """
+        num_blocks = -(-num_bytes // 16)
         int_V = int.from_bytes(self.V, 'big')
-        new_V = (int_V + 1) % 2**(8*16)
-        self.V = new_V.to_bytes(16, byteorder='big')
+        if num_blocks <= ECB_BLOCKS or int_V + num_blocks >= 2**128:
+            counters = b"".join(((int_V + i) % 2**128).to_bytes(16, 'big') for i in range(1, num_blocks + 1))
+            stream = self.cipher.encrypt(counters)
+        else:
+            stream = AES.new(self.key, AES.MODE_CTR, nonce=b"", initial_value=int_V + 1).encrypt(bytes(16*num_blocks))
+        self.V = ((int_V + num_blocks) % 2**128).to_bytes(16, 'big')
+        return stream[:num_bytes]
         
     def ctr_drbg_update(self, provided_data):
-        tmp = b""
-        cipher = AES.new(self.key, AES.MODE_ECB)
-        # Collect bytes from AES ECB
-        while len(tmp) != self.seed_length:
-            self.__increment_counter()
-            tmp  += cipher.encrypt(self.V)
-        
-        # Take the first 48 bytes
-        tmp = tmp[:self.seed_length]
-        tmp = xor_bytes(tmp, provided_data)
-        
+        # Take the first 48 bytes of AES ECB
+        self.__set_key_and_V(xor_bytes(self.__keystream(self.seed_length), provided_data))
+
+    def __set_key_and_V(self, tmp):
         # Set the new values of key and V
         self.key = tmp[:32]
         self.V = tmp[32:]
+        self.cipher = AES.new(self.key, AES.MODE_ECB)
         
     def reseed(self, additional_information=b""):
         """
@@ -67,8 +87,20 @@ class AES256_CTR_DRBG:
         seed_material = self.__instantiate(additional_information)
         self.ctr_drbg_update(seed_material)
         self.reseed_ctr = 1
+        self.buffer = b""
         
     def random_bytes(self, num_bytes, additional=None):
+        if self.buffer_size and additional is None:
+            if len(self.buffer) < num_bytes:
+                self.buffer = self.buffer + self.generate(max(self.buffer_size, num_bytes - len(self.buffer)))
+            output_bytes, self.buffer = self.buffer[:num_bytes], self.buffer[num_bytes:]
+            return output_bytes
+        return self.generate(num_bytes, additional)
+
+    def generate(self, num_bytes, additional=None):
+        """
+        One generate call of the NIST reference
+        """
         if self.reseed_ctr >= self.reseed_interval:
             raise Warning("The DRBG has been exhausted! Reseed!")
         
@@ -77,21 +109,16 @@ class AES256_CTR_DRBG:
             additional = bytes([0]) * self.seed_length
         else:
             if len(additional) > self.seed_length:
-                 raise ValueError(f"The additional input must be of length at most: {self.seed_length}. Input has length {len(seed)}")
+                 raise ValueError(f"The additional input must be of length at most: {self.seed_length}. Input has length {len(additional)}")
             elif len(additional) < self.seed_length:
                 additional += bytes([0]) * (self.seed_length - len(additional))
             self.ctr_drbg_update(additional)
         
-        # Collect bytes!
-        tmp = b""
-        cipher = AES.new(self.key, AES.MODE_ECB)
-        while len(tmp) < num_bytes:
-            self.__increment_counter()
-            tmp += cipher.encrypt(self.V)
-        
-        # Collect only the requested number of bits
-        output_bytes = tmp[:num_bytes]
-        self.ctr_drbg_update(additional)
+        # The requested bytes and the 48 bytes of the following update
+        # are consecutive blocks under the same key: one encryption
+        output_blocks = 16*(-(-num_bytes // 16))
+        stream = self.__keystream(output_blocks + self.seed_length)
+        output_bytes = stream[:num_bytes]
+        self.__set_key_and_V(xor_bytes(stream[output_blocks:], additional))
         self.reseed_ctr += 1
         return output_bytes
-            
\ No newline at end of file
@@ -0,0 +1,154 @@
+import asyncio
+from kyber_pool import KyberPool, WORKER_KYBER, run_chunk
+
+class AsyncKyber:
+    """
+    asyncio front-end for one Kyber parameter set.
+
+    `await keygen()`, `enc(pk)` and `dec(c, sk)` queue the request
+    and return its result. Concurrent requests of one operation are
+    coalesced into micro-batches of up to `max_batch` items: a batch
+    is dispatched once it is full or `max_latency` seconds after its
+    first request. Batches run through the batch API on a KyberPool,
+    at most one batch per worker at a time.
+
+    Each operation has a queue of `max_queue` requests, when it is
+    full the callers wait (backpressure).
+    """
+    OPERATIONS = ("keygen", "enc", "dec")
+
+    def __init__(self, parameter_set="kyber_512", pool=None, max_batch=64, max_latency=0.005, max_queue=1024, key_length=32):
+        if parameter_set not in WORKER_KYBER:
+            raise ValueError(f"Unknown parameter set {parameter_set}, expected one of {list(WORKER_KYBER)}")
+        self.parameter_set = parameter_set
+        self.owns_pool = pool is None # A pool passed in is not shut down by `close`
+        self.pool = KyberPool() if pool is None else pool
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.max_queue = max_queue
+        self.key_length = key_length
+
+        kyber = WORKER_KYBER[parameter_set]
+        self.ciphertext_length = (kyber.du * kyber.k + kyber.dv) * kyber.n // 8
+        self.public_key_length = 12 * kyber.k * kyber.n // 8 + 32
+        self.secret_key_length = 2 * 12 * kyber.k * kyber.n // 8 + 96
+
+        self.queues = None
+        self.batchers = []
+        self.dispatches = set()
+        self.batches = 0 # Number of dispatched micro-batches
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def start(self):
+        """
+        Start one batcher task per operation on the running loop
+        """
+        if self.queues is not None:
+            return
+        self.inflight = asyncio.Semaphore(self.pool.max_workers)
+        self.queues = {operation: asyncio.Queue(self.max_queue) for operation in self.OPERATIONS}
+        self.batchers = [asyncio.create_task(self._batcher(operation, queue)) for operation, queue in self.queues.items()]
+
+    async def close(self):
+        """
+        Stop batching, wait for the dispatched batches and shut
+        down the pool if it was created here. Requests still in
+        a queue or in a batch not yet dispatched are cancelled.
+        """
+        for batcher in self.batchers:
+            batcher.cancel()
+        await asyncio.gather(*self.batchers, return_exceptions=True)
+        await asyncio.gather(*self.dispatches, return_exceptions=True)
+        for queue in (self.queues or {}).values():
+            while not queue.empty():
+                _, future = queue.get_nowait()
+                future.cancel()
+        self.queues, self.batchers = None, []
+        if self.owns_pool:
+            self.pool.shutdown()
+
+    async def _submit(self, operation, item):
+        if self.queues is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queues[operation].put((item, future)) # Waits while the queue is full
+        return await future
+
+    async def keygen(self):
+        """
+        A key pair (pk, sk)
+        """
+        return await self._submit("keygen", None)
+
+    async def enc(self, pk):
+        """
+        Encapsulate to `pk` (bytes or PublicKey), returns (c, K)
+        """
+        pk = bytes(pk)
+        if len(pk) != self.public_key_length:
+            raise ValueError(f"Public key must be {self.public_key_length} bytes long")
+        return await self._submit("enc", pk)
+
+    async def dec(self, c, sk):
+        """
+        Decapsulate `c` with `sk` (bytes or SecretKey), returns K
+        """
+        sk = bytes(sk)
+        if len(c) != self.ciphertext_length:
+            raise ValueError(f"Ciphertext must be {self.ciphertext_length} bytes long")
+        if len(sk) != self.secret_key_length:
+            raise ValueError(f"Secret key must be {self.secret_key_length} bytes long")
+        return await self._submit("dec", (c, sk))
+
+    async def _batcher(self, operation, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = []
+            try:
+                batch.append(await queue.get())
+                deadline = loop.time() + self.max_latency
+                while len(batch) < self.max_batch:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+
+                await self.inflight.acquire()
+            except asyncio.CancelledError:
+                # Closed while collecting: cancel the requests of the partial batch like the queued ones
+                for _, future in batch:
+                    future.cancel()
+                raise
+            dispatch = asyncio.create_task(self._dispatch(operation, batch))
+            self.dispatches.add(dispatch)
+            dispatch.add_done_callback(self.dispatches.discard)
+
+    async def _dispatch(self, operation, batch):
+        loop = asyncio.get_running_loop()
+        self.batches += 1
+        try:
+            items = [item for item, _ in batch]
+            results = await loop.run_in_executor(self.pool.executor, run_chunk, self.parameter_set, operation, items, None, self.key_length)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), (result, error) in zip(batch, results):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        finally:
+            self.inflight.release()
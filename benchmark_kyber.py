@@ -1,5 +1,9 @@
-from kyber import Kyber512, Kyber768, Kyber1024
+from kyber import Kyber, DEFAULT_PARAMETERS, Kyber512, Kyber768, Kyber1024
+from kyber_pool import KyberPool
+import os
+from utils import bytes_to_bits, bitstring_to_bytes, pack_bits, unpack_bits
 import cProfile
+import random
 from time import time
 
 def profile_kyber(Kyber):
@@ -40,12 +44,130 @@ def benchmark_kyber(Kyber, name, count):
     print(f"Enc: {round(sum(enc_times), 3)}")
     print(f"Dec: {round(sum(dec_times),3)}")
     
+
+def benchmark_batch(Kyber, name, count):
+    """
+    `count` single keygen/enc/dec calls against one call
+    of keygen_batch/enc_batch/dec_batch of size `count`.
+    Keygen gains less (about 2x against about 3x for enc/dec
+    with N = 100), the per-key matrix expansion dominates it.
+    """
+    print(f"-"*27)
+    print(f"  {name} batch | (N = {count})")
+    print(f"-"*27)
+    
+    t0 = time()
+    keys = [Kyber.keygen() for _ in range(count)]
+    t1 = time()
+    Kyber.keygen_batch(count)
+    t2 = time()
+    print(f"Keygen: {round(t1 - t0, 3)} -> {round(t2 - t1, 3)}")
+    
+    pk, sk = keys[0]
+    public_key, secret_key = Kyber.load_public_key(pk), Kyber.load_secret_key(sk)
+    
+    t0 = time()
+    _ = [Kyber.enc(public_key) for _ in range(count)]
+    t1 = time()
+    cs = [c for c, _ in Kyber.enc_batch([public_key] * count)]
+    t2 = time()
+    print(f"Enc: {round(t1 - t0, 3)} -> {round(t2 - t1, 3)}")
+    
+    t0 = time()
+    _ = [Kyber.dec(c, secret_key) for c in cs]
+    t1 = time()
+    Kyber.dec_batch(cs, secret_key)
+    t2 = time()
+    print(f"Dec: {round(t1 - t0, 3)} -> {round(t2 - t1, 3)}")
+    
+def benchmark_matrix_expansion(parameter_set, count):
+    """
+    XOF / Parse timing breakdown of expanding A per hash backend,
+    against a whole enc without the matrix cache
+    """
+    print(f"-"*27)
+    print(f"  {parameter_set} matrix | ({count} calls)")
+    print(f"-"*27)
+    
+    for backend in ("hashlib", "CompactFIPS202"):
+        kyber = Kyber(DEFAULT_PARAMETERS[parameter_set], matrix_cache_size=0, hash_backend=backend)
+        timings = [kyber.expand_matrix(os.urandom(32), transpose=True)[1] for _ in range(count)]
+        pk, _ = kyber.keygen()
+        t0 = time()
+        for _ in range(count):
+            kyber.enc(pk)
+        enc_time = (time() - t0) / count
+        xof_time = sum(t["xof"] for t in timings) / count
+        parse_time = sum(t["parse"] for t in timings) / count
+        print(f"{backend}: XOF {round(1000 * xof_time, 3)} ms, Parse {round(1000 * parse_time, 3)} ms, Enc {round(1000 * enc_time, 3)} ms")
+    
+def benchmark_pool(parameter_set, count, max_workers):
+    """
+    The benchmark_kyber workload (keygen, enc, dec per key)
+    on a KyberPool with 1 to `max_workers` workers, on system
+    randomness (chunks through the batch API) and seeded (one
+    DRBG and single calls per item)
+    """
+    print(f"-"*27)
+    print(f"  KyberPool {parameter_set} | ({count} calls)")
+    print(f"-"*27)
+    
+    for workers in range(1, max_workers + 1):
+        for seed in (None, bytes(48)):
+            with KyberPool(max_workers=workers) as pool:
+                pool.set_drbg_seed(seed)
+                pool.keygen(parameter_set, workers) # Start the workers before timing
+                
+                t0 = time()
+                keys = pool.keygen(parameter_set, count)
+                encs = pool.enc(parameter_set, [pk for pk, _ in keys])
+                pool.dec(parameter_set, [c for c, _ in encs], [sk for _, sk in keys])
+                elapsed = time() - t0
+            mode = "batched" if seed is None else "seeded"
+            print(f"{workers} workers, {mode}: {round(elapsed, 3)} ({round(3*count / elapsed)} ops/s)")
+    
+def benchmark_bit_packing(count):
+    """
+    Compare the bit string encode/decode reference against
+    the NumPy packers, for every l used by Kyber
+    """
+    print(f"-"*27)
+    print(f"  Bit packing | ({count} calls)")
+    print(f"-"*27)
+    
+    for l in [1, 4, 5, 10, 11, 12]:
+        coeffs = [random.randint(0, 2**l - 1) for _ in range(256)]
+        
+        t0 = time()
+        for _ in range(count):
+            input_bytes = bitstring_to_bytes(''.join(format(c, f'0{l}b')[::-1] for c in coeffs))
+            bits = bytes_to_bits(input_bytes)
+            _ = [sum(bits[i*l + j] << j for j in range(l)) for i in range(256)]
+        ref_time = time() - t0
+        
+        t1 = time()
+        for _ in range(count):
+            _ = unpack_bits(pack_bits(coeffs, l), l)
+        np_time = time() - t1
+        
+        print(f"l={l:2}: {round(ref_time, 3)} -> {round(np_time, 3)} ({round(ref_time / np_time, 1)}x)")
     
 if __name__ == '__main__':
     # profile_kyber(Kyber512)
     # profile_kyber(Kyber768)
     # profile_kyber(Kyber1024)
     
+    benchmark_bit_packing(1000)
+    
+    benchmark_matrix_expansion("kyber_512", 20)
+    benchmark_matrix_expansion("kyber_1024", 20)
+    
+    benchmark_batch(Kyber512, "Kyber512", 64)
+    benchmark_batch(Kyber768, "Kyber768", 64)
+    benchmark_batch(Kyber1024, "Kyber1024", 64)
+    
+    benchmark_pool("kyber_512", 1000, os.cpu_count())
+    
     count = 1000
     benchmark_kyber(Kyber512, "Kyber512", count)
     benchmark_kyber(Kyber768, "Kyber768", count)    
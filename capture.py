@@ -0,0 +1,63 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Captured stages and the fields of their records:
+#   parse        : input_bytes, coefficients, output
+#   cbd          : input_bytes, eta, coefficients, output
+#   decode       : input_bytes, l, coefficients, output
+#   encode       : l, coefficients, output
+#   compress     : d, q, coefficients
+#   xof          : bytes32, a, b, length, input_bytes, output
+#   error_vector : v, N, sigma, eta
+STAGES = ("parse", "cbd", "decode", "encode", "compress", "xof", "error_vector")
+
+# The Capture of the current thread / asyncio task, None when nothing is captured
+ACTIVE_CAPTURE = ContextVar("active_capture", default=None)
+
+class Capture:
+    """
+    Per-context store of the intermediates of the captured stages.
+    `capture[stage]` lists one record (a dict of fields) per call,
+    in call order, and `capture.last(stage)` is the latest one.
+    """
+    def __init__(self, stages):
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown stages {sorted(unknown)}, expected some of {STAGES}")
+        self.stages = frozenset(stages)
+        self.records = {stage: [] for stage in stages}
+
+    def __getitem__(self, stage):
+        return self.records[stage]
+
+    def last(self, stage):
+        return self.records[stage][-1]
+
+    def record(self, stage, **fields):
+        self.records[stage].append(fields)
+
+def capturing(stage):
+    """
+    The active Capture if it records `stage`, else None. Stages call
+    this once and only build their record when it is not None.
+    """
+    active = ACTIVE_CAPTURE.get()
+    if active is not None and stage in active.stages:
+        return active
+    return None
+
+@contextmanager
+def capture(stages=STAGES):
+    """
+    Record the intermediates of `stages` inside the block, e.g.
+
+        with capture(stages=["cbd"]) as cap:
+            Kyber512.keygen()
+        cap.last("cbd")["coefficients"]
+    """
+    active = Capture(stages)
+    token = ACTIVE_CAPTURE.set(active)
+    try:
+        yield active
+    finally:
+        ACTIVE_CAPTURE.reset(token)
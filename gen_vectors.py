@@ -0,0 +1,280 @@
+import argparse
+import itertools
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import shake_256
+from time import time
+from aes256_ctr_drbg import AES256_CTR_DRBG
+from CompactFIPS202 import KeccakF1600, SHAKE128, SHAKE256, SHA3_256, SHA3_512
+from polynomials import PolynomialRing
+from utils import pack_bits, unpack_bits
+from vectors import NVEC, VectorCollector, VectorWriter
+
+# Modules with a testbench in rtl/, in the order they are generated
+MODULES = ("keccak", "keccakf1600", "parse", "cbd", "encode", "decode", "compress", "decompress")
+
+# Hash calls Kyber makes: (function, input bytes, output bytes)
+KECCAK_CALLS = [
+    (lambda b, l: SHAKE128(b, l), 34, 672),   # XOF
+    (lambda b, l: SHAKE256(b, l), 33, 128),   # PRF, eta = 2
+    (lambda b, l: SHAKE256(b, l), 33, 192),   # PRF, eta = 3
+    (lambda b, l: SHAKE256(b, l), 64, 32),    # KDF
+    (lambda b, l: SHA3_256(b), 32, 32),       # H(m)
+    (lambda b, l: SHA3_256(b), 800, 32),      # H(pk), Kyber512
+    (lambda b, l: SHA3_256(b), 1184, 32),     # H(pk), Kyber768
+    (lambda b, l: SHA3_256(b), 768, 32),      # H(c), Kyber512
+    (lambda b, l: SHA3_512(b), 32, 64),       # G(d)
+    (lambda b, l: SHA3_512(b), 64, 64),       # G(m || H(pk))
+]
+
+# Every Keccak mode with its rate in bytes, for the padding edge cases
+KECCAK_RATES = [
+    (lambda b: SHAKE128(b, 168), 168),
+    (lambda b: SHAKE256(b, 136), 136),
+    (lambda b: SHA3_256(b), 136),
+    (lambda b: SHA3_512(b), 72),
+]
+
+# Parameters of the stages in Kyber: l of encode / decode, d of compress / decompress
+L_VALUES = (1, 4, 5, 10, 11, 12)
+D_VALUES = (1, 4, 5, 10, 11)
+
+# Largest share of the vectors of a call given to edge cases, the rest are random
+EDGE_FRACTION = 0.5
+
+R = PolynomialRing(3329, 256)
+
+def task_seed(seed, module, chunk):
+    """
+    48 byte DRBG seed of one chunk, derived from the master seed
+    """
+    return shake_256(seed + module.encode() + chunk.to_bytes(4, "big")).digest(48)
+
+def collect(module, n, calls):
+    """
+    Run the first `n` of `calls`, argument-less stage calls writing
+    one vector each, and return the vectors of `module` as
+    (fields, hex_digits)
+    """
+    with VectorCollector(nvec={module: n}, modules=[module]) as collector:
+        for call in itertools.islice(calls, n):
+            call()
+    return collector.vectors.get(module, [])
+
+def with_edge_cases(n, edges, randoms):
+    """
+    Inputs of `n` vectors: edge cases, then `randoms`. `edges` has
+    one list of cases per parameter value (mode, eta, l or d) and is
+    taken round-robin, so the first vectors cover every value. At
+    most EDGE_FRACTION of `n` are edge cases, so small counts still
+    get random inputs.
+    """
+    rounds = itertools.zip_longest(*edges, fillvalue=None)
+    cases = (case for cases in rounds for case in cases if case is not None)
+    return itertools.chain(itertools.islice(cases, int(n*EDGE_FRACTION)), randoms)
+
+def max_coefficient(l):
+    """
+    Largest coefficient of l bits in Kyber, q - 1 for l = 12
+    """
+    return min(2**l, R.q) - 1
+
+def gen_keccak_vectors(n, seed=bytes(48), edge_cases=True):
+    """
+    Kyber hash calls on random inputs, after inputs of rate - 1,
+    rate and rate + 1 bytes for every mode, the padding edge cases
+    """
+    drbg = AES256_CTR_DRBG(seed)
+    edges = [[lambda function=function, input_bytes=bytes(i % 256 for i in range(length)): function(input_bytes)
+              for length in (rate - 1, rate, rate + 1)] for function, rate in KECCAK_RATES]
+    def randoms():
+        while True:
+            function, input_length, output_length = KECCAK_CALLS[drbg.random_bytes(1)[0] % len(KECCAK_CALLS)]
+            input_bytes = drbg.random_bytes(input_length)
+            yield lambda: function(input_bytes, output_length)
+    return collect("keccak", n, with_edge_cases(n, edges if edge_cases else [], randoms()))
+
+def gen_keccakf1600_vectors(n, seed=bytes(48), edge_cases=True):
+    """
+    Keccak-f[1600] on random states, after the all zero and all one states
+    """
+    drbg = AES256_CTR_DRBG(seed)
+    edges = [[bytes(200), bytes([0xff])*200]] if edge_cases else []
+    def randoms():
+        while True:
+            yield drbg.random_bytes(200)
+    return collect("keccakf1600", n, (lambda state=state: KeccakF1600(bytearray(state)) for state in with_edge_cases(n, edges, randoms())))
+
+def gen_parse_vectors(n, seed=bytes(48), edge_cases=True):
+    """
+    Parse of 768 byte streams, the length Kyber squeezes for one
+    matrix entry. The edge cases are all 0, all q - 1, q - 1 and q
+    (the first rejected value) alternating, and the most rejections
+    that still give 256 coefficients, before and between them.
+    Random streams with fewer than 256 coefficients are skipped.
+    """
+    drbg = AES256_CTR_DRBG(seed)
+    q, count = R.q, 2*R.n # 512 candidates in 768 bytes
+    edges = [
+        np.zeros(count, dtype=np.int64),
+        np.full(count, q - 1),
+        np.resize([q - 1, q], count),
+        np.concatenate([np.full(count - R.n, 4095), np.arange(R.n) * (q - 1) // (R.n - 1)]),
+        np.resize([q, 4095, q - 1, 0], count),
+    ]
+    def randoms():
+        while True:
+            input_bytes = drbg.random_bytes(3*R.n)
+            candidates = unpack_bits(input_bytes, 12)
+            if np.count_nonzero(candidates < q) >= R.n:
+                yield input_bytes
+    streams = with_edge_cases(n, [[pack_bits(c, 12) for c in edges]] if edge_cases else [], randoms())
+    return collect("parse", n, (lambda input_bytes=input_bytes: R.parse(input_bytes) for input_bytes in streams))
+
+def gen_cbd_vectors(n, eta=(2, 3), seed=bytes(48), edge_cases=True):
+    """
+    CBD of random 64 eta byte inputs, `eta` one value or cycled
+    through. The edge cases are all 0 and all 1 bits (coefficients
+    0), all eta, all -eta and eta, -eta alternating.
+    """
+    drbg = AES256_CTR_DRBG(seed)
+    etas = (eta,) if isinstance(eta, int) else tuple(eta)
+    def edges(eta):
+        a, b = 2**eta - 1, (2**eta - 1) << eta # eta one bits in the first / second half of a coefficient
+        return [(pack_bits(np.resize(values, R.n), 2*eta), eta) for values in ([0], [a | b], [a], [b], [a, b])]
+    def randoms():
+        for eta in itertools.cycle(etas):
+            yield drbg.random_bytes(64*eta), eta
+    inputs = with_edge_cases(n, [edges(eta) for eta in etas] if edge_cases else [], randoms())
+    return collect("cbd", n, (lambda input_bytes=input_bytes, eta=eta: R.cbd(input_bytes, eta) for input_bytes, eta in inputs))
+
+def gen_decode_vectors(n, l=L_VALUES, seed=bytes(48), edge_cases=True):
+    """
+    Decode of random 32 l byte inputs, `l` one value or cycled
+    through, after all 0 and all maximal coefficients for every l
+    """
+    drbg = AES256_CTR_DRBG(seed)
+    ls = (l,) if isinstance(l, int) else tuple(l)
+    edges = [[(pack_bits(np.full(R.n, value), l), l) for value in (0, max_coefficient(l))] for l in ls]
+    def randoms():
+        for l in itertools.cycle(ls):
+            yield drbg.random_bytes(32*l), l
+    inputs = with_edge_cases(n, edges if edge_cases else [], randoms())
+    return collect("decode", n, (lambda input_bytes=input_bytes, l=l: R.decode(input_bytes, l) for input_bytes, l in inputs))
+
+def gen_encode_vectors(n, l=L_VALUES, seed=bytes(48), edge_cases=True):
+    """
+    Encode of random polynomials with l bit coefficients (below q
+    for l = 12), `l` one value or cycled through, after all 0 and
+    all maximal coefficients for every l
+    """
+    drbg = AES256_CTR_DRBG(seed)
+    ls = (l,) if isinstance(l, int) else tuple(l)
+    edges = [[(np.full(R.n, value), l) for value in (0, max_coefficient(l))] for l in ls]
+    def randoms():
+        for l in itertools.cycle(ls):
+            yield unpack_bits(drbg.random_bytes(32*l), l) % R.q, l
+    inputs = with_edge_cases(n, edges if edge_cases else [], randoms())
+    return collect("encode", n, (lambda coefficients=coefficients, l=l: R(coefficients).encode(l) for coefficients, l in inputs))
+
+def compress_boundaries(d):
+    """
+    256 coefficients on both sides of the rounding boundaries of
+    compress to d bits, (2k + 1) q / 2^(d + 1), and q - 1
+    """
+    upper = -((-(2*np.arange(2**d) + 1) * R.q) >> (d + 1)) # First x rounding up to k + 1
+    values = np.unique(np.clip(np.concatenate([upper - 1, upper, [R.q - 1]]), 0, R.q - 1))
+    step = -(-len(values) // R.n)
+    return np.resize(values[::step], R.n)
+
+def gen_compress_vectors(n, d=D_VALUES, seed=bytes(48), edge_cases=True):
+    """
+    Compress of random polynomials mod q, `d` one value or cycled
+    through, after all 0, all q - 1 and the rounding boundaries
+    for every d
+    """
+    drbg = AES256_CTR_DRBG(seed)
+    ds = (d,) if isinstance(d, int) else tuple(d)
+    edges = [[(coefficients, d) for coefficients in (np.zeros(R.n, dtype=np.int64), np.full(R.n, R.q - 1), compress_boundaries(d))] for d in ds]
+    def randoms():
+        for d in itertools.cycle(ds):
+            yield unpack_bits(drbg.random_bytes(32*12), 12) % R.q, d
+    inputs = with_edge_cases(n, edges if edge_cases else [], randoms())
+    return collect("compress", n, (lambda coefficients=coefficients, d=d: R(coefficients).compress(d) for coefficients, d in inputs))
+
+def gen_decompress_vectors(n, d=D_VALUES, seed=bytes(48), edge_cases=True):
+    """
+    Decompress of random d bit polynomials, `d` one value or cycled
+    through, after all 0, all 2^d - 1 and a ramp from 0 to 2^d - 1
+    for every d
+    """
+    drbg = AES256_CTR_DRBG(seed)
+    ds = (d,) if isinstance(d, int) else tuple(d)
+    edges = [[(coefficients, d) for coefficients in (np.zeros(R.n, dtype=np.int64), np.full(R.n, 2**d - 1), np.arange(R.n) * (2**d - 1) // (R.n - 1))] for d in ds]
+    def randoms():
+        for d in itertools.cycle(ds):
+            yield unpack_bits(drbg.random_bytes(32*d), d), d
+    inputs = with_edge_cases(n, edges if edge_cases else [], randoms())
+    return collect("decompress", n, (lambda coefficients=coefficients, d=d: R(coefficients).decompress(d) for coefficients, d in inputs))
+
+# Vector generator of every module: (n, seed=..., edge_cases=...) -> [(fields, hex_digits)]
+GENERATORS = {
+    "keccak"      : gen_keccak_vectors,
+    "keccakf1600" : gen_keccakf1600_vectors,
+    "parse"       : gen_parse_vectors,
+    "cbd"         : gen_cbd_vectors,
+    "encode"      : gen_encode_vectors,
+    "decode"      : gen_decode_vectors,
+    "compress"    : gen_compress_vectors,
+    "decompress"  : gen_decompress_vectors,
+}
+
+def generate_chunk(module, count, seed, edge_cases):
+    """
+    Runs in a worker: `count` vectors of `module` from a DRBG
+    on `seed`, as (fields, hex_digits) in generation order
+    """
+    return GENERATORS[module](count, seed=seed, edge_cases=edge_cases)
+
+def run_campaign(modules=MODULES, count=None, seed=bytes(48), root="./vec", workers=None, chunk=50):
+    """
+    Generate `count` vectors (the testbench NVEC by default) of every
+    module in `modules` into `root`, the edge cases of a module first
+    (in its first chunk, capped by EDGE_FRACTION).
+    The chunks run in parallel and are merged in module and chunk
+    order, so the files only depend on the seed, not on the number of
+    workers. Returns the vector counts.
+    """
+    tasks = []
+    for module in modules:
+        if module not in MODULES:
+            raise ValueError(f"Unknown module {module}, expected some of {MODULES}")
+        total = NVEC[module] if count is None else count
+        for index, start in enumerate(range(0, total, chunk)):
+            tasks.append((module, min(chunk, total - start), task_seed(seed, module, index), index == 0))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(generate_chunk, *task) for task in tasks]
+        with VectorWriter(root, nvec=None, modules=modules) as writer:
+            for (module, *_), future in zip(tasks, futures):
+                for fields, hex_digits in future.result():
+                    writer.write(module, fields, hex_digits)
+
+    return writer.counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate the $readmemh test vectors of the rtl/*_tb.v testbenches")
+    parser.add_argument("modules", nargs="*", default=list(MODULES), help=f"modules to generate (default: all of {', '.join(MODULES)})")
+    parser.add_argument("--count", type=int, default=None, help="vectors per module (default: the testbench NVEC)")
+    parser.add_argument("--seed", default="00"*48, help="master seed as hex")
+    parser.add_argument("--out", default="./vec", help="output directory, read as ../vec by the testbenches")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: cpu count)")
+    parser.add_argument("--chunk", type=int, default=50, help="vectors per worker task")
+    args = parser.parse_args()
+
+    t0 = time()
+    counts = run_campaign(args.modules, args.count, bytes.fromhex(args.seed), args.out, args.workers, args.chunk)
+    for module, n in counts.items():
+        print(f"{module:12}: {n} vectors -> {os.path.join(args.out, module)}")
+    print(f"Done in {round(time() - t0, 2)} s")
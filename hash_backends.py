@@ -0,0 +1,154 @@
+import abc
+from hashlib import sha3_256, sha3_512, shake_128, shake_256
+from CompactFIPS202 import SHAKE128, SHAKE256, SHA3_256, SHA3_512, SHAKE128Sponge, SHAKE128_batch
+
+class PrefixStream:
+    """
+    Incremental reads of a one-shot XOF: `squeeze(length)` returns
+    the next `length` bytes by recomputing the longer prefix
+    """
+    def __init__(self, function, input_bytes):
+        self.function = function
+        self.input_bytes = input_bytes
+        self.offset = 0
+
+    def squeeze(self, length):
+        output = self.function(self.input_bytes, self.offset + length)[self.offset:]
+        self.offset = self.offset + length
+        return output
+
+class HashBackend(abc.ABC):
+    """
+    The Keccak functions of Kyber: XOF and matrix streams (SHAKE128),
+    PRF and KDF (SHAKE256), H (SHA3-256) and G (SHA3-512).
+    Subclasses implement the four abstract one-shot functions, so an
+    incomplete backend fails when it is created. `shake128_stream`
+    falls back to a PrefixStream over `shake128` and `shake128_batch`
+    to one `shake128` per input.
+    """
+    name = None
+
+    @abc.abstractmethod
+    def shake128(self, input_bytes, length):
+        pass
+
+    @abc.abstractmethod
+    def shake256(self, input_bytes, length):
+        pass
+
+    @abc.abstractmethod
+    def sha3_256(self, input_bytes):
+        pass
+
+    @abc.abstractmethod
+    def sha3_512(self, input_bytes):
+        pass
+
+    def shake128_stream(self, input_bytes):
+        """
+        SHAKE128 of `input_bytes` as a stream, `squeeze(length)`
+        returns its next `length` bytes
+        """
+        return PrefixStream(self.shake128, input_bytes)
+
+    def shake128_batch(self, inputs, length):
+        """
+        SHAKE128 of every input, e.g. the k^2 streams of the matrix A
+        """
+        return [self.shake128(input_bytes, length) for input_bytes in inputs]
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+class HashlibBackend(HashBackend):
+    """
+    C implementations of hashlib, the default
+    """
+    name = "hashlib"
+
+    def shake128(self, input_bytes, length):
+        return shake_128(input_bytes).digest(length)
+
+    def shake256(self, input_bytes, length):
+        return shake_256(input_bytes).digest(length)
+
+    def sha3_256(self, input_bytes):
+        return sha3_256(input_bytes).digest()
+
+    def sha3_512(self, input_bytes):
+        return sha3_512(input_bytes).digest()
+
+class CompactFIPS202Backend(HashBackend):
+    """
+    The hardware-mirroring sponge of CompactFIPS202: its "keccak"
+    trace events and "keccak" / "keccakf1600" vectors follow every
+    hash call of Kyber. Batches of equal length inputs run their
+    permutations on lane arrays.
+    """
+    name = "CompactFIPS202"
+
+    def shake128(self, input_bytes, length):
+        return bytes(SHAKE128(input_bytes, length))
+
+    def shake256(self, input_bytes, length):
+        return bytes(SHAKE256(input_bytes, length))
+
+    def sha3_256(self, input_bytes):
+        return bytes(SHA3_256(input_bytes))
+
+    def sha3_512(self, input_bytes):
+        return bytes(SHA3_512(input_bytes))
+
+    def shake128_stream(self, input_bytes):
+        return SHAKE128Sponge().absorb(input_bytes)
+
+    def shake128_batch(self, inputs, length):
+        if len(set(map(len, inputs))) > 1:
+            return super().shake128_batch(inputs, length)
+        return SHAKE128_batch(inputs, length)
+
+class RecordingBackend(HashBackend):
+    """
+    Runs `backend` (hashlib by default) and appends every call to
+    `calls` as (function, input_bytes, output). Streams are recorded
+    as one shake128 call per squeeze, over the prefix squeezed so far.
+    """
+    name = "recording"
+
+    def __init__(self, backend=None):
+        self.backend = HashlibBackend() if backend is None else backend
+        self.calls = []
+
+    def record(self, function, input_bytes, output):
+        self.calls.append((function, bytes(input_bytes), bytes(output)))
+        return output
+
+    def shake128(self, input_bytes, length):
+        return self.record("shake128", input_bytes, self.backend.shake128(input_bytes, length))
+
+    def shake256(self, input_bytes, length):
+        return self.record("shake256", input_bytes, self.backend.shake256(input_bytes, length))
+
+    def sha3_256(self, input_bytes):
+        return self.record("sha3_256", input_bytes, self.backend.sha3_256(input_bytes))
+
+    def sha3_512(self, input_bytes):
+        return self.record("sha3_512", input_bytes, self.backend.sha3_512(input_bytes))
+
+    def __repr__(self):
+        return f"RecordingBackend({self.backend!r})"
+
+# Backends by name, for Kyber(..., hash_backend="CompactFIPS202")
+HASH_BACKENDS = {backend.name: backend for backend in (HashlibBackend, CompactFIPS202Backend, RecordingBackend)}
+
+def get_hash_backend(backend):
+    """
+    A HashBackend from an instance, a name of HASH_BACKENDS or None (hashlib)
+    """
+    if backend is None:
+        return HashlibBackend()
+    if isinstance(backend, str):
+        if backend not in HASH_BACKENDS:
+            raise ValueError(f"Unknown hash backend {backend}, expected one of {list(HASH_BACKENDS)}")
+        return HASH_BACKENDS[backend]()
+    return backend
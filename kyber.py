@@ -1,9 +1,16 @@
 import os
+from collections import OrderedDict
+from threading import Lock
+from time import perf_counter
+import numpy as np
 from CompactFIPS202 import *
-from hashlib import sha3_256, sha3_512, shake_128, shake_256
 from polynomials import *
 from modules import *
-from ntt_helper import NTTHelperKyber
+from ntt_helper import NTTHelperKyberNumpy, NTTHelperNumpy
+from utils import pack_bits, unpack_bits
+from tracing import get_trace_hook
+from capture import capturing
+from hash_backends import get_hash_backend
 try:
     from aes256_ctr_drbg import AES256_CTR_DRBG
 except ImportError as e:
@@ -42,8 +49,44 @@ DEFAULT_PARAMETERS = {
     }
 }
 
+class PublicKey:
+    """
+    A Kyber public key parsed once for repeated encapsulation.
+
+    Holds the encoded key `pk`, the decoded t^T in NTT form `tt`,
+    the expanded matrix A^T in NTT form `At` and the hash H(pk) `hpk`.
+    Both matrices are frozen. Create it with `Kyber.load_public_key`.
+    """
+    def __init__(self, pk, tt, At, hpk):
+        self.pk = pk
+        self.tt = tt.freeze()
+        self.At = At.freeze()
+        self.hpk = hpk
+
+    def __bytes__(self):
+        return self.pk
+
+class SecretKey:
+    """
+    A Kyber secret key parsed once for repeated decapsulation.
+
+    Holds the encoded key `sk`, the decoded s^T in NTT form `st`
+    (frozen), the embedded public key as a PublicKey `public_key`
+    (with t^T, A^T and H(pk)) and the rejection value `z`.
+    Create it with `Kyber.load_secret_key`.
+    """
+    def __init__(self, sk, st, public_key, z):
+        self.sk = sk
+        self.st = st.freeze()
+        self.public_key = public_key
+        self.hpk = public_key.hpk
+        self.z = z
+
+    def __bytes__(self):
+        return self.sk
+
 class Kyber:
-    def __init__(self, parameter_set):
+    def __init__(self, parameter_set, ntt_helper=NTTHelperKyberNumpy, lazy_reduction=False, matrix_cache_size=16, hash_backend=None):
         self.n = parameter_set["n"] # Maximum degree of the used polynomials
         self.k = parameter_set["k"] # Number of polynomials per vector or the number of polynomials in the key
         self.q = parameter_set["q"] # Modulus for numbers
@@ -52,22 +95,37 @@ class Kyber:
         self.du = parameter_set["du"] # Control how much u get compressed
         self.dv = parameter_set["dv"] # Control how much v get compressed
         
-        self.R = PolynomialRing(self.q, self.n, ntt_helper=NTTHelperKyber) # An instance of PolynomialRing class
+        self.R = PolynomialRing(self.q, self.n, ntt_helper=ntt_helper, lazy_reduction=lazy_reduction) # An instance of PolynomialRing class (NTTHelperKyber for the scalar reference NTT)
         self.M = Module(self.R) # An instance of Module class
         
         self.drbg = None # Deterministic Random Bit Generator (DRBG) represents an instance of the AES256_CTR_DRBG class
         self.random_bytes = os.urandom
-        
+        self.hash = get_hash_backend(hash_backend) # HashBackend of XOF / PRF / H / G / KDF: hashlib by default, "CompactFIPS202" for the hardware-mirroring sponge
+
+        self.matrix_cache_size = matrix_cache_size # Number of expanded matrices A^T kept per (rho, is_ntt), 0 disables the cache
+        self.matrix_cache_lock = Lock() # Guards the LRU order and the counters, the cache is shared between threads
+        self.clear_matrix_cache()
+        
+    # Drop all cached matrices and reset the hit/miss counters
+    def clear_matrix_cache(self):
+        with self.matrix_cache_lock:
+            self.matrix_cache = OrderedDict() # LRU order, most recently used last
+            self.matrix_cache_hits = 0
+            self.matrix_cache_misses = 0
+
     # Set the seed and random bytes 
-    def set_drbg_seed(self, seed): 
+    def set_drbg_seed(self, seed, buffer_size=0): 
         """
         Setting the seed switches the entropy source
         from os.urandom to AES256 CTR DRBG
+
+        A `buffer_size` serves the 32 byte requests from larger
+        DRBG calls, faster but no longer reproducing the KAT files
         
         Note: requires pycryptodome for AES impl.
         (Seemed overkill to code my own AES for Kyber)
         """
-        self.drbg = AES256_CTR_DRBG(seed)
+        self.drbg = AES256_CTR_DRBG(seed, buffer_size=buffer_size)
         self.random_bytes = self.drbg.random_bytes
 
     # Reset the seed with existing seed value
@@ -84,7 +142,6 @@ class Kyber:
             self.drbg.reseed(seed)
         
     # Extended Output Function (XOF): Hash the bytes32 + a + b values (bytes) using the shake_128 algorithm and produce the output with specified "length"
-    @staticmethod
     def _xof(self, bytes32, a, b, length):
         """
         XOF: B^* x B x B -> B*
@@ -94,19 +151,48 @@ class Kyber:
         if len(input_bytes) != 34:
             raise ValueError(f"Input bytes should be one 32 byte array and 2 single bytes.")
 
-        self._xof_bytes32       = bytes32
-        self._xof_a             = a
-        self._xof_b             = b
-        self._xof_length        = length
-        self._xof_input_bytes   = input_bytes
+        output = self.hash.shake128(input_bytes, length)
+
+        cap = capturing("xof")
+        if cap:
+            cap.record("xof", bytes32=bytes32, a=a, b=b, length=length, input_bytes=input_bytes, output=output)
 
-        #print(f'SHAKE128:{len(input_bytes)}, {length}')
-        return shake_128(input_bytes).digest(length)
-        # return SHAKE128(input_bytes, length)
+        return output
     
+    def _xof_batch(self, bytes32, pairs, length):
+        """
+        The XOF of every (a, b) of `pairs` in one backend call
+        """
+        inputs = [bytes32 + a + b for a, b in pairs]
+        if any(len(input_bytes) != 34 for input_bytes in inputs):
+            raise ValueError(f"Input bytes should be one 32 byte array and 2 single bytes.")
+
+        outputs = self.hash.shake128_batch(inputs, length)
+
+        cap = capturing("xof")
+        if cap:
+            for (a, b), input_bytes, output in zip(pairs, inputs, outputs):
+                cap.record("xof", bytes32=bytes32, a=a, b=b, length=length, input_bytes=input_bytes, output=output)
+
+        return outputs
+
+    def _xof_reader(self, bytes32, a, b, offset):
+        """
+        Incremental reads of the XOF stream after its first `offset`
+        bytes: every call returns the next `length` bytes. The stream
+        is only set up on the first read.
+        """
+        stream = None
+        def read(length):
+            nonlocal stream
+            if stream is None:
+                stream = self.hash.shake128_stream(bytes32 + a + b)
+                stream.squeeze(offset)
+            return stream.squeeze(length)
+        return read
+
     # Pseudorandom Function (PRF): Hash the s + b values (bytes) using the shake_256 algorithm and product the output with specified "length"
-    @staticmethod  
-    def _prf(s, b, length): 
+    def _prf(self, s, b, length): 
         """
         PRF: B^32 x B -> B^*
         """
@@ -114,40 +200,29 @@ class Kyber:
         if len(input_bytes) != 33:
             raise ValueError(f"Input bytes should be one 32 byte array and one single byte.")
         
-        #print(f'SHAKE256:{len(input_bytes)}, {length}')
-        return shake_256(input_bytes).digest(length)
-        # return SHAKE256(input_bytes, length)
+        return self.hash.shake256(input_bytes, length)
     
     # Hash the input_bytes by sha3_256 algorithm
-    @staticmethod
-    def _h(input_bytes): 
+    def _h(self, input_bytes): 
         """
         H: B* -> B^32
         """
-        #print(f'SHA3_256:{len(input_bytes)}')
-        return sha3_256(input_bytes).digest() # 32 bytes long
-        # return SHA3_256(input_bytes)
+        return self.hash.sha3_256(input_bytes) # 32 bytes long
     
     # Hash the input_bytes by sha3_512 algorithm
-    @staticmethod  
-    def _g(input_bytes): 
+    def _g(self, input_bytes): 
         """
         G: B* -> B^32 x B^32
         """
-        output = sha3_512(input_bytes).digest() # 64 bytes long
-        # output = SHA3_512(input_bytes)
-        #print(f'SHA3_512:{len(input_bytes)}')
+        output = self.hash.sha3_512(input_bytes) # 64 bytes long
         return output[:32], output[32:]
     
     # Key Derivation Function (KDF)
-    @staticmethod
-    def _kdf(input_bytes, length):
+    def _kdf(self, input_bytes, length):
         """
         KDF: B^* -> B^*
         """
-        #print(f'SHAKE256:{len(input_bytes)}, {length}')
-        return shake_256(input_bytes).digest(length)
-        # return SHAKE256(input_bytes, length)
+        return self.hash.shake256(input_bytes, length)
     
     # Generate an error vector that consists of "self.k" polynomials 
     # sigma: A byte sequence used as an input to a pseudo-random function (PRF).
@@ -159,21 +234,17 @@ class Kyber:
         Helper function which generates an element in the
         module from the Centered Binomial Distribution.
         """
-        elements = [] # Error vector
+        list_of_input_bytes = [] # PRF outputs of the error vector
         for _ in range(self.k):
-            input_bytes = self._prf(sigma, bytes([N]), 64*eta) # Generate an input bytes
-            poly = self.R.cbd(input_bytes, eta, is_ntt=is_ntt) # Create a polynomial
-            elements.append(poly)
+            list_of_input_bytes.append(self._prf(sigma, bytes([N]), 64*eta)) # Generate an input bytes
             N = N + 1
+        elements = self.R.cbd_batch(list_of_input_bytes, eta, is_ntt=is_ntt) # Sample all k polynomials at once
         v = self.M(elements).transpose() # An instance of Matrix class (Has been transposed from shape (k, 1) to shape (1, k))
-        v_norm = self.M(elements)
 
-        """For Test"""
-        self._generate_error_vector_v = v
-        self._generate_error_vector_v_norm = v_norm
-        self._generate_error_vector_N = N
-        self._generate_error_vector_sigma = sigma
-        self._generate_error_vector_eta = eta
+        cap = capturing("error_vector")
+        if cap:
+            v_copy = self.M([ele.copy() for ele in elements]).transpose() # Snapshot, v is transformed in place by the callers
+            cap.record("error_vector", v=v_copy, N=N, sigma=sigma, eta=eta)
 
         return v, N
         
@@ -188,20 +259,55 @@ class Kyber:
         
         When `transpose` is set to True, the matrix A is
         built as the transpose.
+
+        The last `matrix_cache_size` transposed matrices, those of
+        public keys, are kept in an LRU cache keyed on (rho, is_ntt).
+        Cached matrices are frozen and shared between callers,
+        in-place operations on them raise. The matrix A of keygen is used
+        once, it is expanded without going through the cache.
         """
-        A = []
-        for i in range(self.k):
-            row = []
-            for j in range(self.k):
-                if transpose:
-                    input_bytes = self._xof(self, rho, bytes([i]), bytes([j]), 3*self.R.n) # Generate a ninput bytes
-                else:
-                    input_bytes = self._xof(self, rho, bytes([j]), bytes([i]), 3*self.R.n) # Generate a ninput bytes
-                aij = self.R.parse(input_bytes, is_ntt=is_ntt) # Create a polynomial from the byte stream
-                row.append(aij)
-            A.append(row)
-        return self.M(A) # An instance of Matrix class
-        
+        if not transpose:
+            return self.expand_matrix(rho, is_ntt=is_ntt)[0]
+
+        key = (bytes(rho), is_ntt)
+        with self.matrix_cache_lock:
+            A = self.matrix_cache.get(key)
+            if A is not None:
+                self.matrix_cache_hits += 1
+                self.matrix_cache.move_to_end(key)
+                return A
+            self.matrix_cache_misses += 1
+
+        # Expand outside the lock, a concurrent miss on the same rho stores an equal matrix
+        A, _ = self.expand_matrix(rho, transpose=transpose, is_ntt=is_ntt)
+
+        if self.matrix_cache_size > 0:
+            A.freeze()
+            with self.matrix_cache_lock:
+                self.matrix_cache[key] = A
+                while len(self.matrix_cache) > self.matrix_cache_size:
+                    self.matrix_cache.popitem(last=False) # Evict the least recently used matrix
+        return A
+        
+    def expand_matrix(self, rho, transpose=False, is_ntt=False):
+        """
+        Expand the k x k matrix A (A^T if `transpose`) from `rho`,
+        bypassing the matrix cache: all k^2 XOF streams in one
+        `shake128_batch` call of the hash backend, then Parse of each.
+
+        Returns the matrix and its timing breakdown in seconds,
+        {"xof": ..., "parse": ...}
+        """
+        t0 = perf_counter()
+        pairs = [(bytes([i]), bytes([j])) if transpose else (bytes([j]), bytes([i])) for i in range(self.k) for j in range(self.k)]
+        streams = self._xof_batch(rho, pairs, 3*self.R.n) # 3n input bytes per entry
+        t1 = perf_counter()
+        polys = [self.R.parse(input_bytes, is_ntt=is_ntt, xof=self._xof_reader(rho, a, b, len(input_bytes))) # Rest of the same stream, if parse runs short
+                 for (a, b), input_bytes in zip(pairs, streams)]
+        A = self.M([polys[self.k*i:self.k*(i+1)] for i in range(self.k)]) # An instance of Matrix class
+        t2 = perf_counter()
+        return A, {"xof": t1 - t0, "parse": t2 - t1}
+
     def _cpapke_keygen(self):
         """
         Algorithm 4 (Key Generation)
@@ -213,17 +319,17 @@ class Kyber:
             Secret Key (12*k*n) / 8      bytes
             Public Key (12*k*n) / 8 + 32 bytes
         """
-        print(f'-------------------------')
-        print(f'Kyber Key Generation')
-        print(f'-------------------------')
+        trace = get_trace_hook("kyber")
+        if trace:
+            trace("kyber", "keygen")
         # Generate random value, hash and split
         d = self.random_bytes(32)
         rho, sigma = self._g(d)
         # Set counter for PRF
         N = 0
         
-        # Generate the matrix A ∈ R^kxk
-        A = self._generate_matrix_from_seed(rho, is_ntt=True)
+        # Generate the matrix A ∈ R^kxk, used once so not cached
+        A, _ = self.expand_matrix(rho, is_ntt=True)
         
         # Generate the error vector s ∈ R^k
         s, N = self._generate_error_vector(sigma, self.eta_1, N)
@@ -234,7 +340,7 @@ class Kyber:
         e.to_ntt() 
                            
         # Construct the public key
-        t = (A @ s).to_montgomery() + e
+        t = A.ntt_matvec(s).to_montgomery().iadd_(e)
         
         # Reduce vectors mod^+ q
         t.reduce_coefficents()
@@ -245,34 +351,48 @@ class Kyber:
         sk = s.encode(l=12)
         return pk, sk
         
+    def _cpapke_decode_public_key(self, pk):
+        """
+        Decode t^T and expand A^T (both in NTT form) from
+        the public key bytes pk = Encode_12(t) || rho
+        """
+        if len(pk) != 12 * self.k * self.R.n // 8 + 32:
+            raise ValueError(f"Public key must be {12 * self.k * self.R.n // 8 + 32} bytes long")
+        rho = pk[-32:]
+        
+        # Convert public_key (bytes array) to a matrix under ntt form
+        tt = self.M.decode(pk, 1, self.k, l=12, is_ntt=True)
+        
+        # Generate the matrix A^T ∈ R^(kxk)
+        At = self._generate_matrix_from_seed(rho, transpose=True, is_ntt=True)
+        return tt, At
+        
     def _cpapke_enc(self, pk, m, coins):
         """
         Algorithm 5 (Encryption)
         https://pq-crystals.org/kyber/data/kyber-specification-round3-20210804.pdf
         
         Input:
-            pk: public key
+            pk: public key (bytes or PublicKey)
             m:  message ∈ B^32
             coins:  random coins ∈ B^32
         Output:
             c:  ciphertext
         """
-        print(f'-------------------------')
-        print(f'Kyber Encryption')
-        print(f'-------------------------')
+        trace = get_trace_hook("kyber")
+        if trace:
+            trace("kyber", "enc")
         N = 0
-        rho = pk[-32:]
         
-        # Convert public_key (bytes array) to a matrix under ntt form
-        tt = self.M.decode(pk, 1, self.k, l=12, is_ntt=True)        
+        # t^T and A^T ∈ R^(kxk) under ntt form, decoded once if pk is a PublicKey
+        if isinstance(pk, PublicKey):
+            tt, At = pk.tt, pk.At
+        else:
+            tt, At = self._cpapke_decode_public_key(pk)
         
         # Encode message as polynomial
-        print(f':::Decompressing u')
         m_poly = self.R.decode(m, l=1).decompress(1)
         
-        # Generate the matrix A^T ∈ R^(kxk)
-        At = self._generate_matrix_from_seed(rho, transpose=True, is_ntt=True)
-        
         # Generate the error vector r ∈ R^k
         r, N = self._generate_error_vector(coins, self.eta_1, N)
         r.to_ntt()
@@ -285,9 +405,9 @@ class Kyber:
         e2 = self.R.cbd(input_bytes, self.eta_2)
         
         # Module/Polynomial arithmetic 
-        u = (At @ r).from_ntt() + e1
-        v = (tt @ r)[0][0].from_ntt()
-        v = v + e2 + m_poly
+        u = At.ntt_matvec(r).from_ntt().iadd_(e1)
+        v = tt.ntt_matvec(r)[0][0].from_ntt()
+        v.iadd_(e2).iadd_(m_poly)
         
         # Ciphertext to bytes
         c1 = u.compress(self.du).encode(l=self.du)
@@ -301,14 +421,14 @@ class Kyber:
         https://pq-crystals.org/kyber/data/kyber-specification-round3-20210804.pdf
         
         Input:
-            sk: secret key
+            sk: secret key (bytes or SecretKey)
             c:  message ∈ B^32
         Output:
             m:  message ∈ B^32
         """
-        print(f'-------------------------')
-        print(f'Kyber Decryption')
-        print(f'-------------------------')
+        trace = get_trace_hook("kyber")
+        if trace:
+            trace("kyber", "dec")
         # Split ciphertext to vectors
         index = self.du * self.k * self.R.n // 8
         c2 = c[index:]
@@ -320,16 +440,105 @@ class Kyber:
         # Recover the polynomial v
         v = self.R.decode(c2, l=self.dv).decompress(self.dv)
         
-        # s_transpose (already in NTT form)
-        st = self.M.decode(sk, 1, self.k, l=12, is_ntt=True)
+        # s_transpose (already in NTT form), decoded once if sk is a SecretKey
+        st = sk.st if isinstance(sk, SecretKey) else self.M.decode(sk, 1, self.k, l=12, is_ntt=True)
         
         # Recover message as polynomial
-        m = (st @ u)[0][0].from_ntt()
+        m = st.ntt_matvec(u)[0][0].from_ntt()
         m = v - m
         
         # Return message as bytes
         return m.compress(1).encode(l=1)
     
+    def _batch_error_vectors(self, seeds, eta, N):
+        """
+        CBD samples of PRF(seed, N), ..., PRF(seed, N+k-1) for every
+        seed, as a (len(seeds), k, n) array: the batched form of
+        `_generate_error_vector`
+        """
+        input_bytes = b"".join(self._prf(seed, bytes([N + i]), 64*eta) for seed in seeds for i in range(self.k))
+        return cbd_coefficients(input_bytes, eta).reshape(len(seeds), self.k, self.R.n).astype(np.int64)
+
+    def _cpapke_keygen_batch(self, ds):
+        """
+        Algorithm 4 for every 32 byte seed d in `ds`, on
+        stacked (N, k, n) arrays. Returns a list of (pk, sk).
+        """
+        helper = self.R.ntt_helper
+        rhos, sigmas = zip(*[self._g(d) for d in ds])
+        
+        # A ∈ R^kxk of every seed, (N, k, k, n)
+        A = np.stack([self.expand_matrix(rho, is_ntt=True)[0].to_numpy() for rho in rhos])
+        
+        # Error vectors s, e ∈ R^k in NTT form, (N, k, n)
+        s = helper.ntt(self._batch_error_vectors(sigmas, self.eta_1, 0))
+        e = helper.ntt(self._batch_error_vectors(sigmas, self.eta_1, self.k))
+        
+        # t = A s + e, to Montgomery form as in `_cpapke_keygen`
+        t = helper.ntt_mul(helper.mont_r2, helper.ntt_multiply_accumulate(A, s)) + e
+        
+        # Encode all keys as one block and split
+        length = 12 * self.k * self.R.n // 8
+        t_bytes = pack_bits(t % self.q, 12)
+        s_bytes = pack_bits(s % self.q, 12)
+        return [(t_bytes[i*length:(i+1)*length] + rho, s_bytes[i*length:(i+1)*length]) for i, rho in enumerate(rhos)]
+
+    def _cpapke_enc_batch(self, public_keys, ms, coins):
+        """
+        Algorithm 5 for every PublicKey, message and coins,
+        on stacked (N, k, n) arrays. Returns a list of ciphertexts.
+        """
+        helper = self.R.ntt_helper
+        count = len(public_keys)
+        
+        # t^T (N, 1, k, n) and A^T (N, k, k, n), already in NTT form
+        tt = np.stack([public_key.tt.to_numpy() for public_key in public_keys])
+        At = np.stack([public_key.At.to_numpy() for public_key in public_keys])
+        
+        # Messages as polynomials, (N, n)
+        m_poly = decompress_coefficients(unpack_bits(b"".join(ms), 1).reshape(count, self.R.n), 1, self.q)
+        
+        # Error vectors r (NTT form), e1 and error polynomials e2
+        r = helper.ntt(self._batch_error_vectors(coins, self.eta_1, 0))
+        e1 = self._batch_error_vectors(coins, self.eta_2, self.k)
+        input_bytes = b"".join(self._prf(seed, bytes([2*self.k]), 64*self.eta_2) for seed in coins)
+        e2 = cbd_coefficients(input_bytes, self.eta_2).reshape(count, self.R.n)
+        
+        # u = A^T r + e1, v = t^T r + e2 + m
+        u = helper.intt(helper.ntt_multiply_accumulate(At, r)) + e1
+        v = helper.intt(helper.ntt_multiply_accumulate(tt, r))[:, 0] + e2 + m_poly
+        
+        # Compress and encode as one block, then split
+        c1_length = self.du * self.k * self.R.n // 8
+        c2_length = self.dv * self.R.n // 8
+        c1 = pack_bits(compress_coefficients(u, self.du, self.q), self.du)
+        c2 = pack_bits(compress_coefficients(v, self.dv, self.q), self.dv)
+        return [c1[i*c1_length:(i+1)*c1_length] + c2[i*c2_length:(i+1)*c2_length] for i in range(count)]
+
+    def _cpapke_dec_batch(self, secret_keys, cs):
+        """
+        Algorithm 6 for every SecretKey and ciphertext,
+        on stacked (N, k, n) arrays. Returns a list of messages.
+        """
+        helper = self.R.ntt_helper
+        count = len(secret_keys)
+        index = self.du * self.k * self.R.n // 8
+        if any(len(c) != index + self.dv * self.R.n // 8 for c in cs):
+            raise ValueError(f"Ciphertexts must be {index + self.dv * self.R.n // 8} bytes long")
+        
+        # Recover u (NTT form) and v of every ciphertext
+        u = unpack_bits(b"".join(c[:index] for c in cs), self.du).reshape(count, self.k, self.R.n)
+        u = helper.ntt(decompress_coefficients(u, self.du, self.q))
+        v = unpack_bits(b"".join(c[index:] for c in cs), self.dv).reshape(count, self.R.n)
+        v = decompress_coefficients(v, self.dv, self.q)
+        
+        # m = v - s^T u
+        st = np.stack([secret_key.st.to_numpy() for secret_key in secret_keys])
+        m = v - helper.intt(helper.ntt_multiply_accumulate(st, u))[:, 0]
+        
+        m_bytes = pack_bits(compress_coefficients(m, 1, self.q), 1)
+        return [m_bytes[32*i:32*(i+1)] for i in range(count)]
+    
     def keygen(self):
         """
         Algorithm 7 (CCA KEM KeyGen)
@@ -351,24 +560,48 @@ class Kyber:
         sk = _sk + pk + self._h(pk) + z
         return pk, sk
         
+    def load_public_key(self, pk):
+        """
+        Parse the public key bytes once, the returned PublicKey
+        can be passed to `enc` in place of `pk` so that each
+        encapsulation only does the per-message work.
+        """
+        tt, At = self._cpapke_decode_public_key(pk)
+        return PublicKey(pk, tt, At, self._h(pk))
+        
     def enc(self, pk, key_length=32):
         """
         Algorithm 8 (CCA KEM Encapsulation)
         https://pq-crystals.org/kyber/data/kyber-specification-round3-20210804.pdf
         
         Input: 
-            pk: Public Key
+            pk: Public Key (bytes or PublicKey from `load_public_key`)
         Output:
             c:  Ciphertext
             K:  Shared key
         """
+        hpk = pk.hpk if isinstance(pk, PublicKey) else self._h(pk)
         m = self.random_bytes(32)
         m_hash = self._h(m)
-        Kbar, r = self._g(m_hash + self._h(pk))
+        Kbar, r = self._g(m_hash + hpk)
         c = self._cpapke_enc(pk, m_hash, r)
         K = self._kdf(Kbar + self._h(c), key_length)
         return c, K
 
+    def load_secret_key(self, sk):
+        """
+        Parse the secret key bytes sk = _sk || pk || H(pk) || z once,
+        the returned SecretKey can be passed to `dec` in place of `sk`
+        so that each decapsulation only does the per-ciphertext work.
+        """
+        index = 12 * self.k * self.R.n // 8
+        if len(sk) != 2*index + 96:
+            raise ValueError(f"Secret key must be {2*index + 96} bytes long")
+        st = self.M.decode(sk[:index], 1, self.k, l=12, is_ntt=True)
+        pk = sk[index:-64]
+        tt, At = self._cpapke_decode_public_key(pk)
+        return SecretKey(sk, st, PublicKey(pk, tt, At, sk[-64:-32]), sk[-32:])
+        
     def dec(self, c, sk, key_length=32):
         """
         Algorithm 9 (CCA KEM Decapsulation)
@@ -376,17 +609,20 @@ class Kyber:
         
         Input: 
             c:  ciphertext
-            sk: Secret Key
+            sk: Secret Key (bytes or SecretKey from `load_secret_key`)
         Output:
             K:  Shared key
         """
         # Extract values from `sk`
         # sk = _sk || pk || H(pk) || z
-        index = 12 * self.k * self.R.n // 8
-        _sk =  sk[:index]
-        pk = sk[index:-64]
-        hpk = sk[-64:-32]
-        z = sk[-32:]
+        if isinstance(sk, SecretKey):
+            _sk, pk, hpk, z = sk, sk.public_key, sk.hpk, sk.z
+        else:
+            index = 12 * self.k * self.R.n // 8
+            _sk =  sk[:index]
+            pk = sk[index:-64]
+            hpk = sk[-64:-32]
+            z = sk[-32:]
         
         # Decrypt the ciphertext
         _m = self._cpapke_dec(_sk, c)
@@ -401,6 +637,72 @@ class Kyber:
         # Decapsulation failed... return random value
         return self._kdf(z + self._h(c), key_length)
 
+    def keygen_batch(self, count):
+        """
+        `count` calls of `keygen` as one batch over stacked arrays.
+        Draws the same random bytes in the same order, so it returns
+        exactly the list of (pk, sk) the single calls would.
+
+        Every key expands its own matrix A, which is not batched and
+        dominates keygen, so the speedup is below that of
+        enc_batch / dec_batch.
+        
+        Needs a vectorised NTT helper, otherwise it loops over `keygen`.
+        """
+        if count == 0 or not isinstance(self.R.ntt_helper, NTTHelperNumpy):
+            return [self.keygen() for _ in range(count)]
+        
+        seeds = [(self.random_bytes(32), self.random_bytes(32)) for _ in range(count)] # d then z, as in `keygen`
+        keys = self._cpapke_keygen_batch([d for d, _ in seeds])
+        
+        # sk = sk' || pk || H(pk) || z
+        return [(pk, _sk + pk + self._h(pk) + z) for (pk, _sk), (_, z) in zip(keys, seeds)]
+        
+    def enc_batch(self, pks, key_length=32):
+        """
+        `enc` of every public key in `pks` (bytes or PublicKey, the
+        same key may repeat) as one batch over stacked arrays.
+        Returns exactly the list of (c, K) the single calls would.
+        
+        Needs a vectorised NTT helper, otherwise it loops over `enc`.
+        """
+        if len(pks) == 0 or not isinstance(self.R.ntt_helper, NTTHelperNumpy):
+            return [self.enc(pk, key_length) for pk in pks]
+        
+        public_keys = [pk if isinstance(pk, PublicKey) else self.load_public_key(pk) for pk in pks]
+        m_hashes = [self._h(self.random_bytes(32)) for _ in public_keys]
+        Kbar_r = [self._g(m_hash + public_key.hpk) for m_hash, public_key in zip(m_hashes, public_keys)]
+        cs = self._cpapke_enc_batch(public_keys, m_hashes, [r for _, r in Kbar_r])
+        return [(c, self._kdf(Kbar + self._h(c), key_length)) for c, (Kbar, _) in zip(cs, Kbar_r)]
+        
+    def dec_batch(self, cs, sks, key_length=32):
+        """
+        `dec` of every ciphertext in `cs` as one batch over stacked
+        arrays. `sks` is one secret key for all ciphertexts or a list
+        with one per ciphertext (bytes or SecretKey). Returns exactly
+        the list of keys the single calls would.
+        
+        Needs a vectorised NTT helper, otherwise it loops over `dec`.
+        """
+        if isinstance(sks, (bytes, SecretKey)):
+            sks = [sks] * len(cs)
+        if len(sks) != len(cs):
+            raise ValueError("Need one secret key per ciphertext")
+        if len(cs) == 0 or not isinstance(self.R.ntt_helper, NTTHelperNumpy):
+            return [self.dec(c, sk, key_length) for c, sk in zip(cs, sks)]
+        
+        loaded = {sk: self.load_secret_key(sk) for sk in set(sk for sk in sks if not isinstance(sk, SecretKey))}
+        secret_keys = [sk if isinstance(sk, SecretKey) else loaded[sk] for sk in sks]
+        
+        # Decrypt, then re-encrypt for the Fujisaki-Okamoto check
+        _ms = self._cpapke_dec_batch(secret_keys, cs)
+        _Kbar_r = [self._g(_m + secret_key.hpk) for _m, secret_key in zip(_ms, secret_keys)]
+        _cs = self._cpapke_enc_batch([secret_key.public_key for secret_key in secret_keys], _ms, [_r for _, _r in _Kbar_r])
+        
+        # K from Kbar if decapsulation was successful, from z otherwise
+        return [self._kdf((_Kbar if c == _c else secret_key.z) + self._h(c), key_length)
+                for c, _c, (_Kbar, _), secret_key in zip(cs, _cs, _Kbar_r, secret_keys)]
+
 # Initialise with default parameters for easy import
 Kyber512 = Kyber(DEFAULT_PARAMETERS["kyber_512"])
 Kyber768 = Kyber(DEFAULT_PARAMETERS["kyber_768"])
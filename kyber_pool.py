@@ -0,0 +1,139 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from kyber import Kyber512, Kyber768, Kyber1024
+from aes256_ctr_drbg import AES256_CTR_DRBG
+
+# Kyber instances of a worker process, by parameter set name
+WORKER_KYBER = {
+    "kyber_512" : Kyber512,
+    "kyber_768" : Kyber768,
+    "kyber_1024" : Kyber1024,
+}
+
+def init_worker():
+    """
+    Runs once in every worker: one keygen/enc/dec per parameter
+    set so the first chunk does not pay for warming up
+    """
+    for kyber in WORKER_KYBER.values():
+        pk, sk = kyber.keygen()
+        c, _ = kyber.enc(pk)
+        kyber.dec(c, sk)
+
+def run_item(kyber, operation, item, key_length):
+    if operation == "keygen":
+        return kyber.keygen()
+    if operation == "enc":
+        return kyber.enc(item, key_length)
+    c, sk = item
+    return kyber.dec(c, sk, key_length)
+
+def run_chunk(parameter_set, operation, items, seeds, key_length):
+    """
+    Runs one chunk of work items in a worker, returns one
+    (result, None) or (None, error) per item so that a bad item
+    does not fail the rest of its chunk.
+
+    Without seeds the chunk goes through the batch API on system
+    randomness, and item by item if the batch raises. With seeds
+    every item gets its own DRBG, so its result does not depend on
+    the chunk or worker it lands in.
+    """
+    kyber = WORKER_KYBER[parameter_set]
+    if seeds is None:
+        kyber.drbg = None
+        kyber.random_bytes = os.urandom
+        try:
+            if operation == "keygen":
+                results = kyber.keygen_batch(len(items))
+            elif operation == "enc":
+                results = kyber.enc_batch(items, key_length)
+            else:
+                results = kyber.dec_batch([c for c, _ in items], [sk for _, sk in items], key_length)
+            return [(result, None) for result in results]
+        except Exception:
+            seeds = [None] * len(items)
+
+    results = []
+    for item, seed in zip(items, seeds):
+        try:
+            if seed is not None:
+                kyber.set_drbg_seed(seed)
+            results.append((run_item(kyber, operation, item, key_length), None))
+        except Exception as e:
+            results.append((None, e))
+    return results
+
+class KyberPool:
+    """
+    Runs Kyber keygen/enc/dec over a pool of worker processes.
+
+    Every worker holds warmed up Kyber512/768/1024 instances, the
+    parameter set of a call is chosen by its name in
+    DEFAULT_PARAMETERS. Work items are sent in chunks of `chunksize`
+    and results come back in submission order.
+
+    After `set_drbg_seed` every work item is seeded with the next 48
+    bytes of a DRBG on that seed, in submission order, so results are
+    reproducible independent of the number of workers and chunksize.
+    """
+    def __init__(self, max_workers=None, chunksize=16):
+        self.chunksize = chunksize
+        self.max_workers = max_workers or os.cpu_count() # The executor's default
+        self.drbg = None
+        self.executor = ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    # Seed the per work item DRBG seeds, None goes back to system randomness
+    def set_drbg_seed(self, seed):
+        self.drbg = None if seed is None else AES256_CTR_DRBG(seed)
+
+    def _map(self, parameter_set, operation, items, key_length=32):
+        if parameter_set not in WORKER_KYBER:
+            raise ValueError(f"Unknown parameter set {parameter_set}, expected one of {list(WORKER_KYBER)}")
+
+        futures = []
+        for i in range(0, len(items), self.chunksize):
+            chunk = items[i:i + self.chunksize]
+            seeds = None if self.drbg is None else [self.drbg.random_bytes(48) for _ in chunk]
+            futures.append(self.executor.submit(run_chunk, parameter_set, operation, chunk, seeds, key_length))
+
+        results = []
+        for future in futures:
+            for result, error in future.result():
+                if error is not None:
+                    raise error
+                results.append(result)
+        return results
+
+    def keygen(self, parameter_set, count):
+        """
+        `count` key pairs, as a list of (pk, sk)
+        """
+        return self._map(parameter_set, "keygen", [None] * count)
+
+    def enc(self, parameter_set, pks, key_length=32):
+        """
+        Encapsulate to every public key in `pks`, as a list of (c, K)
+        """
+        return self._map(parameter_set, "enc", [bytes(pk) for pk in pks], key_length)
+
+    def dec(self, parameter_set, cs, sks, key_length=32):
+        """
+        Decapsulate every ciphertext in `cs`, with one secret key
+        for all of them or one per ciphertext, as a list of K
+        """
+        if not isinstance(sks, (list, tuple)):
+            sks = [sks] * len(cs)
+        if len(sks) != len(cs):
+            raise ValueError("Need one secret key per ciphertext")
+
+        return self._map(parameter_set, "dec", [(c, bytes(sk)) for c, sk in zip(cs, sks)], key_length)
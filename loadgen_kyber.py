@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import struct
+from time import perf_counter
+from async_kyber import AsyncKyber
+from kyber_pool import KyberPool
+
+# Frames on the socket: 4 byte big endian length, then the payload.
+# Requests are b"E" (encapsulate to the server key, answered with c)
+# or b"D" + c (decapsulate c with the server key, answered with K).
+
+async def read_frame(reader):
+    length, = struct.unpack(">I", await reader.readexactly(4))
+    return await reader.readexactly(length)
+
+def write_frame(writer, payload):
+    writer.write(struct.pack(">I", len(payload)) + payload)
+
+async def serve_client(kyber, pk, sk, reader, writer):
+    try:
+        while True:
+            request = await read_frame(reader)
+            if request[:1] == b"E":
+                c, _ = await kyber.enc(pk)
+                write_frame(writer, c)
+            else:
+                write_frame(writer, await kyber.dec(request[1:], sk))
+            await writer.drain()
+    except asyncio.IncompleteReadError:
+        pass
+    finally:
+        writer.close()
+
+async def run_client(port, requests, latencies):
+    """
+    One connection doing `requests` encapsulate + decapsulate round
+    trips, appending the latency of every round trip in seconds
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for _ in range(requests):
+        t0 = perf_counter()
+        write_frame(writer, b"E")
+        c = await read_frame(reader)
+        write_frame(writer, b"D" + c)
+        await read_frame(reader)
+        latencies.append(perf_counter() - t0)
+    writer.close()
+    await writer.wait_closed()
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+async def main(args):
+    pool = KyberPool(max_workers=args.workers)
+    async with AsyncKyber(args.parameter_set, pool=pool, max_batch=args.max_batch, max_latency=args.max_latency / 1000, max_queue=args.max_queue) as kyber:
+        pk, sk = await kyber.keygen()
+        server = await asyncio.start_server(lambda r, w: serve_client(kyber, pk, sk, r, w), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        latencies = []
+        t0 = perf_counter()
+        await asyncio.gather(*[run_client(port, args.requests, latencies) for _ in range(args.clients)])
+        elapsed = perf_counter() - t0
+
+        server.close()
+        await server.wait_closed()
+        batches = kyber.batches
+    pool.shutdown()
+
+    latencies.sort()
+    print(f"-"*27)
+    print(f"  {args.parameter_set} | {args.clients} clients x {args.requests} round trips")
+    print(f"-"*27)
+    print(f"Round trips: {len(latencies)} in {round(elapsed, 3)} s ({round(len(latencies) / elapsed, 1)}/s)")
+    print(f"Batches    : {batches}")
+    print(f"p50        : {round(1000 * percentile(latencies, 50), 2)} ms")
+    print(f"p99        : {round(1000 * percentile(latencies, 99), 2)} ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load generator for AsyncKyber against a loopback socket server")
+    parser.add_argument("--parameter-set", default="kyber_512", choices=["kyber_512", "kyber_768", "kyber_1024"])
+    parser.add_argument("--clients", type=int, default=64, help="concurrent connections")
+    parser.add_argument("--requests", type=int, default=20, help="encapsulate + decapsulate round trips per connection")
+    parser.add_argument("--workers", type=int, default=None, help="KyberPool workers (default: cpu count)")
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-latency", type=float, default=5.0, help="max batching delay in ms")
+    parser.add_argument("--max-queue", type=int, default=1024)
+    asyncio.run(main(parser.parse_args()))
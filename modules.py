@@ -1,3 +1,9 @@
+import numpy as np
+from polynomials import LAZY_BOUND, LAZY_MUL_BOUND
+from utils import pack_bits, unpack_bits
+from capture import capturing
+from vectors import vector_writer, concat_fields
+
 class Module:
     def __init__(self, ring):
         self.ring = ring # PolynomialRing
@@ -12,14 +18,29 @@ class Module:
         else:
             if self.ring.n*l*m*n > len(input_bytes)*8:
                 raise ValueError("Byte length is too short for given l")
-            
-        chunk_length = 32*l
-        byte_chunks = [input_bytes[i:i+chunk_length] for i in range(0, len(input_bytes), chunk_length)]
-        matrix = [[0 for _ in range(n)] for _ in range(m)] # m rows and n cols
-        for i in range(m):
-            for j in range(n):
-                mij = self.ring.decode(byte_chunks[n*i+j], l=l, is_ntt=is_ntt)
-                matrix[i][j] = mij
+
+        # Unpack all m*n polynomials in one go, each element gets a row of the block as its buffer
+        chunk_length = self.ring.n*l // 8
+        block = unpack_bits(input_bytes[:m*n*chunk_length], l).astype(np.int32).reshape(m, n, self.ring.n)
+        matrix = [[self.ring(block[i][j], is_ntt=is_ntt, bound=2**l - 1) for j in range(n)] for i in range(m)] # m rows and n cols
+
+        cap = capturing("decode")
+        if cap:
+            for i in range(m):
+                for j in range(n):
+                    offset = (i*n + j)*chunk_length
+                    cap.record("decode", input_bytes=input_bytes[offset:offset + chunk_length], l=l, coefficients=block[i][j].tolist(), output=matrix[i][j].copy())
+
+        writer = vector_writer("decode")
+        if writer:
+            for i in range(m):
+                for j in range(n):
+                    offset = (i*n + j)*chunk_length
+                    vecDict = dict()
+                    vecDict['i_ibytes'] = int.from_bytes(input_bytes[offset:offset + chunk_length])
+                    vecDict['i_l'] = int(l)
+                    vecDict['o_coeffs'] = concat_fields(block[i][j].tolist(), l)
+                    writer.write('decode', vecDict, 384*8//4)
 
         return self(matrix)
 
@@ -55,6 +76,7 @@ class Module:
             self.rows = matrix_elements # A 2D matrix of Polynomial class
             self.m = len(matrix_elements) # Number of rows
             self.n = len(matrix_elements[0]) # Number of cols
+            self.frozen = False # Set by freeze()
             if not self.check_dimensions():
                 raise ValueError("Inconsistent row lengths in matrix")
 
@@ -74,6 +96,7 @@ class Module:
 
         # Transpose the self.rows matrix and assign again for self
         def transpose_self(self):
+            self.check_writable()
             self.m, self.n = self.n, self.m
             self.rows = [list(item) for item in zip(*self.rows)]
 
@@ -81,13 +104,30 @@ class Module:
             
         # Reduce all coefficients value by mod q with each coefficient for polynomials in a row ~ polynomial ring
         def reduce_coefficents(self):
+            self.check_writable()
             for row in self.rows:
                 for ele in row:
                     ele.reduce_coefficents()
             return self
+
+        # Stack the coefficients of all elements into one (m, n, ring degree) array
+        def to_numpy(self):
+            return np.stack([np.stack([ele.coeffs for ele in row]) for row in self.rows])
+
+        # Make the matrix immutable: tuple rows of frozen elements, in-place operations on it then raise
+        def freeze(self):
+            self.rows = tuple(tuple(ele.freeze() for ele in row) for row in self.rows)
+            self.frozen = True
+            return self
+
+        # Raise if the matrix is frozen, called by the in-place operations
+        def check_writable(self):
+            if self.frozen:
+                raise ValueError("Cannot modify a frozen matrix in place, use a copy")
             
         # Converts the coefficients of a polynomial "poly" to Montgomery form for polynomials in a row ~ polynomial ring
         def to_montgomery(self):
+            self.check_writable()
             for row in self.rows:
                 for ele in row:
                     ele.to_montgomery()
@@ -96,15 +136,47 @@ class Module:
 
         # Encodes the polynomial as a byte array for polynomials in a row ~ polynomial ring
         def encode(self, l=None):
-            output = b""
-            for row in self.rows:
-                for j in range(self.n): # self.n: number of columns in a matrix
-                    output += row[j].encode(l=l)
+            """
+            With `l` given, all elements are packed as one block
+            """
+            if l is None:
+                output = b""
+                for row in self.rows:
+                    for j in range(self.n): # self.n: number of columns in a matrix
+                        output += row[j].encode(l=l)
+
+                return output
+
+            ring = self.parent.ring
+            if ring.lazy_reduction:
+                for row in self.rows:
+                    for ele in row:
+                        ele.reduce_bound(ring.q - 1)
+
+            elements = [ele for row in self.rows for ele in row]
+            output = pack_bits(np.stack([ele.coeffs for ele in elements]), l)
+
+            cap = capturing("encode")
+            if cap:
+                chunk_length = ring.n*l // 8
+                for i, ele in enumerate(elements):
+                    cap.record("encode", l=l, coefficients=ele.coeffs.tolist(), output=output[i*chunk_length:(i+1)*chunk_length])
+
+            writer = vector_writer("encode")
+            if writer:
+                chunk_length = ring.n*l // 8
+                for i, ele in enumerate(elements):
+                    vecDict = dict()
+                    vecDict['i_coeffs'] = concat_fields(ele.coeffs.tolist(), 12)
+                    vecDict['i_l'] = int(l)
+                    vecDict['o_obytes'] = int.from_bytes(output[i*chunk_length:(i+1)*chunk_length])
+                    writer.write('encode', vecDict, 384*8//4)
 
             return output
             
         # Compresses the polynomial coefficients using lossy compression for polynomials in a row ~ polynomial ring
         def compress(self, d):
+            self.check_writable()
             for row in self.rows:
                 for ele in row:
                     ele.compress(d)
@@ -113,6 +185,7 @@ class Module:
         
         # Decompresses the polynomial coefficients for polynomials in a row ~ polynomial ring
         def decompress(self, d):
+            self.check_writable()
             for row in self.rows:
                 for ele in row:
                     ele.decompress(d)
@@ -121,17 +194,30 @@ class Module:
     
         # Converts a polynomial to Number Theoretic Transform (NTT) form for polynomials in a row ~ polynomial ring
         def to_ntt(self):
-            for row in self.rows:
-                for ele in row:
-                    ele.to_ntt()
+            """
+            All elements go through the ring's NTT helper as one
+            batch, so a vectorised helper transforms them together.
+            """
+            self.check_writable()
+            ring = self.parent.ring
+            if ring.ntt_helper is None:
+                raise ValueError("Can only perform NTT transform when parent element has an NTT Helper")
+
+            elements = [ele for row in self.rows for ele in row]
+            if ring.lazy_reduction:
+                for ele in elements:
+                    ele.reduce_bound(ring.ntt_helper.ntt_input_bound(LAZY_BOUND))
+            ring.ntt_helper.to_ntt_batch(elements)
 
             return self
     
         # Converts a polynomial from NTT form and performs a multiplication by a Montgomery factor for polynomials in a row ~ polynomial ring
         def from_ntt(self):
-            for row in self.rows:
-                for ele in row:
-                    ele.from_ntt()
+            self.check_writable()
+            if self.parent.ring.ntt_helper is None:
+                raise ValueError("Can only perform NTT transform when parent element has an NTT Helper")
+
+            self.parent.ring.ntt_helper.from_ntt_batch([ele for row in self.rows for ele in row])
 
             return self        
                     
@@ -141,7 +227,7 @@ class Module:
 
         # Compare 2 matrices to see if they are equal or not
         def __eq__(self, other):
-            return other.rows == self.rows
+            return [list(row) for row in other.rows] == [list(row) for row in self.rows]
 
         # Returns the sum of the self and other matrices
         # Behave like self_matrix + other_matrix
@@ -173,6 +259,30 @@ class Module:
             
             return self
 
+        # Adds the other matrix into self element by element, in place
+        def iadd_(self, other):
+            if self.get_dim() != other.get_dim():
+                raise ValueError("Matrices are not of the same dimensions")
+            self.check_writable()
+
+            for self_row, other_row in zip(self.rows, other.rows):
+                for a, b in zip(self_row, other_row):
+                    a.iadd_(b)
+
+            return self
+
+        # Subtracts the other matrix from self element by element, in place
+        def isub_(self, other):
+            if self.get_dim() != other.get_dim():
+                raise ValueError("Matrices are not of the same dimensions")
+            self.check_writable()
+
+            for self_row, other_row in zip(self.rows, other.rows):
+                for a, b in zip(self_row, other_row):
+                    a.isub_(b)
+
+            return self
+
         # Returns the difference of the self and other matrices 
         # Behave like self_matrix - other_matrix
         def __sub__(self, other):
@@ -216,10 +326,57 @@ class Module:
             if self.n != other.m:
                 raise ValueError("Matrices are of incompatible dimensions")
 
-            new_elements = [[sum(a*b for a,b in zip(A_row, B_col)) for B_col in other.transpose().rows] for A_row in self.rows]
+            B_cols = other.transpose().rows
+            new_elements = []
+            for A_row in self.rows:
+                new_row = []
+                for B_col in B_cols:
+                    # Accumulate the products in place rather than through `sum`
+                    acc = A_row[0] * B_col[0]
+                    for a, b in zip(A_row[1:], B_col[1:]):
+                        acc.iadd_(a*b)
+                    new_row.append(acc)
+                new_elements.append(new_row)
 
             return self.parent(new_elements)
 
+        # Returns the product of the self matrix and the column vector "other", both in NTT form
+        def ntt_matvec(self, other):
+            """
+            Denoted A @ v, for A (m x k) and v (k x 1) in NTT form.
+
+            Fused multiply-accumulate: every output polynomial is
+            accumulated over the k products in one pass by the
+            ring's NTT helper and reduced once, into [0, q).
+            """
+            if not isinstance(other, Module.Matrix):
+                raise TypeError("Can only multiply matrcies with other matrices")
+            
+            if self.parent != other.parent:
+                raise TypeError("Matricies must have the same base ring")
+            
+            if self.n != other.m or other.n != 1:
+                raise ValueError("Matrices are of incompatible dimensions")
+
+            ring = self.parent.ring
+            if ring.ntt_helper is None:
+                raise ValueError("Can only perform ntt reduction when parent element has an NTT Helper")
+
+            col = [row[0] for row in other.rows]
+            elements = [ele for row in self.rows for ele in row] + col
+            if not all(ele.is_ntt for ele in elements):
+                raise ValueError("Can only multiply using NTT if both polynomials are in NTT form")
+
+            if ring.lazy_reduction:
+                for ele in elements:
+                    ele.reduce_bound(LAZY_MUL_BOUND)
+
+            new_coeffs = ring.ntt_helper.ntt_multiply_accumulate(
+                                [[a.coeffs for a in row] for row in self.rows],
+                                [b.coeffs for b in col])
+
+            return self.parent([[ring(c, is_ntt=True, bound=ring.q - 1)] for c in new_coeffs])
+
         # Define how instances of Matrix are represented as strings when using the repr() function
         def __repr__(self):
             if len(self.rows) == 1:
@@ -9,6 +9,8 @@ TODOs:
 - Allow for kyber and dilithium NTT in one file. 
 
 """
+import numpy as np
+from tracing import get_trace_hook
 
 NTT_PARAMETERS = {
     "kyber" : {
@@ -71,7 +73,8 @@ class NTTHelper():
         
     # Converts the coefficients of a polynomial "poly" to Montgomery form
     def to_montgomery(self, poly):
-        poly.coeffs = [self.ntt_mul(self.mont_r2, c) for c in poly.coeffs]
+        poly.coeffs[:] = [self.ntt_mul(self.mont_r2, c) for c in poly.coeffs.tolist()]
+        poly.bound = self.q - 1
 
         return poly
 
@@ -120,6 +123,8 @@ class NTTHelper():
         
     # Multiplies two sets of polynomial coefficients "f_coeffs" and "g_coeffs" using NTT-based multiplication
     def ntt_coefficient_multiplication(self, f_coeffs, g_coeffs):
+        f_coeffs = [int(c) for c in f_coeffs]
+        g_coeffs = [int(c) for c in g_coeffs]
         new_coeffs = []
         for i in range(64):
             r0, r1 = self.ntt_base_multiplication(
@@ -134,6 +139,68 @@ class NTTHelper():
 
         return new_coeffs
         
+    # Multiplies two sets of polynomial coefficients like "ntt_coefficient_multiplication", with fewer reductions
+    def ntt_coefficient_multiplication_lazy(self, f_coeffs, g_coeffs):
+        """
+        Lazy reduction variant: the products making up r0 and r1
+        are summed before a single Montgomery reduction, so every
+        base multiplication reduces three times instead of five.
+        The result agrees with `ntt_coefficient_multiplication`
+        modulo q, and lies in [0, q).
+        """
+        f_coeffs = [int(c) for c in f_coeffs]
+        g_coeffs = [int(c) for c in g_coeffs]
+        new_coeffs = []
+        for i in range(64):
+            for j, zeta in ((0, self.zetas[64+i]), (2, -self.zetas[64+i])):
+                a0, a1 = f_coeffs[4*i+j], f_coeffs[4*i+j+1]
+                b0, b1 = g_coeffs[4*i+j], g_coeffs[4*i+j+1]
+                r0 = self.montgomery_reduce(self.ntt_mul(a1, b1) * zeta + a0 * b0)
+                r1 = self.montgomery_reduce(a0 * b1 + a1 * b0)
+                new_coeffs += [r0, r1]
+
+        return new_coeffs
+
+    # Multiply-accumulate of NTT form rows, sum_j f_block[i][j] * g_block[j] for every row i
+    def ntt_multiply_accumulate(self, f_block, g_block):
+        """
+        Matrix-vector product in NTT form: `f_block` holds m rows of
+        k coefficient lists, `g_block` holds k coefficient lists.
+
+        The partial products of all k terms are summed first, so
+        every output polynomial is reduced once, into [0, q).
+        The result agrees with summing `ntt_coefficient_multiplication`
+        over the row modulo q.
+        """
+        new_rows = []
+        for f_row in f_block:
+            s00, s01, s11 = [0]*128, [0]*128, [0]*128
+            for f_coeffs, g_coeffs in zip(f_row, g_block):
+                f_coeffs = [int(c) for c in f_coeffs]
+                g_coeffs = [int(c) for c in g_coeffs]
+                for i in range(128):
+                    a0, a1 = f_coeffs[2*i], f_coeffs[2*i+1]
+                    b0, b1 = g_coeffs[2*i], g_coeffs[2*i+1]
+                    s00[i] += a0 * b0
+                    s01[i] += a0 * b1 + a1 * b0
+                    s11[i] += a1 * b1
+            new_coeffs = []
+            for i in range(128):
+                zeta = self.zetas[64 + i//2] if i % 2 == 0 else -self.zetas[64 + i//2]
+                new_coeffs += [self.montgomery_reduce(self.montgomery_reduce(s11[i]) * zeta + s00[i]),
+                               self.montgomery_reduce(s01[i])]
+            new_rows.append(new_coeffs)
+
+        return new_rows
+
+    # Largest input |coefficient| for which the output of "to_ntt" stays within "limit"
+    def ntt_input_bound(self, limit):
+        """
+        Each of the 7 forward layers adds or subtracts a value
+        in [0, q) without reducing (n = 256)
+        """
+        return limit - 7*(self.q - 1)
+        
     # Converts a polynomial to Number Theoretic Transform (NTT) form
     def to_ntt(self, poly):
         """
@@ -147,27 +214,29 @@ class NTTHelper():
         if poly.is_ntt:
             raise ValueError("Cannot convert NTT form polynomial to NTT form")
 
+        trace = get_trace_hook("ntt")
         k, l = 1, 128
-        coeffs = poly.coeffs
+        coeffs = poly.coeffs.tolist()
         while l >= 2:
-            print(f'l          : {l}')
+            if trace:
+                trace("ntt", "layer", l=l)
             start = 0
             while start < 256:
                 zeta = self.zetas[k]
-                print(f'start      : {start}')
-                print(f'k          : {k}')
-                print(f'zeta       : {zeta}')
-                print(f'coeffs     : {coeffs}')
+                if trace:
+                    trace("ntt", "group", start=start, k=k, zeta=zeta, coeffs=list(coeffs))
                 k = k + 1
                 for j in range(start, start + l):
                     t = self.ntt_mul(zeta, coeffs[j+l])
-                    print(f'index      : {j:3},{j+l:3}')
+                    if trace:
+                        trace("ntt", "butterfly", index=(j, j+l))
                     coeffs[j+l] = coeffs[j] - t
                     coeffs[j]   = coeffs[j] + t
                 start = l + (j + 1)
             l = l >> 1
-            print(f'-----------------------')
 
+        poly.coeffs[:] = coeffs
+        poly.bound += 7*(self.q - 1)
         poly.is_ntt = True
 
         return poly
@@ -193,7 +262,7 @@ class NTTHelper():
             
         l, l_upper = 2, 128
         k = l_upper - 1
-        coeffs = poly.coeffs
+        coeffs = poly.coeffs.tolist()
         while l <= 128:
             start = 0
             while start < poly.parent.n:
@@ -210,13 +279,203 @@ class NTTHelper():
         for j in range(poly.parent.n):
             coeffs[j] = self.ntt_mul(coeffs[j], self.f)
             
+        poly.coeffs[:] = coeffs
+        poly.bound = self.q - 1
         poly.is_ntt = False
         
         return poly
+
+    # Converts every polynomial in "polys" to NTT form
+    def to_ntt_batch(self, polys):
+        """
+        Scalar fallback, transforms one polynomial at a time
+        """
+        for poly in polys:
+            self.to_ntt(poly)
+
+        return polys
+
+    # Converts every polynomial in "polys" from NTT form
+    def from_ntt_batch(self, polys):
+        """
+        Scalar fallback, transforms one polynomial at a time
+        """
+        for poly in polys:
+            self.from_ntt(poly)
+
+        return polys
     
 NTTHelperKyber = NTTHelper(NTT_PARAMETERS["kyber"])
 
 
+class NTTHelperNumpy(NTTHelper):
+    """
+    Vectorised drop-in for `NTTHelper`. Each of the seven
+    butterfly layers is one NumPy operation over the whole
+    polynomial, with the zetas of every layer sliced out of
+    `zetas` once at construction.
+
+    The arithmetic is the same as in `NTTHelper` (no reduction
+    in the forward butterflies, Montgomery factors included), so
+    both helpers give identical coefficients. `NTTHelper` stays
+    the scalar reference.
+
+    Only implemented (currently) for n = 256
+    """
+    def __init__(self, parameter_set):
+        super().__init__(parameter_set)
+        zetas = np.array(self.zetas, dtype=np.int64)
+
+        # Layer with butterfly length l uses zetas[128//l : 256//l],
+        # in order for the NTT and in reverse order for the inverse
+        self.ntt_layers = []
+        l = 128
+        while l >= 2:
+            groups = 128 // l
+            self.ntt_layers.append((l, zetas[groups:2*groups].reshape(-1, 1)))
+            l = l >> 1
+        self.intt_layers = [(l, zeta[::-1]) for l, zeta in reversed(self.ntt_layers)]
+
+        # Base multiplication zetas: +zeta for coeffs 4i, 4i+1 and -zeta for 4i+2, 4i+3
+        self.base_zetas = np.stack([zetas[64:128], -zetas[64:128]], axis=-1)
+
+    # Converts the coefficients of a polynomial "poly" to Montgomery form
+    def to_montgomery(self, poly):
+        poly.coeffs[:] = self.ntt_mul(self.mont_r2, poly.coeffs.astype(np.int64))
+        poly.bound = self.q - 1
+
+        return poly
+
+    # Multiplies two sets of polynomial coefficients "f_coeffs" and "g_coeffs" using NTT-based multiplication
+    def ntt_coefficient_multiplication(self, f_coeffs, g_coeffs):
+        f = np.array(f_coeffs, dtype=np.int64).reshape(64, 2, 2)
+        g = np.array(g_coeffs, dtype=np.int64).reshape(64, 2, 2)
+        a0, a1 = f[..., 0], f[..., 1]
+        b0, b1 = g[..., 0], g[..., 1]
+
+        r0  = self.ntt_mul(self.ntt_mul(a1, b1), self.base_zetas)
+        r0 += self.ntt_mul(a0, b0)
+        r1  = self.ntt_mul(a0, b1)
+        r1 += self.ntt_mul(a1, b0)
+
+        return np.stack([r0, r1], axis=-1).reshape(-1)
+
+    # Multiplies two sets of polynomial coefficients with three reductions per base multiplication
+    def ntt_coefficient_multiplication_lazy(self, f_coeffs, g_coeffs):
+        f = np.asarray(f_coeffs, dtype=np.int64).reshape(64, 2, 2)
+        g = np.asarray(g_coeffs, dtype=np.int64).reshape(64, 2, 2)
+        a0, a1 = f[..., 0], f[..., 1]
+        b0, b1 = g[..., 0], g[..., 1]
+
+        r0 = self.montgomery_reduce(self.ntt_mul(a1, b1) * self.base_zetas + a0 * b0)
+        r1 = self.montgomery_reduce(a0 * b1 + a1 * b0)
+
+        return np.stack([r0, r1], axis=-1).reshape(-1)
+
+    # Multiply-accumulate of NTT form rows, sum_j f_block[i][j] * g_block[j] for every row i
+    def ntt_multiply_accumulate(self, f_block, g_block):
+        """
+        Vectorised `NTTHelper.ntt_multiply_accumulate` over an
+        (m, k, 256) block and a (k, 256) block. Sums are reduced
+        mod q before the Montgomery factor is applied, so they
+        cannot leave int64 for operands below `LAZY_MUL_BOUND`.
+
+        Leading batch axes are broadcast, e.g. an (N, m, k, 256)
+        block with an (N, k, 256) block gives (N, m, 256).
+        """
+        f = np.asarray(f_block, dtype=np.int64)
+        g = np.asarray(g_block, dtype=np.int64)
+        f = f.reshape(f.shape[:-1] + (64, 2, 2))
+        g = g.reshape(g.shape[:-2] + (1,) + g.shape[-2:-1] + (64, 2, 2)) # (..., 1, k, 64, 2, 2) against (..., m, k, 64, 2, 2)
+        a0, a1 = f[..., 0], f[..., 1]
+        b0, b1 = g[..., 0], g[..., 1]
+
+        s00 = (a0 * b0).sum(axis=-3) % self.q
+        s01 = (a0 * b1 + a1 * b0).sum(axis=-3) % self.q
+        s11 = (a1 * b1).sum(axis=-3) % self.q
+
+        r0 = self.montgomery_reduce(self.montgomery_reduce(s11) * self.base_zetas + s00)
+        r1 = self.montgomery_reduce(s01)
+
+        return np.stack([r0, r1], axis=-1).reshape(r0.shape[:-2] + (256,))
+
+    # Forward NTT over the last axis of a (..., 256) coefficient block
+    def ntt(self, coeffs):
+        """
+        Forward NTT of every row of `coeffs`, e.g. a k x 256
+        vector or a k x k x 256 matrix, in one pass per layer.
+        Returns a new int64 array of the same shape.
+
+        Traced, every layer is one "ntt" event with the rows
+        entering it.
+        """
+        trace = get_trace_hook("ntt")
+        coeffs = np.array(coeffs, dtype=np.int64)
+        for l, zetas in self.ntt_layers:
+            x = coeffs.reshape(-1, 128 // l, 2, l) # (rows, groups, lower/upper half, l)
+            if trace:
+                trace("ntt", "layer", l=l, coeffs=x.reshape(-1, 256).tolist())
+            t = self.ntt_mul(zetas, x[:, :, 1])
+            x[:, :, 1] = x[:, :, 0] - t
+            x[:, :, 0] += t
+
+        return coeffs
+
+    # Inverse NTT (with Montgomery factor) over the last axis of a (..., 256) coefficient block
+    def intt(self, coeffs):
+        """
+        Inverse NTT of every row of `coeffs`, see `ntt`. Traced
+        layers are "inverse_layer" events.
+        """
+        trace = get_trace_hook("ntt")
+        coeffs = np.array(coeffs, dtype=np.int64)
+        for l, zetas in self.intt_layers:
+            x = coeffs.reshape(-1, 128 // l, 2, l)
+            if trace:
+                trace("ntt", "inverse_layer", l=l, coeffs=x.reshape(-1, 256).tolist())
+            t = x[:, :, 0].copy()
+            x[:, :, 0] = self.reduce_mod_q(t + x[:, :, 1])
+            x[:, :, 1] = self.ntt_mul(zetas, x[:, :, 1] - t)
+
+        return self.ntt_mul(coeffs, self.f)
+
+    # Converts a polynomial to Number Theoretic Transform (NTT) form
+    def to_ntt(self, poly):
+        return self.to_ntt_batch([poly])[0]
+
+    # Converts a polynomial from NTT form and performs a multiplication by a Montgomery factor
+    def from_ntt(self, poly):
+        return self.from_ntt_batch([poly])[0]
+
+    # Converts every polynomial in "polys" to NTT form with a single batched transform
+    def to_ntt_batch(self, polys):
+        if any(poly.is_ntt for poly in polys):
+            raise ValueError("Cannot convert NTT form polynomial to NTT form")
+
+        coeffs = self.ntt([poly.coeffs for poly in polys])
+        for poly, row in zip(polys, coeffs):
+            poly.coeffs[:] = row
+            poly.bound += 7*(self.q - 1)
+            poly.is_ntt = True
+
+        return polys
+
+    # Converts every polynomial in "polys" from NTT form with a single batched transform
+    def from_ntt_batch(self, polys):
+        if not all(poly.is_ntt for poly in polys):
+            raise ValueError("Can only convert from a polynomial in NTT form")
+
+        coeffs = self.intt([poly.coeffs for poly in polys])
+        for poly, row in zip(polys, coeffs):
+            poly.coeffs[:] = row
+            poly.bound = self.q - 1
+            poly.is_ntt = False
+
+        return polys
+
+NTTHelperKyberNumpy = NTTHelperNumpy(NTT_PARAMETERS["kyber"])
+
+
 
 # def __montgomery_reduce_old(a):
 #     """
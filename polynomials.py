@@ -1,14 +1,142 @@
-import random, itertools, os
-from bitstring import Bits
+import random, itertools
+import numpy as np
 from utils import *
-from fixedpoint import FixedPoint
+from capture import capturing
+from vectors import vector_writer, concat_fields
 
-def genvec(funcName, dict, bitwidth):
-    for key, value in dict.items():
-        print(f'{key:20}: {value}')
-        os.system(f'mkdir -p ./vec/{funcName}')
-        with open(f'./vec/{funcName}/{key}.vec', 'a') as fh:
-            fh.write(hex(value).replace('0x','').rjust(bitwidth,'0')+'\n')   
+# Storage type of the coefficient buffer of a `Polynomial`.
+# Products are always formed in int64 before reduction.
+COEFF_DTYPE = np.int32
+
+# Cross-check compress/decompress against the FixedPoint model of the
+# hardware. Off by default, the production path is pure integer arithmetic
+# and does not import `fixedpoint` or `bitstring`.
+HW_VERIFICATION = False
+
+def set_hw_verification(enabled=True):
+    """
+    Switch the FixedPoint hardware model cross-check on or off
+    """
+    global HW_VERIFICATION
+    HW_VERIFICATION = enabled
+
+def decompress_constant(q, d):
+    """
+    q / 2^d in unsigned fixed point with 3 fractional bits
+    (rounded half up), returned as the integer D = 8 * (q / 2^d)
+    """
+    return ((q << 3) + (1 << (d - 1))) >> d
+
+def hw_compress(coeffs, d, q):
+    """
+    FixedPoint model of the compress hardware (2^d / q with
+    24 fractional bits). Also checks it against the float model.
+    """
+    from fixedpoint import FixedPoint
+
+    frac_bits = 24
+    compress_mod   = 2**d
+    compress_float = compress_mod / q
+    compress_float = float(FixedPoint(compress_float, signed=False, m=0, n=frac_bits))
+
+    hw_coeffs = list()
+    for coeff in coeffs:
+        mult = FixedPoint(compress_float * coeff, signed=True, m=13, n=frac_bits)
+        mult_round = FixedPoint(mult.bits[frac_bits+12:frac_bits] + mult.bits[frac_bits-1])
+        if d == 1:
+            hw_coeffs.append(mult_round.bits[0])
+        else:
+            hw_coeffs.append(mult_round.bits[d-1:0])
+
+    if hw_coeffs != [round_up(compress_float * c) % compress_mod for c in coeffs]:
+        raise ValueError("Compress FixedPoint model does not match the float model")
+
+    return [int(c) for c in hw_coeffs]
+
+def hw_decompress(coeffs, d, q):
+    """
+    FixedPoint model of the decompress hardware (q / 2^d with
+    3 fractional bits). Also checks it against the float model.
+    """
+    from fixedpoint import FixedPoint
+
+    decompress_float = q / 2**d
+    decompress_float = float(FixedPoint(decompress_float, signed=False, m=11, n=3))
+
+    hw_coeffs = list()
+    for coeff in coeffs:
+        mult = FixedPoint(decompress_float * coeff, signed=False, m=22, n=3)
+        hw_coeffs.append(FixedPoint(mult.bits[14:3] + mult.bits[2]))
+
+    if hw_coeffs != [round_up(decompress_float * c) for c in coeffs]:
+        raise ValueError("Decompress FixedPoint model does not match the float model")
+
+    return [int(c) for c in hw_coeffs]
+
+def compress_coefficients(coeffs, d, q):
+    """
+    round(2^d / q * x) mod 2^d of every coefficient, computed exactly
+    in integers for any array shape. With `set_hw_verification(True)`
+    the result is also checked against the FixedPoint hardware model.
+    """
+    x = np.asarray(coeffs, dtype=np.int64)
+    compressed = ((((x % q) << d) + q // 2) // q) & ((1 << d) - 1)
+
+    if HW_VERIFICATION:
+        if hw_compress(x.reshape(-1).tolist(), d, q) != compressed.reshape(-1).tolist():
+            raise ValueError("Compress does not match the FixedPoint hardware model")
+
+    return compressed
+
+def decompress_coefficients(coeffs, d, q):
+    """
+    round(D * x / 8) of every coefficient, D = decompress_constant(q, d),
+    for any array shape. With `set_hw_verification(True)` the result is
+    also checked against the FixedPoint hardware model.
+    """
+    x = np.asarray(coeffs, dtype=np.int64)
+    decompressed = (x * decompress_constant(q, d) + 4) >> 3
+
+    if HW_VERIFICATION:
+        if hw_decompress(x.reshape(-1).tolist(), d, q) != decompressed.reshape(-1).tolist():
+            raise ValueError("Decompress does not match the FixedPoint hardware model")
+
+    return decompressed
+
+# CBD lookup tables: entry v of CBD_TABLES[eta] is popcount(a) - popcount(b)
+# for the 2*eta bit chunk v = b << eta | a of one coefficient
+CBD_TABLES = {
+    eta: np.array([bin(v & ((1 << eta) - 1)).count("1") - bin(v >> eta).count("1")
+                   for v in range(1 << 2*eta)], dtype=COEFF_DTYPE)
+    for eta in (2, 3)
+}
+
+def cbd_coefficients(input_bytes, eta):
+    """
+    Centered binomial samples of a byte stream, one per 2*eta bits
+    (little-endian bit order). For eta = 2 every nibble and for eta = 3
+    every 6 bits of a 24-bit word index CBD_TABLES, other eta sum the
+    unpacked bits directly.
+    """
+    stream = np.frombuffer(input_bytes, dtype=np.uint8)
+    if eta == 2:
+        chunks = np.stack([stream & 0xF, stream >> 4], axis=1).reshape(-1)
+        return CBD_TABLES[2][chunks]
+    if eta == 3:
+        b = stream.reshape(-1, 3).astype(np.int32)
+        w = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        chunks = (w[:, None] >> np.arange(0, 24, 6)) & 0x3F
+        return CBD_TABLES[3][chunks.reshape(-1)]
+    bits = np.unpackbits(stream, bitorder="little").reshape(-1, 2, eta).sum(axis=2, dtype=COEFF_DTYPE)
+    return bits[:, 0] - bits[:, 1]
+
+# Lazy reduction: largest coefficient magnitude a buffer may reach
+# before it has to be reduced (the machine width of COEFF_DTYPE)
+LAZY_BOUND = int(np.iinfo(COEFF_DTYPE).max)
+
+# Lazy reduction: largest magnitude of an NTT multiplication operand,
+# so that 2 * a * b * mont_r_inv stays within int64
+LAZY_MUL_BOUND = 1 << 26
 
 class PolynomialRing:
     """
@@ -16,11 +144,12 @@ class PolynomialRing:
         
         R = GF(q) / (X^n + 1) 
     """
-    def __init__(self, q, n, ntt_helper=None):
+    def __init__(self, q, n, ntt_helper=None, lazy_reduction=False):
         self.q = q # The finite field size
         self.n = n # The degree of the polynomial
         self.element = PolynomialRing.Polynomial # A polynomial class instance
         self.ntt_helper = ntt_helper # An optional helper class for performing Number Theoretic Transforms (NTT)
+        self.lazy_reduction = lazy_reduction # Only reduce coefficients when their bound would overflow, or at encode/compress
 
     # Generates a polynomial with coefficients [0, 1]. 
     # The "is_ntt" parameter specifies whether the polynomial should be in NTT form.
@@ -36,50 +165,52 @@ class PolynomialRing:
         
     # Convert a byte stream to the NTT representation with q = 3329 (Parses a byte array into a polynomial)
     # It extracts coefficients from the byte array and creates a polynomial.
-    def parse(self, input_bytes, is_ntt=False):
+    def parse(self, input_bytes, is_ntt=False, xof=None):
         """
         Algorithm 1 (Parse)
         https://pq-crystals.org/kyber/data/kyber-specification-round3-20210804.pdf
         
         Parse: B^* -> R
-        """
-        i, j = 0, 0
-        coefficients = [0 for _ in range(self.n)]
-        while j < self.n:
-            #print(f'while loop {j}')
-            d1 = input_bytes[i] + 256*(input_bytes[i+1] % 16)
-            d2 = (input_bytes[i+1] // 16) + 16*input_bytes[i+2]
-            
-            if d1 < self.q:
-                #print(f'[PARSE - {j, i}] d1: {d1}')
-                coefficients[j] = d1
-                j = j + 1
-            
-            if d2 < self.q and j < self.n:
-                #print(f'[PARSE - {j, i}] d2: {d2}')
-                coefficients[j] = d2
-                j = j + 1
-                
-            i = i + 3
 
+        All 12-bit candidates d1, d2 of every 3 bytes are unpacked at
+        once and the first n below q are kept. If `input_bytes` runs
+        out of candidates, `xof(length)` (the next `length` bytes of
+        the same stream, e.g. `KeccakSponge.squeeze`) is asked for one
+        more SHAKE128 block at a time.
         """
-        For Test
-        """
-        self.parse_input_bytes = input_bytes
-        self.parse_coefficients = coefficients
-        self.parse_return = self(coefficients, is_ntt=is_ntt)
+        while True:
+            stream = np.frombuffer(input_bytes, dtype=np.uint8)
+            b = stream[:3*(len(stream)//3)].reshape(-1, 3).astype(np.int32)
+            d1 = b[:, 0] + 256*(b[:, 1] % 16)
+            d2 = (b[:, 1] // 16) + 16*b[:, 2]
+            candidates = np.stack([d1, d2], axis=1).reshape(-1) # d1, d2 in stream order
+            accepted = candidates[candidates < self.q]
+            if len(accepted) >= self.n:
+                break
+            if xof is None:
+                raise ValueError(f"Input bytes only give {len(accepted)} of {self.n} coefficients, pass `xof` to squeeze more")
+            input_bytes = input_bytes + xof(168)
+
+        coefficients = accepted[:self.n]
+        poly = self(coefficients, is_ntt=is_ntt, bound=self.q - 1)
+
+        cap = capturing("parse")
+        if cap:
+            cap.record("parse", input_bytes=input_bytes, coefficients=coefficients.tolist(), output=poly.copy())
 
         # print(f'[PARSE] Input Bytes  : {len(input_bytes)},{input_bytes.hex()}')
         # print(f'[PARSE] COEFF        : {[hex(x).replace('0x','') for x in coefficients]}')
         # print(f'[PARSE] MIN/MAX COEFF: {min(coefficients)},{max(coefficients)}')
         # print(f'[PARSE] Return       : {self(coefficients, is_ntt=is_ntt)}')
 
-        # vecDict = dict()
-        # vecDict['i_ibytes'] = int.from_bytes(input_bytes)
-        # vecDict['o_coeffs'] = int(''.join(Bits(uint=x, length=12).bin for x in coefficients), 2)
-        # genvec('parse', vecDict, 768*2)
+        writer = vector_writer("parse")
+        if writer:
+            vecDict = dict()
+            vecDict['i_ibytes'] = int.from_bytes(input_bytes)
+            vecDict['o_coeffs'] = concat_fields(coefficients.tolist(), 12)
+            writer.write('parse', vecDict, 768*2)
 
-        return self(coefficients, is_ntt=is_ntt)      
+        return poly
 
     # Performs Centered Binomial Distribution (CBD) on a byte array and converts it into a polynomial. 
     # This is used in the Kyber algorithm to generate random polynomials.
@@ -91,38 +222,39 @@ class PolynomialRing:
         Expects a byte array of length (eta * polynomial_degree / 4) ~ eta * (polynomial_degree >> 2)
         For Kyber, this is 64 eta.
         """
-        assert (self.n >> 2)*eta == len(input_bytes) # Ensure that input are 64 bytes long
-        coefficients = [0 for _ in range(self.n)]
-        list_of_bits = bytes_to_bits(input_bytes) # Convert 64 bytes to 512 bits
-        for i in range(self.n):
-            a = sum(list_of_bits[2*i*eta + j]       for j in range(eta))
-            b = sum(list_of_bits[2*i*eta + eta + j] for j in range(eta))
-            #print(f'eta: {eta}, 2*i*eta: {2*i*eta}')
-            coefficients[i] = a-b
+        return self.cbd_batch([input_bytes], eta, is_ntt=is_ntt)[0]
 
+    def cbd_batch(self, list_of_input_bytes, eta, is_ntt=False):
         """
-        For Test
+        Algorithm 2 for several byte arrays of 64 eta bytes at once,
+        e.g. all k noise polynomials of one error vector. Returns
+        a list of polynomials in the order of the inputs.
         """
-        self.cbd_input_bytes = input_bytes
-        self.cbd_eta = eta
-        self.cbd_coefficients = coefficients
-        self.cbd_list_of_bits = list_of_bits
-        self.cbd_return = self(coefficients, is_ntt=is_ntt)
+        assert all((self.n >> 2)*eta == len(input_bytes) for input_bytes in list_of_input_bytes) # Ensure that inputs are 64 eta bytes long
+        coefficients = cbd_coefficients(b"".join(list_of_input_bytes), eta).reshape(-1, self.n)
+        polys = [self(c, is_ntt=is_ntt, bound=eta) for c in coefficients]
+
+        cap = capturing("cbd")
+        if cap:
+            for input_bytes, poly in zip(list_of_input_bytes, polys):
+                cap.record("cbd", input_bytes=input_bytes, eta=eta, coefficients=poly.coeffs.tolist(), output=poly.copy())
 
         # print(f'[CBD] Input Bytes  : {len(input_bytes)},{input_bytes.hex()}')
         # print(f'[CBD] ETA          : {eta}')
         # print(f'[CBD] COEFF        : {coefficients}')
         # print(f'[CBD] MIN/MAX COEFF: {min(coefficients)},{max(coefficients)}')
-        # print(f'[CBD] List of Bit  : {list_of_bits}')
         # print(f'[CBD] Return       : {self(coefficients, is_ntt=is_ntt)}')
 
-        # vecDict = dict()
-        # vecDict['i_ibytes'] = int.from_bytes(input_bytes)
-        # vecDict['i_eta'] = int(eta)
-        # vecDict['o_coeffs'] = int(''.join(Bits(int=x, length=3).bin for x in coefficients), 2)
-        # genvec('cbd', vecDict, 192*2)
+        writer = vector_writer("cbd")
+        if writer:
+            for input_bytes, c in zip(list_of_input_bytes, coefficients):
+                vecDict = dict()
+                vecDict['i_ibytes'] = int.from_bytes(input_bytes)
+                vecDict['i_eta'] = int(eta)
+                vecDict['o_coeffs'] = concat_fields(c.tolist(), 3)
+                writer.write('cbd', vecDict, 192*2)
 
-        return self(coefficients, is_ntt=is_ntt)
+        return polys
         
     # Decodes a byte array into a polynomial. 
     # This is used for decoding in Kyber.
@@ -141,17 +273,12 @@ class PolynomialRing:
                 raise ValueError("Input bytes must be a multiple of (polynomial degree) / 8")
             
             
-        coefficients = [0 for _ in range(self.n)]
-        list_of_bits = bytes_to_bits(input_bytes)
-        for i in range(self.n):
-            coefficients[i] = sum(list_of_bits[i*l + j] << j for j in range(l))
-
-        """For Test"""
-        self.decode_input_bytes = input_bytes
-        self.decode_l = l
-        self.decode_coefficients = coefficients
-        self.decode_list_of_bits = list_of_bits
-        self.decode_return = self(coefficients, is_ntt=is_ntt)
+        coefficients = unpack_bits(input_bytes, l)
+        poly = self(coefficients, is_ntt=is_ntt)
+
+        cap = capturing("decode")
+        if cap:
+            cap.record("decode", input_bytes=input_bytes, l=l, coefficients=coefficients.tolist(), output=poly.copy())
 
         # print(f'[DECODE] Input Bytes  : {len(input_bytes)},{input_bytes.hex()}')
         # print(f'[DECODE] L            : {l}')
@@ -160,45 +287,61 @@ class PolynomialRing:
         # print(f'[DECODE] List of Bit  : {list_of_bits}')
         # print(f'[DECODE] Return       : {self(coefficients, is_ntt=is_ntt)}')
 
-        # vecDict = dict()
-        # vecDict['i_ibytes'] = int.from_bytes(input_bytes)
-        # vecDict['i_l'] = int(l)
-        # vecDict['o_coeffs'] = int(''.join(Bits(uint=x, length=l).bin for x in coefficients), 2)
-        # genvec('decode', vecDict, 384*8//4)
+        writer = vector_writer("decode")
+        if writer:
+            vecDict = dict()
+            vecDict['i_ibytes'] = int.from_bytes(input_bytes)
+            vecDict['i_l'] = int(l)
+            vecDict['o_coeffs'] = concat_fields(coefficients.tolist(), l)
+            writer.write('decode', vecDict, 384*8//4)
 
-        return self(coefficients, is_ntt=is_ntt)
+        return poly
             
-    def __call__(self, coefficients, is_ntt=False):
+    def __call__(self, coefficients, is_ntt=False, bound=None):
         if isinstance(coefficients, int):
             return self.element(self, [coefficients], is_ntt)
-        if not isinstance(coefficients, list):
+        if not isinstance(coefficients, (list, np.ndarray)):
             raise TypeError(f"Polynomials should be constructed from a list of integers, of length at most d = {self.n}")
         
-        return self.element(self, coefficients, is_ntt) # Call the __init__ method of Polynomial
+        return self.element(self, coefficients, is_ntt, bound) # Call the __init__ method of Polynomial
 
     # Define how instances of PolynomialRing are represented as strings when using the repr() function
     def __repr__(self):
         return f"Univariate Polynomial Ring in x over Finite Field of size {self.q} with modulus x^{self.n} + 1"
 
     class Polynomial:
-        def __init__(self, parent, coefficients, is_ntt=False):
+        """
+        Element of the ring. The coefficients live in a fixed-size
+        `COEFF_DTYPE` NumPy buffer of length n, so arithmetic runs over
+        the whole buffer at once.
+
+        `bound` is an upper bound on the magnitude of the coefficients.
+        When the parent ring uses lazy reduction, additions skip the
+        reduction mod q and the bound decides when it is needed.
+        """
+        __slots__ = ("parent", "coeffs", "is_ntt", "bound")
+
+        def __init__(self, parent, coefficients, is_ntt=False, bound=None):
             self.parent = parent # An instance of PolynomialRing class
             self.coeffs = self.parse_coefficients(coefficients) # Coefficients in a polynomial
             self.is_ntt = is_ntt # Is polynomial in NTT form or not
+            if bound is None:
+                bound = int(np.abs(self.coeffs).max())
+            self.bound = bound # Upper bound of |coefficient|
 
         # Check whether that all coefficients are zero or not
         def is_zero(self):
             """
             Return if polynomial is zero: f = 0
             """
-            return all(c == 0 for c in self.coeffs)
+            return not self.coeffs.any()
 
         # Check whether the polynomial is a 0 degree (There is just a constant) or not
         def is_constant(self):
             """
             Return if polynomial is constant: f = c
             """
-            return all(c == 0 for c in self.coeffs[1:])
+            return not self.coeffs[1:].any()
             
         # Add more "0" coefficients to the polynomial ~ Add "0" padding
         def parse_coefficients(self, coefficients):
@@ -206,21 +349,51 @@ class PolynomialRing:
             Helper function which right pads with zeros
             to allow polynomial construction as 
             f = R([1,1,1])
+
+            A full length `COEFF_DTYPE` array is used as the
+            buffer directly, without a copy.
             """
-            l = len(coefficients)
-            if l > self.parent.n:
-                raise ValueError(f"Coefficients describe polynomial of degree greater than maximum degree {self.parent.n}")
-            elif l < self.parent.n:
-                coefficients = coefficients + [0 for _ in range (self.parent.n - l)]
+            n = self.parent.n
+            if isinstance(coefficients, np.ndarray) and coefficients.dtype == COEFF_DTYPE and coefficients.shape == (n,):
+                return coefficients
 
-            return coefficients
+            l = len(coefficients)
+            if l > n:
+                raise ValueError(f"Coefficients describe polynomial of degree greater than maximum degree {n}")
+            elif l < n:
+                buffer = np.zeros(n, dtype=COEFF_DTYPE)
+                buffer[:l] = coefficients
+                return buffer
+
+            return np.array(coefficients, dtype=COEFF_DTYPE)
+
+        # Returns a polynomial with its own copy of the coefficient buffer
+        def copy(self):
+            return self.parent(self.coeffs.copy(), is_ntt=self.is_ntt, bound=self.bound)
+
+        # Make the polynomial immutable: read-only buffer and no attribute assignment, copy() gives a mutable one
+        def freeze(self):
+            self.coeffs.setflags(write=False)
+            self.__class__ = PolynomialRing.FrozenPolynomial
+            return self
             
         # Reduce all coefficients value by mod q with each coefficient
         def reduce_coefficents(self):
             """
             Reduce all coefficents modulo q
             """
-            self.coeffs = [c % self.parent.q for c in self.coeffs]
+            self.coeffs %= self.parent.q
+            self.bound = self.parent.q - 1
+
+            return self
+
+        # Reduce all coefficients only if their bound is above "limit"
+        def reduce_bound(self, limit):
+            """
+            Lazy reduction: make sure every |coefficient| <= limit
+            """
+            if self.bound > limit:
+                self.reduce_coefficents()
 
             return self
  
@@ -229,86 +402,72 @@ class PolynomialRing:
             """
             Encode (Inverse of Algorithm 3)
             """
+            if self.parent.lazy_reduction:
+                self.reduce_bound(self.parent.q - 1)
+
             if l is None:
-                l = max(x.bit_length() for x in self.coeffs)
+                l = max(int(self.coeffs.max()).bit_length(), 1)
 
-            # Reversed Bits for each coefficient
-            bit_string = ''.join(format(c, f'0{l}b')[::-1] for c in self.coeffs)
+            output = pack_bits(self.coeffs, l)
 
-            """
-            For Test
-            """
-            self.encode_l = l
-            self.encode_coefficients = self.coeffs
-            self.encode_bit_string = bit_string
+            cap = capturing("encode")
+            if cap:
+                cap.record("encode", l=l, coefficients=self.coeffs.tolist(), output=output)
 
             # print(f'[ENCODE] L            : {l}')
             # print(f'[ENCODE] COEFF        : {self.coeffs}')
             # print(f'[ENCODE] MIN/MAX COEFF: {min(self.coeffs)},{max(self.coeffs)}')
-            # print(f'[ENCODE] BIS_STRING   : {len(bit_string)},{bit_string}')
-            # print(f'[ENCODE] Return       : {len(bitstring_to_bytes(bit_string))},{bitstring_to_bytes(bit_string).hex()}')
+            # print(f'[ENCODE] Return       : {len(pack_bits(self.coeffs, l))},{pack_bits(self.coeffs, l).hex()}')
             # print(f'-----------------------------------------------------------')
 
-            # vecDict = dict()
-            # vecDict['i_coeffs'] = int(''.join(Bits(uint=x, length=12).bin for x in self.coeffs), 2)
-            # vecDict['i_l'] = int(l)
-            # vecDict['o_obytes'] = int.from_bytes(bitstring_to_bytes(bit_string))
-            # genvec('encode', vecDict, 384*8//4)
+            writer = vector_writer("encode")
+            if writer:
+                vecDict = dict()
+                vecDict['i_coeffs'] = concat_fields(self.coeffs.tolist(), 12)
+                vecDict['i_l'] = int(l)
+                vecDict['o_obytes'] = int.from_bytes(output)
+                writer.write('encode', vecDict, 384*8//4)
             
-            # Split 8-bit & reverse
-            return bitstring_to_bytes(bit_string)
+            # l bits per coefficient, little endian
+            return output
 
         # Compresses the polynomial coefficients using lossy compression
         def compress(self, d):
             """
             Compress the polynomial by compressing each coefficent
             NOTE: This is lossy compression
+
+            Computed exactly in integers, round(2^d / q * x) mod 2^d.
+            With `set_hw_verification(True)` the result is also checked
+            against the FixedPoint model of the hardware.
             """
+            if self.parent.lazy_reduction:
+                self.reduce_bound(self.parent.q - 1)
+
             # print(f'[  COMPRESS] COEFF_ORIG   : {self.coeffs}')
             # print(f'[  COMPRESS] MIN/MAX COEFF: {min(self.coeffs)},{max(self.coeffs)}')
 
-            i_coeffs = int(''.join(Bits(int=x, length=13).bin for x in self.coeffs), 2)
-            frac_bits = 24
-
-            compress_mod   = 2**d
-            compress_float = compress_mod / self.parent.q
-            compress_float = float(FixedPoint(compress_float, signed=False, m=0, n=frac_bits))
-
-            hw_coeffs = list()
-
-            for coeff in self.coeffs:
-                mult = FixedPoint(compress_float * coeff, signed=True, m=13, n=frac_bits)
-                mult_round = FixedPoint(mult.bits[frac_bits+12:frac_bits] + mult.bits[frac_bits-1])
-                if d == 1:
-                    hw_coeffs.append(mult_round.bits[0])
-                else:
-                    hw_coeffs.append(mult_round.bits[d-1:0])
-                     
-            self.coeffs = [round_up(compress_float * c) % compress_mod for c in self.coeffs]
+            writer = vector_writer("compress")
+            if writer:
+                i_coeffs = concat_fields(self.coeffs.tolist(), 13)
 
-            if hw_coeffs != self.coeffs:
-                raise ValueError("TT")
+            self.coeffs[:] = compress_coefficients(self.coeffs, d, self.parent.q)
+            self.bound = 2**d - 1
             
-            """
-            For Test
-            """
-            self.compress_d = d
-            self.compress_q = self.parent.q
-            self.compress_float = compress_float
-            self.compress_coefficients = self.coeffs
+            cap = capturing("compress")
+            if cap:
+                cap.record("compress", d=d, q=self.parent.q, coefficients=self.coeffs.tolist())
 
             # print(f'[  COMPRESS] D/Q          : {d}/{self.parent.q}')
-            # print(f'[  COMPRESS] MOD/FLOAT    : {compress_mod}/{compress_float}')
             # print(f'[  COMPRESS] COEFF        : {self.coeffs}')
-            # print(f'[  COMPRESS] HW-COEFF     : {hw_coeffs}')
-
             # print(f'[  COMPRESS] MIN/MAX COEFF: {min(self.coeffs)},{max(self.coeffs)}')
 
-            # vecDict = dict()
-            # vecDict['i_coeffs'] = i_coeffs
-            # vecDict['i_d'] = d
-            # vecDict['o_coeffs'] = int(''.join(Bits(uint=x, length=13).bin for x in self.coeffs), 2)
-            # genvec('compress', vecDict, 13*256//4)
+            if writer:
+                vecDict = dict()
+                vecDict['i_coeffs'] = i_coeffs
+                vecDict['i_d'] = d
+                vecDict['o_coeffs'] = concat_fields(self.coeffs.tolist(), 13)
+                writer.write('compress', vecDict, 13*256//4)
 
             return self
             
@@ -319,27 +478,23 @@ class PolynomialRing:
             NOTE: This as compression is lossy, we have
             x' = decompress(compress(x)), which x' != x, but is 
             close in magnitude.
+
+            Like the hardware, q / 2^d is rounded to 3 fractional
+            bits, D / 8, and x' = round(D * x / 8) in integers.
+            With `set_hw_verification(True)` the result is also checked
+            against the FixedPoint model of the hardware.
             """
 
             # print(f'[DECOMPRESS] COEFF_ORIG   : {self.coeffs}')
             # print(f'[DECOMPRESS] MIN/MAX ORI_C: {min(self.coeffs)},{max(self.coeffs)}')
-            i_coeffs = int(''.join(Bits(uint=x, length=12).bin for x in self.coeffs), 2)
 
+            writer = vector_writer("decompress")
+            if writer:
+                i_coeffs = concat_fields(self.coeffs.tolist(), 12)
 
-            decompress_float = self.parent.q / 2**d
-            decompress_float = float(FixedPoint(decompress_float, signed=False, m=11, n=3))
-
-
-            hw_coeffs = list()
-            for coeff in self.coeffs:
-                mult = FixedPoint(decompress_float * coeff, signed=False, m=22, n=3)
-                hw_coeffs.append(FixedPoint(mult.bits[14:3] + mult.bits[2]))
-                     
-            self.coeffs = [round_up(decompress_float * c) for c in self.coeffs]
-
-            
-            if hw_coeffs != self.coeffs:
-                raise ValueError("TT")
+            coeffs = decompress_coefficients(self.coeffs, d, self.parent.q)
+            self.coeffs[:] = coeffs
+            self.bound = int(coeffs.max())
             
 
             # """
@@ -347,19 +502,18 @@ class PolynomialRing:
             # """
             # self.decompress_d = d
             # self.decompress_q = self.parent.q
-            # self.decompress_float = decompress_float
             # self.decompress_coefficients = self.coeffs
 
             # print(f'[DECOMPRESS] D/Q          : {d}/{self.parent.q}')
-            # print(f'[DECOMPRESS] FLOAT        : {decompress_float}')
             # print(f'[DECOMPRESS] COEFF        : {self.coeffs}')
             # print(f'[DECOMPRESS] MIN/MAX COEFF: {min(self.coeffs)},{max(self.coeffs)}')
 
-            # vecDict = dict()
-            # vecDict['i_coeffs'] = i_coeffs
-            # vecDict['i_d'] = d
-            # vecDict['o_coeffs'] = int(''.join(Bits(uint=x, length=12).bin for x in self.coeffs), 2)
-            # genvec('decompress', vecDict, 12*256//4)
+            if writer:
+                vecDict = dict()
+                vecDict['i_coeffs'] = i_coeffs
+                vecDict['i_d'] = d
+                vecDict['o_coeffs'] = concat_fields(self.coeffs.tolist(), 12)
+                writer.write('decompress', vecDict, 12*256//4)
 
             return self
 
@@ -393,19 +547,15 @@ class PolynomialRing:
             suitable for all R_q = F_1[X]/(X^n + 1)
             """
             n = self.parent.n
-            a = self.coeffs
-            b = other.coeffs
-            new_coeffs = [0 for _ in range(n)]
+            a = self.coeffs.astype(np.int64)
+            b = other.coeffs.astype(np.int64)
 
-            for i in range(n):
-                for j in range(0, n-i):
-                    new_coeffs[i+j] += (a[i] * b[j])
+            # Full product has degree 2n - 2, and x^n = -1 folds the top half back negated
+            full = np.convolve(a, b)
+            new_coeffs = full[:n]
+            new_coeffs[:n-1] -= full[n:]
 
-            for j in range(1, n):
-                for i in range(n-j, n):
-                    new_coeffs[i+j-n] -= (a[i] * b[j])
-
-            return [c % self.parent.q for c in new_coeffs]
+            return new_coeffs % self.parent.q
         
         """
         The next four `Polynomial` methods rely on the parent
@@ -416,6 +566,9 @@ class PolynomialRing:
         def to_ntt(self):
             if self.parent.ntt_helper is None:
                 raise ValueError("Can only perform NTT transform when parent element has an NTT Helper")
+
+            if self.parent.lazy_reduction:
+                self.reduce_bound(self.parent.ntt_helper.ntt_input_bound(LAZY_BOUND))
             
             return self.parent.ntt_helper.to_ntt(self)
         
@@ -444,6 +597,15 @@ class PolynomialRing:
             Number Theoretic Transform multiplication.
             Only implemented (currently) for n = 256
             """
+            return self.mul_ntt_into(other, self.parent(0, is_ntt=True, bound=0))
+
+        # NTT multiplication writing the product into the buffer of "out"
+        def mul_ntt_into(self, other, out):
+            """
+            In-place variant of `ntt_multiplication`: the
+            product of self and other is written into `out`
+            (which may be self or other) and `out` is returned.
+            """
             if self.parent.ntt_helper is None:
                 raise ValueError("Can only perform ntt reduction when parent element has an NTT Helper")
             
@@ -451,32 +613,106 @@ class PolynomialRing:
                 raise ValueError("Can only multiply using NTT if both polynomials are in NTT form")
             
             # function in ntt_helper.py
-            new_coeffs = self.parent.ntt_helper.ntt_coefficient_multiplication(self.coeffs, other.coeffs)
+            ntt_helper = self.parent.ntt_helper
+            if self.parent.lazy_reduction:
+                self.reduce_bound(LAZY_MUL_BOUND)
+                other.reduce_bound(LAZY_MUL_BOUND)
+                out.coeffs[:] = ntt_helper.ntt_coefficient_multiplication_lazy(self.coeffs, other.coeffs)
+                out.bound = self.parent.q - 1
+            else:
+                out.coeffs[:] = ntt_helper.ntt_coefficient_multiplication(self.coeffs, other.coeffs)
+                out.bound = 2*self.parent.q - 1
+            out.is_ntt = True
+
+            return out
+
+        # Adds "other" into self in place, coefficient-wise modulo q
+        def iadd_(self, other):
+            """
+            In-place self += other, with the same conditional
+            subtraction of q per coefficient as `add_mod_q`.
+            Under lazy reduction the subtraction is skipped.
+            """
+            if isinstance(other, PolynomialRing.Polynomial):
+                if self.is_ntt ^ other.is_ntt:
+                    raise ValueError(f"Both or neither polynomials must be in NTT form before multiplication")
+                if self.parent.lazy_reduction:
+                    other = self.make_room(other)
+                    self.coeffs += other.coeffs
+                else:
+                    coeffs = self.coeffs
+                    coeffs += other.coeffs
+                    np.subtract(coeffs, self.parent.q, out=coeffs, where=coeffs >= self.parent.q)
+                self.bound += other.bound
+            elif isinstance(other, int):
+                if self.parent.lazy_reduction:
+                    other = other % self.parent.q
+                    self.reduce_bound(LAZY_BOUND - other)
+                    self.coeffs[0] += other
+                else:
+                    self.coeffs[0] = self.add_mod_q(int(self.coeffs[0]), other)
+                self.bound += abs(other)
+            else:
+                raise NotImplementedError(f"Polynomials can only be added to each other")
+
+            return self
 
-            return self.parent(new_coeffs, is_ntt=True)
+        # Reduces self and/or a copy of other so that adding their coefficients cannot overflow
+        def make_room(self, other):
+            """
+            Lazy reduction: ensures self.bound + other.bound <= LAZY_BOUND,
+            reducing self in place only when needed. `other` is never
+            modified, returns it or a reduced copy to add instead.
+            """
+            if other.bound > LAZY_BOUND // 2:
+                other = other.copy().reduce_coefficents()
+            self.reduce_bound(LAZY_BOUND - other.bound)
+
+            return other
+
+        # Subtracts "other" from self in place, coefficient-wise modulo q
+        def isub_(self, other):
+            """
+            In-place self -= other, with the same conditional
+            addition of q per coefficient as `sub_mod_q`.
+            Under lazy reduction the addition is skipped.
+            """
+            if isinstance(other, PolynomialRing.Polynomial):
+                if self.is_ntt ^ other.is_ntt:
+                    raise ValueError(f"Both or neither polynomials must be in NTT form before multiplication")
+                if self.parent.lazy_reduction:
+                    other = self.make_room(other)
+                    self.coeffs -= other.coeffs
+                else:
+                    coeffs = self.coeffs
+                    coeffs -= other.coeffs
+                    np.add(coeffs, self.parent.q, out=coeffs, where=coeffs < 0)
+                self.bound += other.bound
+            elif isinstance(other, int):
+                if self.parent.lazy_reduction:
+                    other = other % self.parent.q
+                    self.reduce_bound(LAZY_BOUND - other)
+                    self.coeffs[0] -= other
+                else:
+                    self.coeffs[0] = self.sub_mod_q(int(self.coeffs[0]), other)
+                self.bound += abs(other)
+            else:
+                raise NotImplementedError(f"Polynomials can only be subracted from each other")
+
+            return self
 
         # Returns the negation of the polynomial. Behave like 0 - polynomial ~ -polynomial
         def __neg__(self):
             """
             Returns -f, by negating all coefficients
             """
-            neg_coeffs = [(-x % self.parent.q) for x in self.coeffs]
+            neg_coeffs = (-self.coeffs) % self.parent.q
             
-            return self.parent(neg_coeffs, is_ntt=self.is_ntt)
+            return self.parent(neg_coeffs, is_ntt=self.is_ntt, bound=self.parent.q - 1)
 
         # Returns the sum of the self and other polynomials. Behave like self_polynomial + other_polynomial
         def __add__(self, other):
-            if isinstance(other, PolynomialRing.Polynomial):
-                if self.is_ntt ^ other.is_ntt:                    
-                    raise ValueError(f"Both or neither polynomials must be in NTT form before multiplication")
-                new_coeffs = [self.add_mod_q(x,y) for x,y in zip(self.coeffs, other.coeffs)]
-            elif isinstance(other, int):
-                new_coeffs = self.coeffs.copy()
-                new_coeffs[0] = self.add_mod_q(new_coeffs[0], other)
-            else:
-                raise NotImplementedError(f"Polynomials can only be added to each other")
-            
-            return self.parent(new_coeffs, is_ntt=self.is_ntt)
+            return self.copy().iadd_(other)
 
         # Returns the sum of the self polynomial (in the right side of +) and another operand (in the left side of +). Behave like other_operand + self_polynomial
         def __radd__(self, other):
@@ -490,17 +726,7 @@ class PolynomialRing:
 
         # Returns the difference of the self and other polynomials. Behave like self_polynomial - other_polynomial
         def __sub__(self, other):
-            if isinstance(other, PolynomialRing.Polynomial):
-                if self.is_ntt ^ other.is_ntt:
-                    raise ValueError(f"Both or neither polynomials must be in NTT form before multiplication")
-                new_coeffs = [self.sub_mod_q(x,y) for x,y in zip(self.coeffs, other.coeffs)]
-            elif isinstance(other, int):
-                new_coeffs = self.coeffs.copy()
-                new_coeffs[0] = self.sub_mod_q(new_coeffs[0], other)
-            else:
-                raise NotImplementedError(f"Polynomials can only be subracted from each other")
-            
-            return self.parent(new_coeffs, is_ntt=self.is_ntt)
+            return self.copy().isub_(other)
 
         # Returns the subtraction of the self polynomial (in the right side of -) and another operand (in the left side of -). Behave like other_operand - self_polynomial
         def __rsub__(self, other):
@@ -522,11 +748,11 @@ class PolynomialRing:
                 else:
                     new_coeffs = self.schoolbook_multiplication(other)
             elif isinstance(other, int):
-                new_coeffs = [(c * other) % self.parent.q for c in self.coeffs]
+                new_coeffs = self.coeffs.astype(np.int64) * (other % self.parent.q) % self.parent.q
             else:
                 raise NotImplementedError(f"Polynomials can only be multiplied by each other, or scaled by integers")
             
-            return self.parent(new_coeffs, is_ntt=self.is_ntt)
+            return self.parent(new_coeffs, is_ntt=self.is_ntt, bound=self.parent.q - 1)
 
         # Returns the product of the self polynomial (in the right side of *) and another operand (in the left side of *). Behave like other_operand * self_polynomial
         def __rmul__(self, other):
@@ -558,17 +784,19 @@ class PolynomialRing:
 
         # Define the equality (==) comparison between polynomial instances
         def __eq__(self, other):
+            q = self.parent.q
             if isinstance(other, PolynomialRing.Polynomial):
-                return self.coeffs == other.coeffs and self.is_ntt == other.is_ntt
+                return np.array_equal(self.coeffs % q, other.coeffs % q) and self.is_ntt == other.is_ntt # Coefficients are only reduced lazily
             elif isinstance(other, int):
-                if self.is_constant() and (other % self.parent.q) == self.coeffs[0]:
+                coeffs = self.coeffs % q
+                if not coeffs[1:].any() and (other % q) == coeffs[0]:
                     return True
                 
             return False
 
         # Allow you to access the coefficients of the polynomial using indexing (e.g., polynomial[0], polynomial[1], ...)
         def __getitem__(self, idx):
-            return self.coeffs[idx]
+            return self.coeffs[idx].tolist()
 
         # Define how instances of Polynomial are represented as strings when using the repr() function
         def __repr__(self):
@@ -581,7 +809,7 @@ class PolynomialRing:
                 return "0" + ntt_info
 
             info = []
-            for i,c in enumerate(self.coeffs):
+            for i,c in enumerate(self.coeffs.tolist()):
                 if c != 0:
                     if i == 0:
                         info.append(f"{c}")
@@ -600,4 +828,17 @@ class PolynomialRing:
 
         # Define how instances of Polynomial are represented as strings when using the str() function
         def __str__(self):
-            return self.__repr__()
\ No newline at end of file
+            return self.__repr__()
+
+    class FrozenPolynomial(Polynomial):
+        """
+        A frozen Polynomial, shared between callers (e.g. the cached
+        matrix A^T), raises on any in-place change.
+        """
+        __slots__ = ()
+
+        def freeze(self):
+            return self
+
+        def __setattr__(self, name, value):
+            raise AttributeError(f"Cannot set {name} of a frozen polynomial")
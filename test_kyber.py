@@ -1,9 +1,29 @@
 #! /home/woong/.venv/kyber/bin/python3
 
 import unittest
+import asyncio
+import contextlib
+import io
+import tempfile
 import os
-from kyber import Kyber512, Kyber768, Kyber1024
+import random
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import shake_128, shake_256, sha3_256, sha3_512
+from kyber import Kyber, Kyber512, Kyber768, Kyber1024, DEFAULT_PARAMETERS
+from kyber_pool import KyberPool, run_chunk
+from async_kyber import AsyncKyber
+from tracing import tracing, get_trace_hook
+from capture import capture, capturing
+from vectors import VectorWriter, concat_fields
+from CompactFIPS202 import SHAKE128, SHAKE256, SHA3_256, SHA3_512, SHAKE128Sponge, SHAKE128_batch, KeccakF1600onLanes, KeccakF1600onLaneList
+from hash_backends import HashBackend, HashlibBackend, RecordingBackend, CompactFIPS202Backend
+from gen_vectors import run_campaign, gen_parse_vectors, gen_cbd_vectors, gen_decompress_vectors, compress_boundaries
 from aes256_ctr_drbg import AES256_CTR_DRBG
+from Crypto.Cipher import AES
+from polynomials import PolynomialRing, set_hw_verification, hw_compress, hw_decompress
+from modules import Module
+from utils import pack_bits, unpack_bits, bitstring_to_bytes, bytes_to_bits
+from ntt_helper import NTTHelperKyber, NTTHelperKyberNumpy
 
 def parse_kat_data(data):
     parsed_data = {}
@@ -52,6 +72,638 @@ class TestKyber(unittest.TestCase):
         print("Kyber1024")
         print("========================================")
         self.generic_test_kyber(Kyber1024, 1)
+
+class TestPublicKey(unittest.TestCase):
+    """
+    Encapsulation with a loaded PublicKey must give the
+    same ciphertext and key as with the public key bytes.
+    """
+    def test_load_public_key(self):
+        for kyber in (Kyber512, Kyber768, Kyber1024):
+            pk, sk = kyber.keygen()
+            public_key = kyber.load_public_key(pk)
+            self.assertEqual(bytes(public_key), pk)
+
+            seed = os.urandom(48)
+            kyber.set_drbg_seed(seed)
+            c, key = kyber.enc(pk)
+            kyber.set_drbg_seed(seed)
+            self.assertEqual(kyber.enc(public_key), (c, key))
+            self.assertEqual(kyber.dec(c, sk), key)
+            kyber.random_bytes = os.urandom
+
+    def test_load_public_key_length(self):
+        with self.assertRaises(ValueError):
+            Kyber512.load_public_key(bytes(800 - 1))
+
+class TestSecretKey(unittest.TestCase):
+    """
+    Decapsulation with a loaded SecretKey must give the
+    same key as with the secret key bytes, also on failure.
+    """
+    def test_load_secret_key(self):
+        for kyber in (Kyber512, Kyber768, Kyber1024):
+            pk, sk = kyber.keygen()
+            secret_key = kyber.load_secret_key(sk)
+            self.assertEqual(bytes(secret_key), sk)
+            self.assertEqual(bytes(secret_key.public_key), pk)
+
+            c, key = kyber.enc(pk)
+            self.assertEqual(kyber.dec(c, secret_key), key)
+            bad_c = bytes([c[0] ^ 1]) + c[1:]
+            self.assertEqual(kyber.dec(bad_c, secret_key), kyber.dec(bad_c, sk))
+
+    def test_load_secret_key_length(self):
+        with self.assertRaises(ValueError):
+            Kyber512.load_secret_key(bytes(1632 + 1))
+
+class TestBatch(unittest.TestCase):
+    """
+    keygen_batch / enc_batch / dec_batch must return exactly
+    what the same sequence of single calls returns.
+    """
+    def test_batch(self):
+        count = 5
+        for kyber in (Kyber512, Kyber768, Kyber1024):
+            seed = os.urandom(48)
+            kyber.set_drbg_seed(seed)
+            keys = [kyber.keygen() for _ in range(count)]
+            pks = [pk for pk, _ in keys]
+            encs = [kyber.enc(pk) for pk in pks]
+
+            kyber.set_drbg_seed(seed)
+            self.assertEqual(kyber.keygen_batch(count), keys)
+            self.assertEqual(kyber.enc_batch([pks[0], kyber.load_public_key(pks[1])] + pks[2:]), encs)
+            kyber.random_bytes = os.urandom
+
+            # Every second ciphertext is corrupted, so decapsulation takes the z branch
+            cs = [c if i % 2 else bytes([c[0] ^ 1]) + c[1:] for i, (c, _) in enumerate(encs)]
+            sks = [sk for _, sk in keys]
+            self.assertEqual(kyber.dec_batch(cs, sks), [kyber.dec(c, sk) for c, sk in zip(cs, sks)])
+
+            # One key for all ciphertexts
+            _, sk = keys[0]
+            self.assertEqual(kyber.dec_batch(cs, kyber.load_secret_key(sk)), [kyber.dec(c, sk) for c in cs])
+
+class TestKyberPool(unittest.TestCase):
+    """
+    Seeded pool results must not depend on the number of
+    workers or the chunksize.
+    """
+    def test_kyber_pool(self):
+        seed = os.urandom(48)
+        results = []
+        for max_workers, chunksize in ((1, 4), (2, 3)):
+            with KyberPool(max_workers=max_workers, chunksize=chunksize) as pool:
+                pool.set_drbg_seed(seed)
+                keys = pool.keygen("kyber_512", 5)
+                encs = pool.enc("kyber_512", [pk for pk, _ in keys])
+                cs = [c for c, _ in encs]
+                self.assertEqual(pool.dec("kyber_512", cs, [sk for _, sk in keys]), [key for _, key in encs])
+                # Only the first ciphertext was made for sk, the others take the z branch
+                _, sk = keys[0]
+                results.append((keys, encs, pool.dec("kyber_512", cs, sk)))
+                
+                # Unseeded chunks go through the batch API
+                pool.set_drbg_seed(None)
+                keys = pool.keygen("kyber_768", 5)
+                encs = pool.enc("kyber_768", [pk for pk, _ in keys])
+                self.assertEqual(pool.dec("kyber_768", [c for c, _ in encs], [sk for _, sk in keys]), [key for _, key in encs])
+        self.assertEqual(results[0], results[1])
+
+class TestAsyncKyber(unittest.TestCase):
+    """
+    Concurrent requests are coalesced into micro-batches
+    and each caller gets its own result.
+    """
+    def test_async_kyber(self):
+        async def run():
+            async with AsyncKyber("kyber_512", pool=KyberPool(max_workers=1), max_batch=8, max_latency=0.05, max_queue=4) as kyber:
+                pk, sk = await kyber.keygen()
+                encs = await asyncio.gather(*[kyber.enc(pk) for _ in range(16)])
+                keys = await asyncio.gather(*[kyber.dec(c, sk) for c, _ in encs])
+                self.assertEqual(keys, [key for _, key in encs])
+                self.assertLess(kyber.batches, 1 + 2*16)
+                with self.assertRaises(ValueError):
+                    await kyber.dec(b"", sk)
+                with self.assertRaises(ValueError):
+                    await kyber.dec(encs[0][0], sk[:-1])
+            kyber.pool.shutdown()
+        asyncio.run(run())
+
+    def test_bad_request_in_batch(self):
+        pk, _ = Kyber512.keygen()
+        async def run():
+            async with AsyncKyber("kyber_512", pool=KyberPool(max_workers=1)) as kyber:
+                with self.assertRaises(ValueError):
+                    await kyber.enc(pk[:-1])
+            kyber.pool.shutdown()
+        asyncio.run(run())
+
+        # In a worker, a failing item only fails itself
+        results = run_chunk("kyber_512", "enc", [pk, pk[:-1], pk], None, 32)
+        self.assertEqual([error is None for _, error in results], [True, False, True])
+        self.assertIsInstance(results[1][1], ValueError)
+        c, K = results[0][0]
+        self.assertEqual(len(c), 768)
+
+    def test_close_cancels_partial_batch(self):
+        async def run():
+            kyber = AsyncKyber("kyber_512", pool=KyberPool(max_workers=1), max_batch=8, max_latency=60)
+            await kyber.start()
+            request = asyncio.ensure_future(kyber.keygen())
+            await asyncio.sleep(0.05) # Picked up by the batcher, waiting for more
+            await kyber.close()
+            with self.assertRaises(asyncio.CancelledError):
+                await asyncio.wait_for(request, 5)
+            kyber.pool.shutdown()
+        asyncio.run(run())
+
+class TestTracing(unittest.TestCase):
+    """
+    Stages are silent by default and call their hook when traced
+    """
+    def test_tracing(self):
+        events = []
+        hook = lambda stage, event, **fields: events.append((stage, event))
+        R = PolynomialRing(3329, 256, ntt_helper=NTTHelperKyber)
+        f = R.random_element()
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            f.copy().to_ntt()
+            Kyber512.keygen()
+        self.assertEqual(stdout.getvalue(), "")
+
+        with tracing(["kyber", "ntt"], hook=hook):
+            f.copy().to_ntt()
+            self.assertEqual(events.count(("ntt", "layer")), 7)
+            self.assertEqual(events.count(("ntt", "group")), 127)
+            self.assertEqual(events.count(("ntt", "butterfly")), 7*128)
+            del events[:]
+            Kyber512.keygen()
+            # Hooks are per context, other threads are not traced
+            with ThreadPoolExecutor(1) as pool:
+                self.assertIsNone(pool.submit(get_trace_hook, "ntt").result())
+        self.assertEqual(get_trace_hook("ntt"), None)
+        self.assertEqual(events[0], ("kyber", "keygen"))
+        self.assertEqual(events.count(("ntt", "layer")), 2*7) # s and e, one batch each on the NumPy helper
+        self.assertEqual(events.count(("ntt", "inverse_layer")), 0)
+
+class TestCapture(unittest.TestCase):
+    """
+    Intermediates are only recorded inside `capture`,
+    into its own store rather than onto the ring
+    """
+    def test_capture(self):
+        with capture(stages=["cbd", "xof", "error_vector", "encode"]) as cap:
+            pk, sk = Kyber512.keygen()
+        Kyber512.keygen()
+
+        self.assertEqual(len(cap["cbd"]), 2*Kyber512.k)
+        self.assertEqual(len(cap["xof"]), Kyber512.k**2)
+        self.assertEqual(len(cap["error_vector"]), 2)
+        self.assertEqual(cap.last("error_vector")["N"], 2*Kyber512.k)
+
+        # s is the first error vector, sk its encoding after the NTT
+        record = cap.last("cbd")
+        self.assertEqual(record["coefficients"], record["output"].coeffs.tolist())
+        self.assertEqual(len(record["input_bytes"]), 64*Kyber512.eta_1)
+        s = cap["error_vector"][0]["v"].transpose().to_ntt().reduce_coefficents()
+        self.assertEqual(s.encode(l=12), sk[:12*Kyber512.k*Kyber512.n // 8])
+        self.assertEqual(b"".join(record["output"] for record in cap["encode"][:Kyber512.k]), pk[:-32])
+
+        self.assertFalse(hasattr(Kyber512.R, "cbd_input_bytes"))
+        self.assertIsNone(capturing("cbd"))
+        with self.assertRaises(ValueError):
+            with capture(stages=["ntt"]):
+                pass
+
+class TestVectorWriter(unittest.TestCase):
+    """
+    Vectors are only written inside an active VectorWriter,
+    capped per module and flushed on close
+    """
+    def test_vector_writer(self):
+        with tempfile.TemporaryDirectory() as root:
+            with VectorWriter(root, nvec={"keccak": 3}, modules=["keccak", "cbd"], buffer_lines=4) as writer:
+                outputs = [SHAKE128(bytes([i]) * 40, 64) for i in range(5)]
+                Kyber512.R.cbd(bytes(128), 2)
+                Kyber512.R.parse(bytes(768))
+            SHAKE128(b"", 32)
+            self.assertEqual(writer.counts, {"keccak": 3, "cbd": 1})
+            self.assertEqual(sorted(os.listdir(root)), ["cbd", "keccak"])
+
+            with open(os.path.join(root, "keccak", "o_obytes.vec")) as fh:
+                lines = fh.read().split()
+            self.assertEqual([int(line, 16) for line in lines], [int.from_bytes(o) for o in outputs[:3]])
+            with open(os.path.join(root, "cbd", "o_coeffs.vec")) as fh:
+                self.assertEqual(int(fh.read(), 16), 0)
+
+    def test_concat_fields(self):
+        self.assertEqual(concat_fields([1, -1, 2], 3), 0b001_111_010)
+
+class TestVectorCampaign(unittest.TestCase):
+    """
+    The generated files depend on the seed, not on the workers
+    """
+    def test_run_campaign(self):
+        files = []
+        for workers in (1, 2):
+            with tempfile.TemporaryDirectory() as root:
+                counts = run_campaign(["keccak", "cbd"], count=6, seed=bytes(range(48)), root=root, workers=workers, chunk=4)
+                self.assertEqual(counts, {"keccak": 6, "cbd": 6})
+                contents = {}
+                for module in ("keccak", "cbd"):
+                    for name in sorted(os.listdir(os.path.join(root, module))):
+                        with open(os.path.join(root, module, name)) as fh:
+                            contents[module, name] = fh.read()
+                files.append(contents)
+        self.assertEqual(files[0], files[1])
+        self.assertEqual(len(files[0]["cbd", "o_coeffs.vec"].split()), 6)
+
+class TestStageVectors(unittest.TestCase):
+    """
+    Stage generators write one vector per stage call, edge cases first
+    """
+    def test_parse_edge_cases(self):
+        vectors = gen_parse_vectors(8)
+        self.assertEqual(len(vectors), 8)
+        fields, hex_digits = vectors[1]
+        self.assertEqual(fields["o_coeffs"], concat_fields([3328]*256, 12)) # All q - 1
+        self.assertEqual(hex_digits, 768*2)
+
+    def test_cbd_edge_cases(self):
+        R = PolynomialRing(3329, 256)
+        for fields, _ in gen_cbd_vectors(5, eta=3):
+            coeffs = R.cbd(fields["i_ibytes"].to_bytes(192), 3).coeffs
+            self.assertEqual(fields["o_coeffs"], concat_fields(coeffs, 3))
+        self.assertEqual(gen_cbd_vectors(6, eta=3)[2][0]["o_coeffs"], concat_fields([3]*256, 3))
+
+    def test_edge_cases_round_robin(self):
+        # Every d gets an edge case and the second half of the vectors are random
+        vectors = gen_decompress_vectors(10)
+        self.assertEqual([fields["i_d"] for fields, _ in vectors], [1, 4, 5, 10, 11]*2)
+        self.assertTrue(all(fields["i_coeffs"] == 0 for fields, _ in vectors[:5]))
+        self.assertTrue(all(fields["i_coeffs"] != 0 for fields, _ in vectors[5:]))
+
+    def test_compress_boundaries(self):
+        boundaries = compress_boundaries(1)
+        self.assertEqual(len(boundaries), 256)
+        self.assertTrue({832, 833, 2496, 2497} <= set(boundaries.tolist()))
+
+class TestHashBackend(unittest.TestCase):
+    """
+    Every hash backend gives the keys and ciphertexts of hashlib
+    """
+    def run_kem(self, kyber):
+        kyber.set_drbg_seed(bytes(48))
+        pk, sk = kyber.keygen()
+        c, K = kyber.enc(pk)
+        self.assertEqual(kyber.dec(c, sk), K)
+        return pk, sk, c, K
+
+    def test_backends(self):
+        expected = self.run_kem(Kyber(DEFAULT_PARAMETERS["kyber_512"]))
+        for backend in ("CompactFIPS202", RecordingBackend(CompactFIPS202Backend())):
+            kyber = Kyber(DEFAULT_PARAMETERS["kyber_512"], hash_backend=backend)
+            self.assertEqual(self.run_kem(kyber), expected)
+        self.assertEqual([function for function, _, _ in backend.calls[:2]], ["sha3_512", "shake128"])
+
+    def test_abstract_backend(self):
+        class Incomplete(HashBackend):
+            def shake128(self, input_bytes, length):
+                return shake_128(input_bytes).digest(length)
+        with self.assertRaises(TypeError):
+            Incomplete()
+        self.assertEqual(HashlibBackend().shake128(b"", 4), shake_128(b"").digest(4))
+
+    def test_expand_matrix(self):
+        rho = bytes(range(32))
+        A, timing = Kyber1024.expand_matrix(rho, transpose=True)
+        B, _ = Kyber(DEFAULT_PARAMETERS["kyber_1024"], hash_backend="CompactFIPS202").expand_matrix(rho, transpose=True)
+        self.assertEqual(A.to_numpy().tolist(), B.to_numpy().tolist())
+        self.assertEqual(sorted(timing), ["parse", "xof"])
+
+    def test_vectors_from_kyber(self):
+        kyber = Kyber(DEFAULT_PARAMETERS["kyber_512"], hash_backend="CompactFIPS202")
+        with tempfile.TemporaryDirectory() as root:
+            with VectorWriter(root, nvec=None, modules=["keccak"]) as writer:
+                kyber.keygen()
+        self.assertEqual(writer.counts["keccak"], 1 + kyber.k**2 + 2*kyber.k + 1) # G, XOF, PRF, H(pk)
+        with self.assertRaises(ValueError):
+            Kyber(DEFAULT_PARAMETERS["kyber_512"], hash_backend="sha3")
+
+class TestKeccak(unittest.TestCase):
+    """
+    The lane-oriented permutation matches hashlib on every mode
+    """
+    def test_against_hashlib(self):
+        for length in (0, 1, 71, 72, 135, 136, 137, 167, 168, 169, 1184):
+            input_bytes = bytes(random.getrandbits(8) for _ in range(length))
+            self.assertEqual(SHAKE128(input_bytes, 672), shake_128(input_bytes).digest(672))
+            self.assertEqual(SHAKE256(input_bytes, 200), shake_256(input_bytes).digest(200))
+            self.assertEqual(SHA3_256(input_bytes), sha3_256(input_bytes).digest())
+            self.assertEqual(SHA3_512(input_bytes), sha3_512(input_bytes).digest())
+
+    def test_sponge(self):
+        prefix = SHAKE128Sponge().absorb(bytes(range(32)))
+        sponge = prefix.copy().absorb(bytes([1, 2]))
+        self.assertEqual(sponge.squeeze(100) + sponge.squeeze(300), shake_128(bytes(range(32)) + bytes([1, 2])).digest(400))
+        self.assertEqual(prefix.squeeze(32), shake_128(bytes(range(32))).digest(32))
+        with self.assertRaises(ValueError):
+            prefix.absorb(b"")
+
+    def test_batch(self):
+        for length in (34, 168, 200):
+            inputs = [bytes([i])*length for i in range(9)]
+            for output_length in (0, 768):
+                expected = [shake_128(input_bytes).digest(output_length) for input_bytes in inputs]
+                self.assertEqual(SHAKE128_batch(inputs, output_length), expected)
+                self.assertEqual(CompactFIPS202Backend().shake128_batch(inputs, output_length), expected)
+
+    def test_lanes(self):
+        lanes = [random.getrandbits(64) for _ in range(25)]
+        nested = KeccakF1600onLanes([[lanes[x+5*y] for y in range(5)] for x in range(5)])
+        self.assertEqual([nested[x][y] for y in range(5) for x in range(5)], KeccakF1600onLaneList(lanes))
+
+class TestPolynomial(unittest.TestCase):
+    """
+    The in-place API must agree with the operators.
+    """
+    R = PolynomialRing(3329, 256, ntt_helper=NTTHelperKyberNumpy)
+
+    def test_inplace_arithmetic(self):
+        f = self.R.random_element()
+        g = self.R.random_element()
+        self.assertEqual(f.copy().iadd_(g), f + g)
+        self.assertEqual(f.copy().isub_(g), f - g)
+        self.assertEqual(f.copy().iadd_(5), f + 5)
+        self.assertEqual(f.copy().isub_(5), f - 5)
+
+    def test_mul_ntt_into(self):
+        f = self.R.random_element(is_ntt=True)
+        g = self.R.random_element(is_ntt=True)
+        out = self.R(0, is_ntt=True)
+        self.assertIs(f.mul_ntt_into(g, out), out)
+        self.assertEqual(out, f * g)
+
+    def test_schoolbook_multiplication(self):
+        f = self.R.random_element()
+        g = self.R.random_element()
+        self.assertEqual((f.copy().to_ntt() * g.copy().to_ntt()).from_ntt(), f * g)
+
+class TestLazyReduction(unittest.TestCase):
+    """
+    Lazy reduction must agree with eager reduction modulo q.
+    """
+    R = PolynomialRing(3329, 256, ntt_helper=NTTHelperKyberNumpy)
+    R_lazy = PolynomialRing(3329, 256, ntt_helper=NTTHelperKyberNumpy, lazy_reduction=True)
+
+    def test_lazy_base_multiplication(self):
+        f = [random.randint(-3329, 3329) for _ in range(256)]
+        g = [random.randint(-3329, 3329) for _ in range(256)]
+        for helper in (NTTHelperKyber, NTTHelperKyberNumpy):
+            eager = [c % 3329 for c in helper.ntt_coefficient_multiplication(f, g)]
+            self.assertEqual(eager, list(helper.ntt_coefficient_multiplication_lazy(f, g)))
+
+    def test_lazy_matches_eager(self):
+        M, M_lazy = Module(self.R), Module(self.R_lazy)
+        A = [[[random.randint(0, 3328) for _ in range(256)] for _ in range(3)] for _ in range(3)]
+        s = [[random.randint(-2, 2) for _ in range(256)] for _ in range(3)]
+        results = []
+        for R, M in ((self.R, M), (self.R_lazy, M_lazy)):
+            A_mat = M([[R(a, is_ntt=True) for a in row] for row in A])
+            s_vec = M([R(c) for c in s]).transpose().to_ntt()
+            t = (A_mat @ s_vec).from_ntt()
+            for _ in range(1000):
+                t.iadd_(t)
+            results.append(t.reduce_coefficents())
+        self.assertEqual(results[0], results[1])
+        self.assertLessEqual(max(ele.bound for row in results[1] for ele in row), 3328)
+
+    def test_equal_mod_q(self):
+        R = self.R_lazy
+        f = R([1]) - R([5])
+        self.assertEqual(f.coeffs[0], -4) # Not reduced
+        self.assertEqual(f, R([3325]))
+        self.assertEqual(f, 3325)
+        self.assertEqual(f, -4)
+        self.assertEqual(R([3329, 6658 + 7]), R([0, 7]))
+        self.assertNotEqual(f, R([3326]))
+        self.assertEqual(Kyber512.R([1]) - Kyber512.R([5]), Kyber512.R([3325]))
+
+    def test_operands_not_modified(self):
+        R = self.R_lazy
+        big = R([2**30 + 5]*256) # Bound above LAZY_BOUND // 2
+        coeffs, bound = big.coeffs.tolist(), big.bound
+        f = R([1, 2, 3])
+        self.assertEqual(f + big, big + 1 + R([0, 2, 3]))
+        self.assertEqual(f.copy().isub_(big), R([1, 2, 3]) - big.copy().reduce_coefficents())
+        self.assertEqual(big.coeffs.tolist(), coeffs)
+        self.assertEqual(big.bound, bound)
+        self.assertEqual(f + big.freeze(), f + R(coeffs))
+
+class TestNTTMatvec(unittest.TestCase):
+    """
+    The fused multiply-accumulate must agree with A @ v modulo q.
+    """
+    def test_ntt_matvec(self):
+        for helper in (NTTHelperKyber, NTTHelperKyberNumpy):
+            R = PolynomialRing(3329, 256, ntt_helper=helper)
+            M = Module(R)
+            A = M([[R.random_element(is_ntt=True) for _ in range(3)] for _ in range(2)])
+            v = M([R.random_element(is_ntt=True) for _ in range(3)]).transpose()
+            self.assertEqual(A.ntt_matvec(v), (A @ v).reduce_coefficents())
+
+class TestMatrixCache(unittest.TestCase):
+    """
+    LRU cache of the expanded matrix A
+    """
+    def test_matrix_cache(self):
+        kyber = Kyber(DEFAULT_PARAMETERS["kyber_512"], matrix_cache_size=2)
+        rho_1, rho_2, rho_3 = os.urandom(32), os.urandom(32), os.urandom(32)
+        A = kyber._generate_matrix_from_seed(rho_1, transpose=True, is_ntt=True)
+        self.assertIs(kyber._generate_matrix_from_seed(rho_1, transpose=True, is_ntt=True), A)
+        self.assertEqual((kyber.matrix_cache_hits, kyber.matrix_cache_misses), (1, 1))
+
+        # Keygen matrices are not cached, and rho_1 is evicted by rho_3
+        kyber._generate_matrix_from_seed(rho_1, is_ntt=True)
+        kyber.keygen()
+        kyber.keygen_batch(2)
+        self.assertEqual((len(kyber.matrix_cache), kyber.matrix_cache_misses), (1, 1))
+        kyber._generate_matrix_from_seed(rho_2, transpose=True, is_ntt=True)
+        kyber._generate_matrix_from_seed(rho_3, transpose=True, is_ntt=True)
+        self.assertEqual(len(kyber.matrix_cache), 2)
+        self.assertIsNot(kyber._generate_matrix_from_seed(rho_1, transpose=True, is_ntt=True), A)
+
+        # Cached matrices are read-only and equal to an uncached expansion
+        uncached = Kyber(DEFAULT_PARAMETERS["kyber_512"], matrix_cache_size=0)
+        self.assertEqual(uncached._generate_matrix_from_seed(rho_1, transpose=True, is_ntt=True), A)
+        self.assertEqual(len(uncached.matrix_cache), 0)
+        with self.assertRaises(ValueError):
+            A[0][0].coeffs += 1
+        with self.assertRaises(ValueError):
+            A.transpose_self()
+        with self.assertRaises(TypeError):
+            A[0][0] = A[0][1]
+        with self.assertRaises(AttributeError):
+            A[0][0].is_ntt = False
+        self.assertEqual(A[0][0].copy() + 1, A[0][0] + 1)
+
+    def test_matrix_cache_threads(self):
+        kyber = Kyber(DEFAULT_PARAMETERS["kyber_512"], matrix_cache_size=2)
+        rhos = [os.urandom(32) for _ in range(3)]
+        with ThreadPoolExecutor(4) as pool:
+            matrices = list(pool.map(lambda i: kyber._generate_matrix_from_seed(rhos[i % 3], transpose=True, is_ntt=True), range(60)))
+        self.assertEqual(kyber.matrix_cache_hits + kyber.matrix_cache_misses, 60)
+        self.assertLessEqual(len(kyber.matrix_cache), 2)
+        for i, A in enumerate(matrices):
+            self.assertEqual(A, matrices[i % 3])
+
+class TestBitPacking(unittest.TestCase):
+    """
+    The NumPy packers must give the same bytes as the
+    bit string reference.
+    """
+    def test_pack_unpack(self):
+        for l in (1, 4, 5, 10, 11, 12):
+            coeffs = [random.randint(0, 2**l - 1) for _ in range(3*256)]
+            bit_string = ''.join(format(c, f'0{l}b')[::-1] for c in coeffs)
+            packed = pack_bits(coeffs, l)
+            self.assertEqual(packed, bitstring_to_bytes(bit_string))
+            self.assertEqual(unpack_bits(packed, l).tolist(), coeffs)
+
+    def test_module_encode_decode(self):
+        R = PolynomialRing(3329, 256, ntt_helper=NTTHelperKyberNumpy)
+        M = Module(R)
+        v = M([R.random_element() for _ in range(3)]).transpose()
+        encoded = b"".join(ele.encode(l=12) for row in v for ele in row)
+        self.assertEqual(v.encode(l=12), encoded)
+        self.assertEqual(M.decode(encoded, 3, 1, l=12), v)
+
+class TestCompress(unittest.TestCase):
+    """
+    The integer compress/decompress must match the
+    FixedPoint hardware model.
+    """
+    def test_compress_matches_hw_model(self):
+        R = PolynomialRing(3329, 256)
+        for d in (1, 4, 5, 10, 11):
+            f = R(list(range(256*(d % 13), 256*(d % 13) + 256)))
+            self.assertEqual(f.copy().compress(d).coeffs.tolist(), hw_compress(f.coeffs.tolist(), d, 3329))
+            g = R([random.randint(0, 2**d - 1) for _ in range(256)])
+            self.assertEqual(g.copy().decompress(d).coeffs.tolist(), hw_decompress(g.coeffs.tolist(), d, 3329))
+
+    def test_hw_verification_switch(self):
+        set_hw_verification(True)
+        try:
+            for Kyber in (Kyber512, Kyber1024):
+                pk, sk = Kyber.keygen()
+                c, key = Kyber.enc(pk)
+                self.assertEqual(key, Kyber.dec(c, sk))
+        finally:
+            set_hw_verification(False)
+
+class TestParse(unittest.TestCase):
+    """
+    Vectorised parse against the byte-by-byte reference,
+    including a stream that needs more XOF output.
+    """
+    R = PolynomialRing(3329, 256)
+
+    @staticmethod
+    def reference_parse(input_bytes, q=3329, n=256):
+        i, coefficients = 0, []
+        while len(coefficients) < n:
+            d1 = input_bytes[i] + 256*(input_bytes[i+1] % 16)
+            d2 = (input_bytes[i+1] // 16) + 16*input_bytes[i+2]
+            if d1 < q:
+                coefficients.append(d1)
+            if d2 < q and len(coefficients) < n:
+                coefficients.append(d2)
+            i = i + 3
+        return coefficients
+
+    def test_parse(self):
+        input_bytes = shake_128(os.urandom(34)).digest(768)
+        self.assertEqual(self.R.parse(input_bytes).coeffs.tolist(), self.reference_parse(input_bytes))
+
+    def test_parse_squeezes_more(self):
+        # Only d2 of every 3 bytes is below q, so 768 bytes give 256 of 512 coefficients
+        stream = bytes([0xff, 0xff, 0x00]) * 1000
+        R = PolynomialRing(3329, 512)
+        with self.assertRaises(ValueError):
+            R.parse(stream[:768])
+        f = R.parse(stream[:768], xof=io.BytesIO(stream[768:]).read)
+        self.assertEqual(f.coeffs.tolist(), self.reference_parse(stream, n=512))
+
+    def test_parse_from_sponge(self):
+        sponge = SHAKE128Sponge().absorb(bytes(34))
+        f = self.R.parse(sponge.squeeze(168), xof=sponge.squeeze)
+        self.assertEqual(f.coeffs.tolist(), self.reference_parse(shake_128(bytes(34)).digest(3*168)))
+
+class TestCBD(unittest.TestCase):
+    """
+    Table lookup / bit-sum CBD against the bit-by-bit reference
+    """
+    R = PolynomialRing(3329, 256)
+
+    @staticmethod
+    def reference_cbd(input_bytes, eta, n=256):
+        list_of_bits = bytes_to_bits(input_bytes)
+        return [sum(list_of_bits[2*i*eta + j] for j in range(eta)) - sum(list_of_bits[2*i*eta + eta + j] for j in range(eta))
+                for i in range(n)]
+
+    def test_cbd(self):
+        for eta in (1, 2, 3, 4):
+            input_bytes = os.urandom(64*eta)
+            self.assertEqual(self.R.cbd(input_bytes, eta).coeffs.tolist(), self.reference_cbd(input_bytes, eta))
+
+    def test_cbd_batch(self):
+        for eta in (2, 3):
+            list_of_input_bytes = [os.urandom(64*eta) for _ in range(4)]
+            polys = self.R.cbd_batch(list_of_input_bytes, eta)
+            self.assertEqual([f.coeffs.tolist() for f in polys], [self.reference_cbd(b, eta) for b in list_of_input_bytes])
+
+class TestNTTHelperNumpy(unittest.TestCase):
+    """
+    The vectorised NTT must agree coefficient for
+    coefficient with the scalar reference helper.
+    """
+    R_ref = PolynomialRing(3329, 256, ntt_helper=NTTHelperKyber)
+    R_np = PolynomialRing(3329, 256, ntt_helper=NTTHelperKyberNumpy)
+
+    def random_pair(self, low=0, high=3328):
+        coeffs = [random.randint(low, high) for _ in range(256)]
+        return self.R_ref(coeffs), self.R_np(coeffs.copy())
+
+    def test_to_ntt(self):
+        for low, high in [(0, 3328), (-3, 3)]:
+            f, g = self.random_pair(low, high)
+            self.assertEqual(f.to_ntt(), g.to_ntt())
+
+    def test_from_ntt(self):
+        f, g = self.random_pair()
+        f.is_ntt = g.is_ntt = True
+        self.assertEqual(f.from_ntt(), g.from_ntt())
+
+    def test_ntt_multiplication(self):
+        f, g = self.random_pair()
+        a, b = self.random_pair()
+        for x in (f, g, a, b):
+            x.is_ntt = True
+        self.assertEqual(f * a, g * b)
+        self.assertEqual(f.to_montgomery(), g.to_montgomery())
+
+    def test_batched_ntt(self):
+        block = [[[random.randint(0, 3328) for _ in range(256)] for _ in range(3)] for _ in range(3)]
+        ntt_block = NTTHelperKyberNumpy.ntt(block)
+        intt_block = NTTHelperKyberNumpy.intt(ntt_block)
+        for i in range(3):
+            for j in range(3):
+                f = self.R_ref(block[i][j].copy()).to_ntt()
+                self.assertEqual(f.coeffs.tolist(), ntt_block[i][j].tolist())
+                self.assertEqual(f.from_ntt().coeffs.tolist(), intt_block[i][j].tolist())
                 
 # class TestKyberDeterministic(unittest.TestCase):
 #     """
@@ -104,62 +756,103 @@ class TestKyber(unittest.TestCase):
 #         self.generic_test_kyber_deterministic(Kyber1024, 5)
         
 
-# class TestKnownTestValuesDRBG(unittest.TestCase):
-#     """
-#     We know how the seeds for the KAT are generated, so
-#     let's check against our own implementation.
+class TestKnownTestValuesDRBG(unittest.TestCase):
+    """
+    We know how the seeds for the KAT are generated, so
+    let's check against our own implementation.
     
-#     We only need to test one file, as the seeds are the 
-#     same across the three files.
-#     """
-#     def test_kyber512_known_answer_seed(self):
-#         # Set DRBG to generate seeds
-#         entropy_input = bytes([i for i in range(48)])
-#         rng = AES256_CTR_DRBG(entropy_input)
+    We only need to test one file, as the seeds are the 
+    same across the three files.
+    """
+    def test_kyber512_known_answer_seed(self):
+        # Set DRBG to generate seeds
+        entropy_input = bytes([i for i in range(48)])
+        rng = AES256_CTR_DRBG(entropy_input)
         
-#         with open("assets/PQCkemKAT_1632.rsp") as f:
-#             # extract data from KAT
-#             kat_data_512 = f.read()
-#             parsed_data = parse_kat_data(kat_data_512)
-#             # Check all seeds match
-#             for data in parsed_data.values():
-#                 seed = data["seed"]
-#                 self.assertEqual(seed, rng.random_bytes(48))
+        with open("assets/PQCkemKAT_1632.rsp") as f:
+            # extract data from KAT
+            kat_data_512 = f.read()
+            parsed_data = parse_kat_data(kat_data_512)
+            # Check all seeds match
+            for data in parsed_data.values():
+                seed = data["seed"]
+                self.assertEqual(seed, rng.random_bytes(48))
+
+class TestDRBG(unittest.TestCase):
+    """
+    Bulk keystream against one AES block per counter value
+    """
+    @staticmethod
+    def reference_keystream(key, V, num_bytes):
+        cipher = AES.new(key, AES.MODE_ECB)
+        V = int.from_bytes(V, "big")
+        return b"".join(cipher.encrypt(((V + i) % 2**128).to_bytes(16, "big")) for i in range(1, num_bytes // 16 + 2))[:num_bytes]
+
+    def test_keystream(self):
+        for V in (bytes(16), bytes([255])*15 + bytes([250])): # Wraps around 2^128 inside the request
+            for num_bytes in (32, 1040, 5000): # ECB counter buffer and CTR mode
+                rng = AES256_CTR_DRBG(bytes(48))
+                rng.V = V
+                expected = self.reference_keystream(rng.key, V, num_bytes)
+                self.assertEqual(rng.random_bytes(num_bytes), expected)
+
+    def test_buffered(self):
+        rng, buffered = AES256_CTR_DRBG(bytes(48)), AES256_CTR_DRBG(bytes(48), buffer_size=256)
+        self.assertEqual(b"".join(buffered.random_bytes(32) for _ in range(16)), rng.random_bytes(256) + rng.random_bytes(256))
+        with self.assertRaises(ValueError):
+            AES256_CTR_DRBG(bytes(48), buffer_size=2**17)
+
+    def test_buffered_kyber(self):
+        # Buffering keeps the KEM correct but leaves the KAT stream after the first request,
+        # TestKnownTestValues covers the unbuffered one
+        with open("assets/PQCkemKAT_1632.rsp") as f:
+            seed, pk, sk, ct, ss = next(iter(parse_kat_data(f.read()).values())).values()
+        kyber = Kyber(DEFAULT_PARAMETERS["kyber_512"])
+        kyber.set_drbg_seed(seed, buffer_size=1024)
+        _pk, _sk = kyber.keygen()
+        self.assertEqual(_pk, pk)
+        self.assertNotEqual(_sk, sk) # z comes from the buffer, not a second generate call
+        _ct, _ss = kyber.enc(_pk)
+        self.assertEqual(kyber.dec(_ct, _sk), _ss)
     
-# class TestKnownTestValues(unittest.TestCase): 
-#     def generic_test_kyber_known_answer(self, Kyber, filename):
-#         with open(filename) as f:
-#             kat_data = f.read()
-#             parsed_data = parse_kat_data(kat_data)
-            
-#             for data in parsed_data.values():
-#                 seed, pk, sk, ct, ss = data.values()
-                
-#                 # Seed DRBG with KAT seed
-#                 Kyber.set_drbg_seed(seed)
-                
-#                 # Assert keygen matches
-#                 _pk, _sk = Kyber.keygen()
-#                 self.assertEqual(pk, _pk)
-#                 self.assertEqual(sk, _sk)
-                
-#                 # Assert encapsulation matches
-#                 _ct, _ss = Kyber.enc(_pk)
-#                 self.assertEqual(ct, _ct)
-#                 self.assertEqual(ss, _ss)
-                
-#                 # Assert decapsulation matches
-#                 __ss = Kyber.dec(ct, sk)
-#                 self.assertEqual(ss, __ss)
-                
-#     def test_kyber512_known_answer(self):
-#         return self.generic_test_kyber_known_answer(Kyber512, "assets/PQCkemKAT_1632.rsp")
-        
-#     def test_kyber768_known_answer(self):
-#         return self.generic_test_kyber_known_answer(Kyber768, "assets/PQCkemKAT_2400.rsp")
-        
-#     def test_kyber1024_known_answer(self):
-#         return self.generic_test_kyber_known_answer(Kyber1024, "assets/PQCkemKAT_3168.rsp")
+class TestKnownTestValues(unittest.TestCase):
+    """
+    Keygen, encapsulation and decapsulation against the
+    KAT files, seeded by the AES256 CTR DRBG.
+    """
+    def generic_test_kyber_known_answer(self, Kyber, filename):
+        with open(filename) as f:
+            kat_data = f.read()
+            parsed_data = parse_kat_data(kat_data)
+
+            for data in parsed_data.values():
+                seed, pk, sk, ct, ss = data.values()
+
+                # Seed DRBG with KAT seed
+                Kyber.set_drbg_seed(seed)
+
+                # Assert keygen matches
+                _pk, _sk = Kyber.keygen()
+                self.assertEqual(pk, _pk)
+                self.assertEqual(sk, _sk)
+
+                # Assert encapsulation matches
+                _ct, _ss = Kyber.enc(_pk)
+                self.assertEqual(ct, _ct)
+                self.assertEqual(ss, _ss)
+
+                # Assert decapsulation matches
+                __ss = Kyber.dec(ct, sk)
+                self.assertEqual(ss, __ss)
+
+    def test_kyber512_known_answer(self):
+        return self.generic_test_kyber_known_answer(Kyber512, "assets/PQCkemKAT_1632.rsp")
+
+    def test_kyber768_known_answer(self):
+        return self.generic_test_kyber_known_answer(Kyber768, "assets/PQCkemKAT_2400.rsp")
+
+    def test_kyber1024_known_answer(self):
+        return self.generic_test_kyber_known_answer(Kyber1024, "assets/PQCkemKAT_3168.rsp")
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,59 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Traced stages:
+#   kyber  : start of keygen / enc / dec (the old banners)
+#   ntt    : layers, butterfly groups and butterflies of the scalar NTT, forward and
+#            inverse layers of the vectorised NTTHelperNumpy (its butterflies run as one
+#            NumPy operation per layer, so it has no group / butterfly events)
+#   keccak : mode and the FETCH/ABSB/PADD/SQUZ phases of CompactFIPS202.KeccakSponge
+STAGES = ("kyber", "ntt", "keccak")
+
+# Active hooks by stage of the current thread / asyncio task, a dict that is
+# replaced, never modified. None by default, so tracing is off and a traced
+# function only pays for one lookup per call.
+TRACE_HOOKS = ContextVar("trace_hooks", default=None)
+
+def print_trace(stage, event, **fields):
+    """
+    Default hook: one line per event, in the format of the old prints
+    """
+    print(f"[{stage}:{event}] " + ", ".join(f"{key}={value}" for key, value in fields.items()))
+
+def set_trace_hook(stage, hook=print_trace):
+    """
+    Call `hook(stage, event, **fields)` for every event of `stage` in
+    the current context, a hook of None switches the stage off
+    """
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage {stage}, expected one of {STAGES}")
+    hooks = dict(TRACE_HOOKS.get() or {})
+    if hook is None:
+        hooks.pop(stage, None)
+    else:
+        hooks[stage] = hook
+    TRACE_HOOKS.set(hooks or None)
+
+def get_trace_hook(stage):
+    """
+    The hook of `stage`, None when it is not traced
+    """
+    hooks = TRACE_HOOKS.get()
+    return hooks.get(stage) if hooks else None
+
+@contextmanager
+def tracing(stages=STAGES, hook=print_trace):
+    """
+    Trace `stages` with `hook` inside the block, e.g.
+
+        with tracing(["keccak"]):
+            SHAKE128(b"", 32)
+    """
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}, expected some of {STAGES}")
+    token = TRACE_HOOKS.set({**(TRACE_HOOKS.get() or {}), **{stage: hook for stage in stages}})
+    try:
+        yield
+    finally:
+        TRACE_HOOKS.reset(token)
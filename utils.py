@@ -1,3 +1,5 @@
+import numpy as np
+
 def bytes_to_bits(input_bytes):
     """
     Convert bytes to an array of bits
@@ -14,6 +16,29 @@ def bitstring_to_bytes(s):
     """
     return bytes([int(s[i:i+8][::-1], 2) for i in range(0, len(s), 8)])
     
+def pack_bits(coeffs, l):
+    """
+    Pack integers in [0, 2^l) into bytes, l bits each,
+    with the same little endian bit order as
+    `bitstring_to_bytes` on reversed binary strings
+    """
+    coeffs = np.asarray(coeffs, dtype=np.int64).reshape(-1)
+    if coeffs.size and (coeffs.min() < 0 or coeffs.max() >> l):
+        raise ValueError(f"Coefficients must lie in [0, 2^{l})")
+    bits = ((coeffs[:, None] >> np.arange(l)) & 1).astype(np.uint8)
+
+    return np.packbits(bits, bitorder='little').tobytes()
+
+def unpack_bits(input_bytes, l):
+    """
+    Inverse of `pack_bits`: read consecutive l bit little
+    endian integers from bytes, as an int64 array
+    """
+    bits = np.unpackbits(np.frombuffer(input_bytes, dtype=np.uint8), bitorder='little')
+    bits = bits.reshape(-1, l).astype(np.int64)
+
+    return bits @ (1 << np.arange(l, dtype=np.int64))
+
 def round_up(x):
     """
     Round x.5 up always
@@ -25,4 +50,4 @@ def xor_bytes(a, b):
     XOR two byte arrays, assume that they are 
     of the same length
     """
-    return bytes(a^b for a,b in zip(a,b))
\ No newline at end of file
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
\ No newline at end of file
@@ -0,0 +1,144 @@
+import os
+from contextvars import ContextVar
+
+# Number of vectors each testbench reads, the `NVEC defines of rtl/*_tb.v
+NVEC = {
+    "cbd"         : 500,
+    "compress"    : 100,
+    "decode"      : 100,
+    "decompress"  : 10,
+    "encode"      : 88,
+    "keccak"      : 500,
+    "keccakf1600" : 10,
+    "parse"       : 160,
+}
+
+# The VectorWriter of the current thread / asyncio task, None when no vectors are written
+ACTIVE_WRITER = ContextVar("active_vector_writer", default=None)
+
+def concat_fields(values, width):
+    """
+    `values` as one integer of `width` bit fields, the first value
+    in the most significant field, negative values in two's complement
+    """
+    mask = (1 << width) - 1
+    out = 0
+    for value in values:
+        out = (out << width) | (int(value) & mask)
+    return out
+
+def vector_writer(module):
+    """
+    The active VectorWriter if it still wants vectors of `module`,
+    else None. Stages call this once and only build their vector
+    when it is not None.
+    """
+    writer = ACTIVE_WRITER.get()
+    if writer is not None and writer.wants(module):
+        return writer
+    return None
+
+class VectorWriter:
+    """
+    Writes `$readmemh` test vectors to <root>/<module>/<field>.vec,
+    one hex line per vector and field.
+
+    Lines are buffered in memory and written in bulk every
+    `buffer_lines` lines and on `flush`/`close`, directories are
+    created once. `nvec` caps the vectors per module: a dict by module
+    (NVEC by default, modules not in it are uncapped), one int for all
+    modules or None. `modules` restricts the written modules.
+    Existing files are truncated unless `append` is set.
+
+    Used as a context manager it is the active writer inside the
+    block, so the traced stages write their vectors to it:
+
+        with VectorWriter("./vec", modules=["keccak"]):
+            SHAKE128(b"", 32)
+    """
+    def __init__(self, root="./vec", nvec=NVEC, modules=None, append=False, buffer_lines=4096):
+        self.root = root
+        self.nvec = nvec
+        self.modules = None if modules is None else frozenset(modules)
+        self.append = append
+        self.buffer_lines = buffer_lines
+        self.counts = {} # Vectors accepted per module
+        self.buffers = {} # (module, field) -> buffered lines
+        self.buffered = 0
+        self.opened = set() # Files written by this writer, appended to from then on
+        self.tokens = []
+
+    def __enter__(self):
+        self.tokens.append(ACTIVE_WRITER.set(self))
+        return self
+
+    def __exit__(self, *exc):
+        ACTIVE_WRITER.reset(self.tokens.pop())
+        self.close()
+
+    def cap(self, module):
+        if isinstance(self.nvec, dict):
+            return self.nvec.get(module)
+        return self.nvec
+
+    def wants(self, module):
+        """
+        True if `module` is written and below its cap
+        """
+        if self.modules is not None and module not in self.modules:
+            return False
+        cap = self.cap(module)
+        return cap is None or self.counts.get(module, 0) < cap
+
+    def write(self, module, fields, hex_digits):
+        """
+        Buffer one vector: every field value as a line of at least
+        `hex_digits` hex digits. Returns False if the vector was
+        dropped because of `modules` or the cap.
+        """
+        if not self.wants(module):
+            return False
+        self.counts[module] = self.counts.get(module, 0) + 1
+        for field, value in fields.items():
+            self.buffers.setdefault((module, field), []).append(format(value, "x").rjust(hex_digits, "0") + "\n")
+        self.buffered += len(fields)
+        if self.buffered >= self.buffer_lines:
+            self.flush()
+        return True
+
+    def flush(self):
+        for (module, field), lines in self.buffers.items():
+            if not lines:
+                continue
+            path = os.path.join(self.root, module, f"{field}.vec")
+            if path not in self.opened:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a" if self.append or path in self.opened else "w") as fh:
+                fh.write("".join(lines))
+            self.opened.add(path)
+            lines.clear()
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+
+class VectorCollector(VectorWriter):
+    """
+    A VectorWriter that keeps the vectors in memory instead of
+    writing files, e.g. in worker processes. `vectors[module]`
+    lists (fields, hex_digits) in write order, ready to be
+    replayed into a VectorWriter.
+    """
+    def __init__(self, nvec=NVEC, modules=None):
+        super().__init__(root=None, nvec=nvec, modules=modules)
+        self.vectors = {}
+
+    def write(self, module, fields, hex_digits):
+        if not self.wants(module):
+            return False
+        self.counts[module] = self.counts.get(module, 0) + 1
+        self.vectors.setdefault(module, []).append((dict(fields), hex_digits))
+        return True
+
+    def flush(self):
+        pass